@@ -1,6 +1,16 @@
+import os
+import sys
+
 from tinydb import TinyDB
 
-db = TinyDB("db.json", indent=2, encoding="utf-8", ensure_ascii=False)
+from core_query import db_file
+
+db_path = db_file("polaris_profile")
+if not os.path.exists(db_path):
+    print(f"Error: {db_path} not found.")
+    sys.exit(1)
+
+db = TinyDB(db_path, indent=2, encoding="utf-8", ensure_ascii=False)
 table = db.table("polaris_profile")
 print(f"Before cleanup: {len(table.all())} profiles.")
 table.truncate()
@@ -18,6 +18,65 @@ ip = get_ip()
 port = 8000
 response_compression = False
 verbose_log = True
+# answer binary kbin requests with binary kbin (see core_common.response_encodings)
+binary_response = True
+
+# payloads larger than this (bytes) are encoded/decoded off the event loop
+codec_offload_size = 32 * 1024
+codec_workers = 2
+
+# server processes; more than 1 shares lobby/PASELI state through state_file
+# and serializes database access between processes
+workers = 1
+state_file = "state.db"
+
+# "tinydb" keeps everything in db.json, "sqlite" uses sqlite_file
+# (convert an existing db.json with utils/db/migrate_db_to_sqlite.py first)
+db_backend = "tinydb"
+sqlite_file = "db.sqlite3"
+
+# with one worker, keep db.json in memory and write it every
+# db_flush_interval seconds or db_flush_writes writes, whichever comes first
+# (0 writes it on every change); a crash loses at most that window
+# db.json is only read at start, so stop the server before running the
+# scripts in utils/ and utils/db/ that edit it
+db_write_behind = True
+db_flush_interval = 5
+db_flush_writes = 200
+# per shard (interval, writes) overrides; PASELI balances are written at once
+db_flush_policy = {"core": (0, 1)}
+
+# with the tinydb backend, one file per game under db_dir (iidx.json,
+# ddr.json, ..., core.json for shop/paseli) instead of a single db.json;
+# an existing db.json is merged into the shards on start and kept as
+# db.json.unsharded (shard files are backed up first); start-up stops if it
+# holds a table that already has different documents in its shard
+db_shards = True
+db_dir = "db"
+
+# threads running get_async_db() calls off the event loop; tables of
+# different shards are read and written in parallel
+db_threads = 4
+
+# with the tinydb backend, keep score history (iidx_scores, ddr_scores, ...)
+# in append-only segments under journal_dir instead of db.json
+score_journal = True
+journal_dir = "scores"
+journal_segment_size = 4 * 1024 * 1024
+
+# the web API (/iidx, /ddr, /gfdm) reads copies of the tables refreshed
+# once they are older than this many seconds
+api_snapshot_max_age = 30
+
+# IIDX result screen ranklist: the top iidx_ranklist_top players plus the
+# iidx_ranklist_around players either side of the player; 0 sends everyone
+iidx_ranklist_top = 0
+iidx_ranklist_around = 5
+
+# store new IIDX/DDR ghosts as files under blob_dir, referenced from the
+# score rows, instead of inline hex
+ghost_blobs = True
+blob_dir = "blobs"
 
 arcade = "Ｍ０ＮＫＹＢＵＳ１Ｎ３Ｚ"
 paseli = 10000
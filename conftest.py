@@ -0,0 +1,12 @@
+import pytest
+
+import core_database
+from testing_db import make_db
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """An empty in-memory database in place of core_database.db."""
+    db = make_db()
+    monkeypatch.setattr(core_database, "db", db)
+    return db
@@ -0,0 +1,78 @@
+import config
+
+import hashlib
+import mmap
+import os
+
+
+# Ghosts are kept out of the score rows: the row holds "blob:<sha256>" and
+# the bytes live in blob_dir/<first two hex digits>/<sha256>. The same
+# ghost stored twice (history row and best row) is one file. Rows written
+# before this keep their inline value, load_ghost() accepts both.
+
+BLOB_PREFIX = "blob:"
+
+
+class BlobStore:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def __contains__(self, key):
+        return os.path.exists(self._path(key))
+
+    def put(self, data):
+        key = hashlib.sha256(data).hexdigest()
+        path = self._path(key)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temp = f"{path}.{os.getpid()}.tmp"
+            with open(temp, "wb") as fp:
+                fp.write(data)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp, path)
+        return key
+
+    def get(self, key):
+        with open(self._path(key), "rb") as fp:
+            if not os.fstat(fp.fileno()).st_size:
+                return b""
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return mm[:]
+
+
+blobs = BlobStore(config.blob_dir)
+
+
+def get_blobs():
+    return blobs
+
+
+def store_ghost(value, binary=True):
+    """Store a ghost given as hex (kbin "bin") or, with binary=False, as
+    text, and return the reference to keep in the row instead."""
+    if not value or not config.ghost_blobs or value.startswith(BLOB_PREFIX):
+        return value
+    data = bytes.fromhex(value) if binary else value.encode("utf-8")
+    return BLOB_PREFIX + blobs.put(data)
+
+
+def load_ghost(value, binary=True):
+    """Inverse of store_ghost(), inline values are returned as they are."""
+    if not isinstance(value, str) or not value.startswith(BLOB_PREFIX):
+        return value
+    data = blobs.get(value[len(BLOB_PREFIX) :])
+    return data.hex() if binary else data.decode("utf-8")
+
+
+def load_ghosts(documents, binary=True):
+    """Copies of score rows with their ghost and ghost_gauge references
+    replaced by the ghosts, for the web API."""
+    fields = ("ghost", "ghost_gauge")
+    return [
+        {k: load_ghost(v, binary) if k in fields else v for k, v in document.items()}
+        for document in documents
+    ]
@@ -1,7 +1,13 @@
 import config
 
+import asyncio
+import threading
 import time
 
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 from lxml.builder import ElementMaker
 
 from kbinxml import KBinXML
@@ -56,91 +62,211 @@ E = ElementMaker(
 )
 
 
+# Game code -> family, profile table and (ext date code, version) pairs in
+# ascending order. A request older than the first pair has no version (None),
+# unknown codes are version 0. Adding a release is one new pair here.
+games = {
+    "JDZ": {"family": "iidx", "profile_table": "iidx_profile", "versions": ((0, 18),)},
+    "KDZ": {"family": "iidx", "profile_table": "iidx_profile", "versions": ((0, 19),)},
+    "LDJ": {
+        "family": "iidx",
+        "profile_table": "iidx_profile",
+        "versions": (
+            (2012010100, 20),
+            (2013100200, 21),
+            (2014091700, 22),
+            (2015111100, 23),
+            (2016102400, 24),
+            (2017122100, 25),
+            (2018110700, 26),
+            (2019101600, 27),
+            # TODO: Consolidate IIDX modules to easily support versions 21-28 (probably never)
+            (2020102800, 28),
+            (2021101300, 29),
+            (2022101700, 30),
+            (2023101800, 31),
+            (2024100900, 32),
+            (2025091700, 33),
+        ),
+    },
+    "M32": {
+        "family": "gitadora",
+        "profile_table": "gitadora_profile",
+        "versions": (
+            # TODO: Support versions 1-5 (never)
+            (2013012400, 1),
+            (2014021400, 2),
+            (2015042100, 3),
+            (2017011800, 4),
+            (2017090600, 5),
+            (2018072700, 6),
+            (2019100200, 7),
+            (2021042100, 8),
+            (2022121400, 9),
+            (2024031300, 10),
+        ),
+    },
+    "MDX": {
+        "family": "ddr",
+        "profile_table": "ddr_profile",
+        "versions": ((2019022600, 19),),  # ???
+    },
+    "KFC": {
+        "family": "sdvx",
+        "profile_table": "sdvx_profile",
+        "versions": ((2020090402, 6),),  # ???
+    },
+    # TODO: ???
+    "PAN": {"family": "nostalgia", "profile_table": "nostalgia_profile", "versions": ((0, 0),)},
+    "REC": {"family": "drs", "profile_table": "dancerush_profile", "versions": ((0, 1),)},
+    "LAV": {"family": "polaris", "profile_table": "polaris_profile", "versions": ((0, 0),)},
+    "XIF": {"family": "polaris", "profile_table": "polaris_profile", "versions": ((0, 1),)},
+}
+
+_version_thresholds = {
+    model: [ext for ext, _ in game["versions"]] for model, game in games.items()
+}
+
+
+def game_models(family, min_version=None, max_version=None):
+    # Model codes of a family with any version in [min_version, max_version]
+    models = []
+    for model, game in games.items():
+        if game["family"] != family:
+            continue
+        versions = [version for _, version in game["versions"]]
+        if min_version is not None and max(versions) < min_version:
+            continue
+        if max_version is not None and min(versions) > max_version:
+            continue
+        models.append(model)
+
+    return models
+
+
+@lru_cache(maxsize=1024)
+def get_game_version(model, ext):
+    if model not in games:
+        return 0
+
+    idx = bisect_right(_version_thresholds[model], int(ext)) - 1
+    if idx < 0:
+        return None
+
+    return games[model]["versions"][idx][1]
+
+
 async def core_get_game_version_from_software_version(software_version):
     _, model, dest, spec, rev, ext = software_version
-    ext = int(ext)
-
-    if model == "LDJ":
-        if ext >= 2025091700:
-            return 33
-        elif ext >= 2024100900:
-            return 32
-        elif ext >= 2023101800:
-            return 31
-        elif ext >= 2022101700:
-            return 30
-        elif ext >= 2021101300:
-            return 29
-        # TODO: Consolidate IIDX modules to easily support versions 21-28 (probably never)
-        elif ext >= 2020102800:
-            return 28
-        elif ext >= 2019101600:
-            return 27
-        elif ext >= 2018110700:
-            return 26
-        elif ext >= 2017122100:
-            return 25
-        elif ext >= 2016102400:
-            return 24
-        elif ext >= 2015111100:
-            return 23
-        elif ext >= 2014091700:
-            return 22
-        elif ext >= 2013100200:
-            return 21
-        elif ext >= 2012010100:
-            return 20
-    elif model == "KDZ":
-        return 19
-    elif model == "JDZ":
-        return 18
-
-    elif model == "M32":
-        if ext >= 2024031300:
-            return 10
-        elif ext >= 2022121400:
-            return 9
-        elif ext >= 2021042100:
-            return 8
-        elif ext >= 2019100200:
-            return 7
-        elif ext >= 2018072700:
-            return 6
-        # TODO: Support versions 1-5 (never)
-        elif ext >= 2017090600:
-            return 5
-        elif ext >= 2017011800:
-            return 4
-        elif ext >= 2015042100:
-            return 3
-        elif ext >= 2014021400:
-            return 2
-        elif ext >= 2013012400:
-            return 1
-
-    elif model == "MDX":
-        if ext >= 2019022600:  # ???
-            return 19
-
-    elif model == "KFC":
-        if ext >= 2020090402:  # ???
-            return 6
-
-    elif model == "REC":
-        return 1
-
-    elif model == "XIF":
-        return 1
 
-    # TODO: ???
-    # elif model == "PAN":
-    #     return 0
+    return get_game_version(model, ext)
+
+
+codec_executor = ThreadPoolExecutor(
+    max_workers=config.codec_workers, thread_name_prefix="codec"
+)
+
+# stage -> [count, total seconds, max seconds], updated from the codec
+# threads and the event loop alike
+codec_stats = {}
+codec_stats_lock = threading.Lock()
+
+
+def _record_stage(timings, stage, start):
+    elapsed = time.perf_counter() - start
+    timings[stage] = elapsed
+
+    with codec_stats_lock:
+        stat = codec_stats.setdefault(stage, [0, 0.0, 0.0])
+        stat[0] += 1
+        stat[1] += elapsed
+        stat[2] = max(stat[2], elapsed)
+
+    return time.perf_counter()
+
+
+def get_codec_stats():
+    with codec_stats_lock:
+        stats = {stage: tuple(stat) for stage, stat in codec_stats.items()}
+    return {
+        stage: {
+            "count": count,
+            "avg_ms": round(total / count * 1000, 3),
+            "max_ms": round(maximum * 1000, 3),
+        }
+        for stage, (count, total, maximum) in stats.items()
+    }
+
+
+async def _run_codec(size, func, *args):
+    # Small payloads are cheaper to handle inline than to hand off
+    if size < config.codec_offload_size:
+        return func(*args)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(codec_executor, func, *args)
+
 
+def _decode_request(data, compress, eamuse_info, timings):
+    start = time.perf_counter()
+
+    if eamuse_info is not None:
+        version, unix_time, prng = eamuse_info.split("-")
+        xml_dec = EamuseARC4(bytes.fromhex(unix_time), bytes.fromhex(prng)).decrypt(data)
+        start = _record_stage(timings, "decrypt", start)
     else:
-        return 0
+        xml_dec = data
+
+    if compress == "lz77":
+        # lz77 payloads from cabinets typically shrink 3-5x
+        xml_dec = lz77_decode(xml_dec, size_hint=len(xml_dec) * 4)
+        start = _record_stage(timings, "decompress", start)
+
+    xml = KBinXML(xml_dec, convert_illegal_things=True)
+    start = _record_stage(timings, "parse", start)
+
+    if config.verbose_log:
+        xml_text = xml.to_text()
+        _record_stage(timings, "to_text", start)
+    else:
+        xml_text = None
+
+    return xml, xml_text, KBinXML.is_binary_xml(xml_dec)
+
+
+class RequestInfo(dict):
+    # request_info["text"] is only rendered when something asks for it,
+    # serializing big kbin trees on every request is wasted work otherwise
+
+    def __init__(self, xml, xml_text, **kwargs):
+        super().__init__(**kwargs)
+        self.xml = xml
+        if xml_text is not None:
+            self["text"] = xml_text
+
+    def __missing__(self, key):
+        if key != "text":
+            raise KeyError(key)
+
+        self["text"] = self.xml.to_text()
+        return self["text"]
+
+
+# Dispatchers (e.g. polaris) parse a request and hand it to a handler
+# which parses it again, so the result is kept on the request object
+request_cache_stats = {"hits": 0, "misses": 0}
+
+
+def get_request_cache_stats():
+    return dict(request_cache_stats)
 
 
 async def core_process_request(request):
+    request_info = getattr(request, "request_info", None)
+    if request_info is not None:
+        request_cache_stats["hits"] += 1
+        return request_info
+
     cl = request.headers.get("Content-Length")
     data = await request.body()
 
@@ -148,58 +274,80 @@ async def core_process_request(request):
         return {}
 
     request.compress = request.headers.get("X-Compress", "none") # intentionally lowercase 'none' (NOT None)
-
-    if "X-Eamuse-Info" in request.headers:
-        xeamuseinfo = request.headers.get("X-Eamuse-Info")
-        version, unix_time, prng = xeamuseinfo.split("-")
-        xml_dec = EamuseARC4(bytes.fromhex(unix_time), bytes.fromhex(prng)).decrypt(data[: int(cl)])
-        request.is_encrypted = True
-    else:
-        xml_dec = data[: int(cl)]
-        request.is_encrypted = False
-
-    if request.compress == "lz77":
-        xml_dec = lz77_decode(xml_dec)
-
-    xml = KBinXML(xml_dec, convert_illegal_things=True)
+    request.is_encrypted = "X-Eamuse-Info" in request.headers
+    request.codec_timings = {}
+
+    data = data[: int(cl)]
+    xml, xml_text, request.is_binxml = await _run_codec(
+        len(data),
+        _decode_request,
+        data,
+        request.compress,
+        request.headers.get("X-Eamuse-Info"),
+        request.codec_timings,
+    )
     root = xml.xml_doc
-    xml_text = xml.to_text()
-    request.is_binxml = KBinXML.is_binary_xml(xml_dec)
+    request.encoding = xml.encoding if request.is_binxml else None
 
-    if config.verbose_log:
+    if xml_text is not None:
         print()
         print("\033[94mREQUEST\033[0m:")
         print(xml_text)
 
     model_parts = (root.attrib["model"], *root.attrib["model"].split(":"))
+    request.model = model_parts[1]
     module = root[0].tag
     method = root[0].attrib["method"] if "method" in root[0].attrib else None
     command = root[0].attrib["command"] if "command" in root[0].attrib else None
     game_version = await core_get_game_version_from_software_version(model_parts)
 
-    return {
-        "root": root,
-        "text": xml_text,
-        "module": module,
-        "method": method,
-        "command": command,
-        "model": model_parts[1],
-        "dest": model_parts[2],
-        "spec": model_parts[3],
-        "rev": model_parts[4],
-        "ext": model_parts[5],
-        "game_version": game_version,
-    }
+    request_cache_stats["misses"] += 1
+    request.request_info = RequestInfo(
+        xml,
+        xml_text,
+        root=root,
+        module=module,
+        method=method,
+        command=command,
+        model=model_parts[1],
+        dest=model_parts[2],
+        spec=model_parts[3],
+        rev=model_parts[4],
+        ext=model_parts[5],
+        game_version=game_version,
+    )
 
+    return request.request_info
 
-async def core_prepare_response(request, xml):
+
+# model -> binary kbin string encoding for responses, None forces text XML.
+# Models not listed answer in the format and encoding the request used.
+# NOTE: KBinXML requires uppercase 'UTF-8', lowercase raises KeyError.
+response_encodings = {
+    # Client (Unity/Mono) expects UTF-8 text (XrpcBase.cs: Encoding.UTF8.GetString)
+    "LAV": None,
+    "XIF": None,
+}
+
+
+def _negotiate_response_encoding(request):
+    if not config.binary_response or not request.is_binxml:
+        return None
+
+    if request.model in response_encodings:
+        return response_encodings[request.model]
+
+    # Default is 'cp932', which causes Mojibake for clients sending UTF-8
+    return request.encoding or "cp932"
+
+
+def _render_response(xml, encoding, timings):
+    start = time.perf_counter()
     binxml = KBinXML(xml)
 
-    if False and request.is_binxml:
-        # [Fix] Force UTF-8 encoding for Binary XML to match Client expectation (XrpcBase.cs uses UTF8)
-        # Default is 'cp932', which causes Mojibake.
-        # NOTE: KBinXML requires uppercase 'UTF-8', lowercase raises KeyError.
-        xml_binary = binxml.to_binary()
+    xml_text = None
+    if encoding is not None:
+        xml_binary = binxml.to_binary(encoding=encoding)
     else:
         # Client (Unity/Mono) expects UTF-8 (XrpcBase.cs: Encoding.UTF8.GetString)
         xml_text = binxml.to_text() 
@@ -208,35 +356,126 @@ async def core_prepare_response(request, xml):
              xml_text = xml_text.replace("?>", ' encoding="UTF-8"?>', 1)
         
         xml_binary = xml_text.encode("utf-8")
+    _record_stage(timings, "render", start)
+
+    if not config.verbose_log:
+        log_text = None
+    elif xml_text is not None:
+        log_text = xml_text
+    else:
+        log_text = binxml.to_text()
+
+    return xml_binary, log_text
+
+
+def _pack_response(xml_binary, compress, arc4, timings):
+    start = time.perf_counter()
+
+    if compress == "lz77":
+        response = lz77_encode(xml_binary)
+        start = _record_stage(timings, "compress", start)
+    else:
+        response = xml_binary
+
+    if arc4 is not None:
+        response = arc4.encrypt(response)
+        _record_stage(timings, "encrypt", start)
+    else:
+        response = bytes(response)
+
+    return response
+
+
+def _encode_response(xml, encoding, compress, arc4, timings):
+    xml_binary, log_text = _render_response(xml, encoding, timings)
+
+    return _pack_response(xml_binary, compress, arc4, timings), log_text
 
-    if config.verbose_log:
-        print("\033[91mRESPONSE\033[0m:")
-        print(binxml.to_text())
 
+def _prepare_headers(request):
     response_headers = {"User-Agent": "EAMUSE.Httpac/1.0"}
-    
+
+    encoding = _negotiate_response_encoding(request)
+
     # Explicitly state UTF-8
-    if not request.is_binxml:
+    if encoding is None:
         response_headers["Content-Type"] = "text/xml; charset=utf-8"
 
     if config.response_compression:
         response_headers["X-Compress"] = request.compress
-        if request.compress == "lz77":
-            response = lz77_encode(xml_binary) # very slow
-        else:
-            response = xml_binary
+        compress = request.compress
     else:
         response_headers["X-Compress"] = "none" # intentionally lowercase 'none' (NOT None)
-        response = xml_binary
-
+        compress = "none"
 
     if request.is_encrypted:
         version = 1
         unix_time = int(time.time())
         prng = next(prng_init) & 0xFFFF
         response_headers["X-Eamuse-Info"] = f"{version}-{unix_time:04x}-{prng:02x}"
-        response = EamuseARC4(unix_time.to_bytes(4), prng.to_bytes(2)).encrypt(response)
+        arc4 = EamuseARC4(unix_time.to_bytes(4), prng.to_bytes(2))
     else:
-        response = bytes(response)
+        arc4 = None
+
+    return response_headers, encoding, compress, arc4
+
+
+def _print_response(log_text):
+    if log_text is not None:
+        print("\033[91mRESPONSE\033[0m:")
+        print(log_text)
+
+
+async def core_prepare_response(request, xml):
+    response_headers, encoding, compress, arc4 = _prepare_headers(request)
+
+    # Rendering cost grows with the number of entries under the module node
+    # (score lists etc.), which is cheap to count before rendering
+    size = sum(len(child) for child in xml) * 64
+    response, log_text = await _run_codec(
+        size,
+        _encode_response,
+        xml,
+        encoding,
+        compress,
+        arc4,
+        request.codec_timings,
+    )
+    _print_response(log_text)
+
+    return response, response_headers
+
+
+async def core_prepare_cached_response(request, cache, key, build):
+    # Like core_prepare_response, but the rendered body is kept in cache
+    # (a core_state.ResponseCache) under (key, encoding) so repeat responses
+    # are only compressed and encrypted. build() returns the response xml
+    # and is only called on a miss; callers invalidate with
+    # cache.invalidate(), which also discards a body rendering meanwhile.
+    response_headers, encoding, compress, arc4 = _prepare_headers(request)
+
+    xml_binary = cache.get((key, encoding))
+    if xml_binary is None:
+        generation = cache.generation((key, encoding))
+        xml = build()
+        size = sum(len(child) for child in xml) * 64
+        xml_binary, log_text = await _run_codec(
+            size, _render_response, xml, encoding, request.codec_timings
+        )
+        cache.store((key, encoding), xml_binary, generation)
+    elif config.verbose_log:
+        log_text = KBinXML(xml_binary).to_text()
+    else:
+        log_text = None
+
+    response = await _run_codec(
+        len(xml_binary),
+        _pack_response,
+        xml_binary,
+        compress,
+        arc4,
+        request.codec_timings,
+    )
+    _print_response(log_text)
 
     return response, response_headers
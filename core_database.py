@@ -1,7 +1,824 @@
+import config
+
+import asyncio
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+import weakref
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, asynccontextmanager, contextmanager, nullcontext
+from functools import wraps
+
 from tinydb import TinyDB
+from tinydb.storages import JSONStorage, Storage
+from tinydb.table import Document, Table
+
+from core_journal import ScoreJournal
+from core_query import build_indexes, plan, shard_for, shard_prefixes
+from core_sqlite import SQLiteDB
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+
+class ProcessLock:
+    # Reentrant lock shared by threads of this process and, through a lock
+    # file, by every server worker process
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+
+    def __enter__(self):
+        self._lock.acquire()
+        self._depth += 1
+        if self._depth == 1:
+            self._file = open(self.filename, "a+b")
+            if os.name == "nt":
+                self._file.seek(0)
+                while True:
+                    try:
+                        msvcrt.locking(self._file.fileno(), msvcrt.LK_LOCK, 1)
+                        break
+                    except OSError:
+                        pass
+            else:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._depth -= 1
+        if self._depth == 0:
+            if os.name == "nt":
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+
+class LockedJSONStorage(JSONStorage):
+    # Plain db.json, read and written from several DB threads through one
+    # file handle. Inside batch() the file is read once and written once.
+
+    def __init__(self, path, **kwargs):
+        self.lock = self._make_lock(path)
+        self._batch = None
+        super().__init__(path, **kwargs)
+
+    def _make_lock(self, path):
+        return threading.RLock()
+
+    def read(self):
+        with self.lock:
+            if self._batch is not None:
+                return self._batch["data"]
+            return super().read()
+
+    def write(self, data):
+        with self.lock:
+            if self._batch is not None:
+                self._batch.update(data=data, dirty=True)
+            else:
+                super().write(data)
+
+    @contextmanager
+    def batch(self):
+        with self.lock:
+            if self._batch is not None:
+                yield
+                return
+            self._batch = {"data": super().read(), "dirty": False}
+            try:
+                yield
+            except BaseException:
+                # nothing reached the file
+                self._batch = None
+                raise
+            batch, self._batch = self._batch, None
+            if batch["dirty"]:
+                super().write(batch["data"])
+
+
+class SharedJSONStorage(LockedJSONStorage):
+    # Other workers may be rewriting the file, never read it half written
+    def _make_lock(self, path):
+        return ProcessLock(f"{path}.lock")
+
+
+class SharedTable(Table):
+    # Another worker may write the file between any two calls, so nothing
+    # read from it is kept: no query results and no next document ID
+
+    def __init__(self, storage, name, cache_size=0):
+        # TinyDB.table() does not pass cache_size, the class default is
+        # bound when Table is defined
+        super().__init__(storage, name, cache_size=0)
+
+    def insert(self, document):
+        # the ID is picked from the file as it is under the lock
+        with self._storage.lock:
+            return super().insert(document)
+
+    def insert_multiple(self, documents):
+        with self._storage.lock:
+            return super().insert_multiple(documents)
+
+    def _update_table(self, updater):
+        # Keep the read-modify-write of the whole file under one lock
+        with self._storage.lock:
+            try:
+                super()._update_table(updater)
+            finally:
+                # worked out again from the file by the next insert
+                self._next_id = None
+
+
+class WriteBehindStorage(Storage):
+    # Keeps the database in memory and writes db.json at most every
+    # db_flush_interval seconds or db_flush_writes writes. A flush goes to
+    # a temporary file that replaces db.json only once it is on disk, so a
+    # crash loses the unflushed writes instead of leaving half a file.
+    # The file is only read at start: tools editing it (utils/, utils/db/)
+    # must not run while the server is up, the next flush overwrites them.
+    # read() returns the live data, IndexedTable copies documents in and out.
+
+    def __init__(
+        self, path, encoding=None, flush_interval=None, flush_writes=None, **kwargs
+    ):
+        self.path = path
+        self.encoding = encoding
+        self.kwargs = kwargs
+        self.lock = threading.RLock()
+        self.flush_interval = (
+            config.db_flush_interval if flush_interval is None else flush_interval
+        )
+        self.flush_writes = (
+            config.db_flush_writes if flush_writes is None else flush_writes
+        )
+
+        self._data = None
+        if os.path.exists(path) and os.path.getsize(path):
+            with open(path, "r", encoding=encoding) as fp:
+                self._data = json.load(fp)
+
+        self._pending = 0
+        self._dirty_since = None
+        self._batch_depth = 0
+        self._batch_dirty = False
+        self._closed = threading.Event()
+        self.stats = {
+            "flushes": 0,
+            "flush_ms_last": 0,
+            "flush_ms_max": 0,
+            "lag_ms_last": 0,
+            "lag_ms_max": 0,
+        }
+
+        if self.flush_interval > 0:
+            threading.Thread(target=self._flush_loop, daemon=True).start()
+
+    def read(self):
+        return self._data
+
+    def write(self, data):
+        with self.lock:
+            self._data = data
+            if self._batch_depth:
+                self._batch_dirty = True
+            else:
+                self._written()
+
+    def _written(self):
+        self._pending += 1
+        if self._dirty_since is None:
+            self._dirty_since = time.time()
+        if self.flush_interval <= 0 or self._pending >= self.flush_writes:
+            self.flush()
+
+    @contextmanager
+    def batch(self):
+        # every write inside counts as one towards db_flush_writes, and an
+        # immediate flush policy flushes once at the end
+        with self.lock:
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth and self._batch_dirty:
+                    self._batch_dirty = False
+                    self._written()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.flush_interval):
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if self._dirty_since is None:
+                return
+
+            start = time.time()
+            temp = f"{self.path}.tmp"
+            with open(temp, "w", encoding=self.encoding) as fp:
+                json.dump(self._data, fp, **self.kwargs)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp, self.path)
+            if os.name != "nt":
+                # make the rename itself durable
+                fd = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+            end = time.time()
+            flush_ms = round((end - start) * 1000, 3)
+            # oldest acknowledged write that was only in memory until now
+            lag_ms = round((end - self._dirty_since) * 1000, 3)
+            self.stats["flushes"] += 1
+            self.stats["flush_ms_last"] = flush_ms
+            self.stats["flush_ms_max"] = max(self.stats["flush_ms_max"], flush_ms)
+            self.stats["lag_ms_last"] = lag_ms
+            self.stats["lag_ms_max"] = max(self.stats["lag_ms_max"], lag_ms)
+            self._pending = 0
+            self._dirty_since = None
+
+    def close(self):
+        if not self._closed.is_set():
+            self._closed.set()
+            self.flush()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                **self.stats,
+                "pending_writes": self._pending,
+                "unflushed_ms": round((time.time() - self._dirty_since) * 1000, 3)
+                if self._dirty_since is not None
+                else 0,
+            }
+
+
+_no_lock = nullcontext()
+
+
+def _copy(value):
+    # Deep copy of a JSON document, much cheaper than copy.deepcopy
+    if isinstance(value, dict):
+        return {key: _copy(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_copy(item) for item in value]
+    return value
+
+
+def _locked(method):
+    # Documents and indexes are shared by the DB threads, and a flush must
+    # not serialize a table while it is being updated
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with getattr(self._storage, "lock", _no_lock):
+            return method(self, *args, **kwargs)
+
+    return wrapper
+
+
+class IndexedTable(Table):
+    # Keeps core_query.table_indexes for this table in memory and answers
+    # equality where() chains through them. Only valid while this process
+    # is the only writer.
+    #
+    # With WriteBehindStorage the stored documents are the live database,
+    # so documents go in and come out as deep copies: changing a returned
+    # profile["version"][...] or a dict after inserting it must not change
+    # the table without a write.
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._indexes = None
+
+    def _get_indexes(self):
+        if self._indexes is None:
+            self._indexes = build_indexes(self.name)
+            for doc_id, document in self._read_table().items():
+                for index in self._indexes:
+                    index.add(int(doc_id), document)
+        return self._indexes
+
+    def _reindex(self, doc_ids):
+        if self._indexes is None:
+            return
+        table = self._read_table()
+        for doc_id in doc_ids:
+            document = table.get(str(doc_id))
+            for index in self._indexes:
+                index.remove(doc_id)
+                if document is not None:
+                    index.add(doc_id, document)
+
+    def _indexed(self, cond):
+        doc_ids = plan(self._get_indexes(), cond)
+        if doc_ids is None:
+            return None
+        table = self._read_table()
+        documents = []
+        for doc_id in sorted(doc_ids):
+            document = table.get(str(doc_id))
+            if document is not None and cond(document):
+                documents.append(self.document_class(_copy(document), doc_id))
+        return documents
+
+    def _detach(self, documents):
+        return [self.document_class(_copy(d), d.doc_id) for d in documents]
+
+    @_locked
+    def all(self):
+        return self._detach(super().all())
+
+    @_locked
+    def search(self, cond):
+        documents = self._indexed(cond)
+        if documents is None:
+            return self._detach(super().search(cond))
+        return documents
+
+    @_locked
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        if cond is not None and doc_id is None and doc_ids is None:
+            documents = self._indexed(cond)
+            if documents is not None:
+                return documents[0] if documents else None
+        document = super().get(cond, doc_id, doc_ids)
+        if document is None:
+            return None
+        if doc_ids is not None:
+            return self._detach(document)
+        return self._detach([document])[0]
+
+    @_locked
+    def contains(self, cond=None, doc_id=None):
+        return super().contains(cond, doc_id)
+
+    @_locked
+    def count(self, cond):
+        return super().count(cond)
+
+    @_locked
+    def __len__(self):
+        return super().__len__()
+
+    @_locked
+    def __iter__(self):
+        return iter(self._detach(super().__iter__()))
+
+    def _attach(self, document):
+        if isinstance(document, Document):
+            return self.document_class(_copy(document), document.doc_id)
+        return _copy(document)
+
+    @_locked
+    def insert(self, document):
+        doc_id = super().insert(self._attach(document))
+        self._reindex([doc_id])
+        return doc_id
+
+    @_locked
+    def insert_multiple(self, documents):
+        doc_ids = super().insert_multiple(
+            [self._attach(document) for document in documents]
+        )
+        self._reindex(doc_ids)
+        return doc_ids
+
+    @_locked
+    def update(self, fields, cond=None, doc_ids=None):
+        if not callable(fields):
+            fields = _copy(fields)
+        if cond is not None and doc_ids is None:
+            documents = self._indexed(cond)
+            if documents is not None:
+                cond, doc_ids = None, [document.doc_id for document in documents]
+                if not doc_ids:
+                    return []
+        updated = super().update(fields, cond, doc_ids)
+        self._reindex(updated)
+        return updated
+
+    @_locked
+    def update_multiple(self, updates):
+        updates = [
+            (fields if callable(fields) else _copy(fields), cond)
+            for fields, cond in updates
+        ]
+        updated = super().update_multiple(updates)
+        self._reindex(updated)
+        return updated
+
+    @_locked
+    def upsert(self, document, cond=None):
+        # a miss and the insert after it must not interleave with another
+        # upsert of the same key
+        return super().upsert(document, cond)
+
+    @_locked
+    def remove(self, cond=None, doc_ids=None):
+        removed = super().remove(cond, doc_ids)
+        self._reindex(removed)
+        return removed
+
+    @_locked
+    def truncate(self):
+        super().truncate()
+        self._indexes = None
 
-db = TinyDB("db.json", indent=2, encoding="utf-8", ensure_ascii=False)
+
+def open_tinydb(path, shard=None):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if config.workers > 1:
+        db = TinyDB(
+            path,
+            storage=SharedJSONStorage,
+            indent=2,
+            encoding="utf-8",
+            ensure_ascii=False,
+        )
+        db.table_class = SharedTable
+    elif config.db_write_behind:
+        flush_interval, flush_writes = config.db_flush_policy.get(shard, (None, None))
+        db = TinyDB(
+            path,
+            storage=WriteBehindStorage,
+            flush_interval=flush_interval,
+            flush_writes=flush_writes,
+            indent=2,
+            encoding="utf-8",
+            ensure_ascii=False,
+        )
+        db.table_class = IndexedTable
+    else:
+        db = TinyDB(
+            path,
+            storage=LockedJSONStorage,
+            indent=2,
+            encoding="utf-8",
+            ensure_ascii=False,
+        )
+        db.table_class = IndexedTable
+    return db
+
+
+def split_db(path, directory):
+    # Move from a single db.json to one file per shard. Its tables are merged
+    # into the shard files; a table that already has documents in its shard
+    # is never replaced, the split stops instead (db.json is then a stale
+    # copy, e.g. left behind by a tool run against the unsharded layout).
+    # Existing shard files are backed up before they are rewritten and
+    # db.json is kept, renamed, once every shard is on disk.
+    if not os.path.exists(path):
+        return
+    with ProcessLock(f"{path}.lock"):
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as fp:
+            tables = json.load(fp) if os.path.getsize(path) else {}
+
+        shards = {}
+        for name, documents in tables.items():
+            shards.setdefault(shard_for(name), {})[name] = documents
+
+        merged = {}
+        conflicts = []
+        for shard, shard_tables in shards.items():
+            shard_path = os.path.join(directory, f"{shard}.json")
+            existing, moved = {}, []
+            if os.path.exists(shard_path) and os.path.getsize(shard_path):
+                with open(shard_path, "r", encoding="utf-8") as fp:
+                    existing = json.load(fp)
+            for name, documents in shard_tables.items():
+                if existing.get(name):
+                    if documents and documents != existing[name]:
+                        conflicts.append(f"{name} in {shard_path}")
+                    continue
+                existing[name] = documents
+                moved.append(name)
+            merged[shard_path] = existing, moved
+        if conflicts:
+            raise RuntimeError(
+                f"{path} and {directory} both hold {', '.join(conflicts)}; "
+                f"move {path} away (or merge it by hand) and start again"
+            )
+
+        stamp = round(time.time())
+        os.makedirs(directory, exist_ok=True)
+        for shard_path, (shard_tables, moved) in merged.items():
+            if not moved:
+                continue
+            if os.path.exists(shard_path):
+                shutil.copy2(shard_path, f"{shard_path}.{stamp}.bak")
+            with open(f"{shard_path}.tmp", "w", encoding="utf-8") as fp:
+                json.dump(shard_tables, fp, indent=2, ensure_ascii=False)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(f"{shard_path}.tmp", shard_path)
+            print(f"Moved {', '.join(moved)} to {shard_path}")
+
+        unsharded = f"{path}.unsharded"
+        if os.path.exists(unsharded):
+            unsharded = f"{unsharded}.{stamp}"
+        os.replace(path, unsharded)
+
+
+class MonkeyDB:
+    # What get_db() returns with the tinydb backend: routes every table to
+    # the TinyDB file of its shard, and the score history tables to the
+    # journal when there is one
+
+    def __init__(self, shards, route):
+        self.shards = shards
+        self.route = route
+        self.journal = None
+
+    def shard(self, name):
+        return self.shards[self.route(name)]
+
+    def attach_journal(self, journal):
+        journal.recover()
+        for shard in self.shards.values():
+            for name in shard.tables():
+                if name in journal:
+                    count = journal.import_documents(name, shard.table(name).all())
+                    shard.drop_table(name)
+                    print(f"Moved {count} rows of {name} to {journal.directory}")
+        self.journal = journal
+
+    def table(self, name):
+        if self.journal is not None and name in self.journal:
+            return self.journal.table(name)
+        return self.shard(name).table(name)
+
+    def tables(self):
+        return set().union(*(shard.tables() for shard in self.shards.values()))
+
+    def drop_table(self, name):
+        self.shard(name).drop_table(name)
+
+    def atomic(self, name):
+        # held across a read-modify-write of table name; with several
+        # workers this is the shard's file lock
+        return self.shard(name).storage.lock
+
+    @contextmanager
+    def batch(self, names):
+        """Write the shards of tables names once, when the block ends."""
+        with ExitStack() as stack:
+            # always in the same order, two batches never wait on each other
+            for shard in sorted({self.route(name) for name in names}, key=str):
+                stack.enter_context(self.shards[shard].storage.batch())
+            if self.journal is not None:
+                for name in sorted(set(names)):
+                    if name in self.journal:
+                        stack.enter_context(self.journal.table(name).batch())
+            yield
+
+    def close(self):
+        for shard in self.shards.values():
+            shard.close()
+
+
+if config.db_backend == "sqlite":
+    db = SQLiteDB(config.sqlite_file)
+else:
+    if config.db_shards:
+        split_db("db.json", config.db_dir)
+        db = MonkeyDB(
+            {
+                shard: open_tinydb(os.path.join(config.db_dir, f"{shard}.json"), shard)
+                for shard in (*shard_prefixes, "core")
+            },
+            shard_for,
+        )
+    else:
+        db = MonkeyDB({None: open_tinydb("db.json")}, lambda name: None)
+    if config.workers == 1 and config.db_write_behind:
+        atexit.register(db.close)
+
+    if config.score_journal:
+        db.attach_journal(
+            ScoreJournal(
+                config.journal_dir,
+                config.journal_segment_size,
+                lock_factory=ProcessLock,
+                shared=config.workers > 1,
+            )
+        )
 
 
 def get_db():
     return db
+
+
+def get_db_stats():
+    if not isinstance(db, MonkeyDB):
+        return {}
+    return {
+        shard or "db": tinydb.storage.get_stats()
+        for shard, tinydb in db.shards.items()
+        if isinstance(tinydb.storage, WriteBehindStorage)
+    }
+
+
+db_executor = ThreadPoolExecutor(
+    max_workers=config.db_threads, thread_name_prefix="db"
+)
+
+
+class AsyncTable:
+    # Awaitable view of get_db().table(name), every call runs on db_executor
+
+    def __init__(self, async_db, name):
+        self.async_db = async_db
+        self.name = name
+
+    def _call(self, method, *args):
+        return self.async_db.run(
+            lambda: getattr(self.async_db.db.table(self.name), method)(*args)
+        )
+
+    async def all(self):
+        return await self._call("all")
+
+    async def search(self, cond):
+        return await self._call("search", cond)
+
+    async def get(self, cond=None, doc_id=None, doc_ids=None):
+        return await self._call("get", cond, doc_id, doc_ids)
+
+    async def contains(self, cond=None, doc_id=None):
+        return await self._call("contains", cond, doc_id)
+
+    async def count(self, cond):
+        return await self._call("count", cond)
+
+    async def insert(self, document):
+        return await self._call("insert", document)
+
+    async def insert_multiple(self, documents):
+        return await self._call("insert_multiple", list(documents))
+
+    async def update(self, fields, cond=None, doc_ids=None):
+        return await self._call("update", fields, cond, doc_ids)
+
+    async def upsert(self, document, cond=None):
+        return await self._call("upsert", document, cond)
+
+    async def remove(self, cond=None, doc_ids=None):
+        return await self._call("remove", cond, doc_ids)
+
+    async def update_with(self, cond, fn):
+        """Read the document matching cond, store fn(document) in its place
+        and return it, with no other writer in between. fn gets None when
+        there is no such document and may return None to leave it as is."""
+        return await self.async_db.run(
+            _update_with, self.async_db.db, self.name, cond, fn
+        )
+
+
+def _update_with(db, name, cond, fn):
+    with db.atomic(name):
+        table = db.table(name)
+        document = fn(table.get(cond))
+        if document is not None:
+            table.upsert(document, cond)
+        return document
+
+
+class UnitOfWork:
+    # Writes queued by a handler through AsyncDB.unit_of_work(). They are
+    # applied in order by one DB thread when the block ends, each shard
+    # written once (one transaction with sqlite), and update_with() fns run
+    # then, against what is stored at that point. Every queued call returns
+    # a future for its result.
+
+    def __init__(self, async_db):
+        self.async_db = async_db
+        self._writes = []
+
+    def table(self, name):
+        return UnitOfWorkTable(self, name)
+
+    def _queue(self, name, method, *args):
+        future = asyncio.get_running_loop().create_future()
+        self._writes.append((name, method, args, future))
+        return future
+
+    def _apply(self, writes):
+        db = self.async_db.db
+        results = []
+        with db.batch([name for name, _, _, _ in writes]):
+            for name, method, args, _ in writes:
+                if method == "update_with":
+                    results.append(_update_with(db, name, *args))
+                else:
+                    results.append(getattr(db.table(name), method)(*args))
+        return results
+
+    def discard(self):
+        writes, self._writes = self._writes, []
+        for _, _, _, future in writes:
+            future.cancel()
+
+    async def commit(self):
+        writes, self._writes = self._writes, []
+        if not writes:
+            return
+        try:
+            results = await self.async_db.run(self._apply, writes)
+        except BaseException:
+            for _, _, _, future in writes:
+                future.cancel()
+            raise
+        for (_, _, _, future), result in zip(writes, results):
+            future.set_result(result)
+
+
+class UnitOfWorkTable:
+    def __init__(self, unit, name):
+        self.unit = unit
+        self.name = name
+
+    def insert(self, document):
+        return self.unit._queue(self.name, "insert", document)
+
+    def insert_multiple(self, documents):
+        return self.unit._queue(self.name, "insert_multiple", list(documents))
+
+    def update(self, fields, cond=None, doc_ids=None):
+        return self.unit._queue(self.name, "update", fields, cond, doc_ids)
+
+    def upsert(self, document, cond=None):
+        return self.unit._queue(self.name, "upsert", document, cond)
+
+    def remove(self, cond=None, doc_ids=None):
+        return self.unit._queue(self.name, "remove", cond, doc_ids)
+
+    def update_with(self, cond, fn):
+        return self.unit._queue(self.name, "update_with", cond, fn)
+
+
+class AsyncDB:
+    # What get_async_db() returns: get_db() for handlers that should not
+    # block the event loop on storage I/O
+
+    def __init__(self, db, executor):
+        self.db = db
+        self.executor = executor
+        self._locks = weakref.WeakValueDictionary()
+
+    def table(self, name):
+        return AsyncTable(self, name)
+
+    async def run(self, func, *args):
+        """Run func(*args) on the DB executor, for several calls that belong
+        together."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, func, *args)
+
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Collect the writes of the block and commit them together at its
+        end; nothing is written if the block raises. With sqlite the commit
+        is all or nothing; TinyDB files are only written once every write
+        went through, but an update_with() fn raising half way leaves the
+        writes before it in the in-memory (write-behind) copy."""
+        unit = UnitOfWork(self)
+        try:
+            yield unit
+        except BaseException:
+            unit.discard()
+            raise
+        await unit.commit()
+
+    def lock(self, *key):
+        """asyncio lock for key, e.g. ("paseli", cardid), to keep a sequence
+        of awaited calls from interleaving with another request's."""
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+
+async_db = AsyncDB(db, db_executor)
+
+
+def get_async_db():
+    return async_db
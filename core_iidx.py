@@ -0,0 +1,398 @@
+import config
+
+from bisect import bisect_left, insort
+
+from tinydb import where
+
+from core_blobs import BLOB_PREFIX
+from core_database import get_db
+from core_state import ResponseCache
+
+
+# In-memory views of the IIDX tables that song select and the result
+# screen ask for on every credit, kept up to date by the handlers writing
+# iidx_scores_best (best_score_saved). Like IndexedTable they assume this
+# process is the only writer; with several workers every request builds
+# its own from the tables instead.
+
+
+class TopScores:
+    # Highest ex_score of every (play_style, music_id, chart_id) over all
+    # players, with the iidx_id holding it
+
+    def __init__(self):
+        self.styles = {}
+
+    @classmethod
+    def build(cls, db):
+        top_scores = cls()
+        for record in db.table("iidx_scores_best").all():
+            top_scores.add(record)
+        return top_scores
+
+    def add(self, record):
+        charts = self.styles.setdefault(record["play_style"], {}).setdefault(
+            record["music_id"], {}
+        )
+        top = charts.get(record["chart_id"])
+        # best scores only go up, the first to reach a score keeps it
+        if top is None or record["ex_score"] > top[0]:
+            charts[record["chart_id"]] = (record["ex_score"], record["iidx_id"])
+
+    def charts(self, play_style, below):
+        """Yields (music_id, {chart_id: (ex_score, iidx_id)}) of play_style
+        for every music_id < below."""
+        for music_id, charts in self.styles.get(play_style, {}).items():
+            if music_id < below:
+                yield music_id, charts
+
+
+class Champions:
+    # Best ex_score of every (music_id, chart_id) over all players, the
+    # ghost appoint sends to beat for ctype 2, 4 and 10. Ghosts are kept as
+    # their blob reference; rows still holding an inline ghost are read
+    # again when asked for instead of keeping the hex in memory
+
+    def __init__(self):
+        self.charts = {}
+
+    @classmethod
+    def build(cls, db):
+        champions = cls()
+        for record in db.table("iidx_scores_best").all():
+            champions.add(record)
+        return champions
+
+    def add(self, record):
+        key = record["music_id"], record["chart_id"]
+        champion = self.charts.get(key)
+        if champion is None:
+            replace = record["ex_score"] > 0
+        else:
+            # the holder tying their own score saves a new ghost
+            replace = record["ex_score"] > champion["ex_score"] or (
+                record["iidx_id"] == champion["iidx_id"]
+                and record["play_style"] == champion["play_style"]
+            )
+        if replace:
+            ghost = record["ghost"]
+            self.charts[key] = {
+                "game_version": record["game_version"],
+                "ghost": (
+                    ghost
+                    if isinstance(ghost, str) and ghost.startswith(BLOB_PREFIX)
+                    else None
+                ),
+                "ex_score": record["ex_score"],
+                "iidx_id": record["iidx_id"],
+                "play_style": record["play_style"],
+                "pid": record["pid"],
+            }
+
+
+class ClearRates:
+    # clear_rate and fc_rate of every chart in iidx_score_stats, what
+    # music/crate sends
+
+    def __init__(self):
+        self.charts = {}
+
+    @classmethod
+    def build(cls, db):
+        clear_rates = cls()
+        for stats in db.table("iidx_score_stats").all():
+            clear_rates.add(stats)
+        return clear_rates
+
+    def add(self, stats):
+        """Returns whether the rates of the chart changed."""
+        key = stats["music_id"], stats["play_style"], stats["chart_id"]
+        rates = int(stats["clear_rate"]), int(stats["fc_rate"])
+        if self.charts.get(key) == rates:
+            return False
+        self.charts[key] = rates
+        return True
+
+    def below(self, below):
+        """Yields (music_id, play_style, chart_id, clear_rate, fc_rate) for
+        every music_id < below."""
+        for (music_id, play_style, chart_id), rates in self.charts.items():
+            if music_id < below:
+                yield music_id, play_style, chart_id, *rates
+
+
+top_scores = None
+champions = None
+clear_rates = None
+
+# rendered music/crate bodies, see core_prepare_cached_response; keyed by
+# game_version, which sends the charts of music_id < (game_version + 1) * 1000
+crate_bodies = ResponseCache()
+
+
+def get_top_scores():
+    global top_scores
+    if config.workers > 1:
+        return TopScores.build(get_db())
+    if top_scores is None:
+        top_scores = TopScores.build(get_db())
+    return top_scores
+
+
+def get_champions():
+    global champions
+    if config.workers > 1:
+        return Champions.build(get_db())
+    if champions is None:
+        champions = Champions.build(get_db())
+    return champions
+
+
+def get_champion(music_id, chart_id):
+    """appoint sdata of the best score on a chart, None before anybody
+    scored on it. ghost is a reference for core_blobs.load_ghost()."""
+    champion = get_champions().charts.get((music_id, chart_id))
+    if champion is None:
+        return None
+    sdata = dict(champion)
+    if sdata["ghost"] is None:
+        record = get_db().table("iidx_scores_best").get(
+            (where("iidx_id") == sdata["iidx_id"])
+            & (where("play_style") == sdata["play_style"])
+            & (where("music_id") == music_id)
+            & (where("chart_id") == chart_id)
+        )
+        sdata["ghost"] = record["ghost"]
+    return sdata
+
+
+def get_clear_rates():
+    global clear_rates
+    if config.workers > 1:
+        return ClearRates.build(get_db())
+    if clear_rates is None:
+        clear_rates = ClearRates.build(get_db())
+    return clear_rates
+
+
+def get_crate_bodies():
+    return crate_bodies if config.workers == 1 else ResponseCache()
+
+
+def warm_up():
+    """Build everything up front instead of on the first credit."""
+    if config.workers == 1:
+        get_top_scores()
+        get_champions()
+        get_clear_rates()
+
+
+class ProfileSummary:
+    # The fields of one game version of a profile that other players see:
+    # ranklists, ghosts and rival lists. A few of these stay cached instead
+    # of the whole profile document
+
+    __slots__ = (
+        "djname",
+        "region",
+        "sach",
+        "dach",
+        "grade_single",
+        "grade_double",
+        "back",
+        "body",
+        "face",
+        "hair",
+        "hand",
+        "head",
+    )
+
+    def __init__(self, game_profile):
+        self.djname = game_profile["djname"]
+        self.region = game_profile["region"]
+        self.sach = game_profile.get("sach", 0)
+        self.dach = game_profile.get("dach", 0)
+        self.grade_single = game_profile["grade_single"]
+        self.grade_double = game_profile["grade_double"]
+        self.back = game_profile.get("back", 0)
+        self.body = game_profile.get("body", 0)
+        self.face = game_profile.get("face", 0)
+        self.hair = game_profile.get("hair", 0)
+        self.hand = game_profile.get("hand", 0)
+        self.head = game_profile.get("head", 0)
+
+
+class Leaderboard:
+    # Players of one chart in ranklist order, clear_flg then ex_score
+    # descending. keys stays sorted, so a rank is a binary search and a new
+    # best score moves one key instead of sorting the chart again
+
+    def __init__(self):
+        self.keys = []
+        self.players = {}
+
+    @classmethod
+    def build(cls, db, game_version, play_style, music_id, chart_id):
+        leaderboard = cls()
+        for record in db.table("iidx_scores_best").search(
+            (where("play_style") == play_style)
+            & (where("music_id") == music_id)
+            & (where("chart_id") == chart_id)
+        ):
+            # only players with a profile for game_version are ranked
+            if get_profile_summary(record["iidx_id"], game_version) is not None:
+                leaderboard.add(record)
+        return leaderboard
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, iidx_id):
+        return iidx_id in self.players
+
+    def add(self, record):
+        iidx_id = record["iidx_id"]
+        key = (-record["clear_flg"], -record["ex_score"], iidx_id)
+        old = self.players.get(iidx_id)
+        if old == key:
+            return
+        if old is not None:
+            del self.keys[bisect_left(self.keys, old)]
+        insort(self.keys, key)
+        self.players[iidx_id] = key
+
+    def rank(self, iidx_id):
+        """1-based rank of iidx_id, 0 when not ranked."""
+        key = self.players.get(iidx_id)
+        if key is None:
+            return 0
+        return bisect_left(self.keys, key) + 1
+
+    def window(self, rank, top, around):
+        """Yields (rank, iidx_id, clear_flg, ex_score) of the top players and
+        of the ones around rank, or of everyone when top is 0."""
+        if top == 0:
+            ranks = range(len(self.keys))
+        else:
+            ranks = set(range(min(top, len(self.keys))))
+            if rank:
+                ranks.update(
+                    range(max(rank - 1 - around, 0), min(rank + around, len(self.keys)))
+                )
+            ranks = sorted(ranks)
+        for i in ranks:
+            clear_flg, ex_score, iidx_id = self.keys[i]
+            yield i + 1, iidx_id, -clear_flg, -ex_score
+
+
+# (play_style, music_id, chart_id) -> {game_version: Leaderboard}, built on
+# the first play of a chart
+leaderboards = {}
+
+# iidx_id -> {game_version: ProfileSummary, None without a profile for it}
+profile_summaries = {}
+
+
+def get_leaderboard(game_version, play_style, music_id, chart_id):
+    if config.workers > 1:
+        return Leaderboard.build(get_db(), game_version, play_style, music_id, chart_id)
+    by_version = leaderboards.setdefault((play_style, music_id, chart_id), {})
+    if game_version not in by_version:
+        by_version[game_version] = Leaderboard.build(
+            get_db(), game_version, play_style, music_id, chart_id
+        )
+    return by_version[game_version]
+
+
+def get_profile_summary(iidx_id, game_version):
+    """ProfileSummary of iidx_id for game_version, None when the player has
+    no profile for it."""
+    cached = profile_summaries.get(iidx_id, {})
+    if game_version in cached:
+        return cached[game_version]
+
+    profile = get_db().table("iidx_profile").get(where("iidx_id") == iidx_id)
+    try:
+        summary = ProfileSummary(profile["version"][str(game_version)])
+    except (KeyError, TypeError):
+        summary = None
+    if config.workers == 1:
+        profile_summaries.setdefault(iidx_id, {})[game_version] = summary
+    return summary
+
+
+def get_djname(iidx_id, game_version):
+    summary = get_profile_summary(iidx_id, game_version)
+    return "UNK" if summary is None else summary.djname
+
+
+def get_ranklist(game_version, play_style, music_id, chart_id, iidx_id):
+    """The music/reg ranklist of a chart as seen by iidx_id: the rows to
+    send, the rank of iidx_id (0 when not ranked) and the number of ranked
+    players. See iidx_ranklist_top in config.py for which rows are sent."""
+    leaderboard = get_leaderboard(game_version, play_style, music_id, chart_id)
+    my_rank = leaderboard.rank(iidx_id)
+
+    ranklist = []
+    for rnum, player, clear_flg, ex_score in leaderboard.window(
+        my_rank, config.iidx_ranklist_top, config.iidx_ranklist_around
+    ):
+        summary = get_profile_summary(player, game_version)
+        ranklist.append(
+            {
+                "rnum": rnum,
+                "opname": config.arcade,
+                "name": summary.djname,
+                "pid": summary.region,
+                "back": summary.back,
+                "body": summary.body,
+                "face": summary.face,
+                "hair": summary.hair,
+                "hand": summary.hand,
+                "head": summary.head,
+                "dgrade": summary.grade_double,
+                "sgrade": summary.grade_single,
+                "score": ex_score,
+                "iidx_id": player,
+                "clflg": clear_flg,
+                "myFlg": player == iidx_id,
+            }
+        )
+    return ranklist, my_rank, len(leaderboard)
+
+
+def best_score_saved(best_score):
+    """Called with the stored row after every iidx_scores_best write."""
+    if top_scores is not None:
+        top_scores.add(best_score)
+    if champions is not None:
+        champions.add(best_score)
+
+    iidx_id = best_score["iidx_id"]
+    chart = best_score["play_style"], best_score["music_id"], best_score["chart_id"]
+    for game_version, leaderboard in leaderboards.get(chart, {}).items():
+        if (
+            iidx_id in leaderboard
+            or get_profile_summary(iidx_id, game_version) is not None
+        ):
+            leaderboard.add(best_score)
+
+
+def score_stats_saved(score_stats):
+    """Called with the stored row after every iidx_score_stats write."""
+    if clear_rates is not None and clear_rates.add(score_stats):
+        # most plays leave the per mille rates as they were
+        crate_bodies.invalidate(
+            lambda key: score_stats["music_id"] < (key[0] + 1) * 1000
+        )
+
+
+def profile_saved(iidx_id):
+    """Called after every write to the iidx_profile row of iidx_id."""
+    for game_version, summary in profile_summaries.pop(iidx_id, {}).items():
+        if summary is None and get_profile_summary(iidx_id, game_version) is not None:
+            # registered for game_version since, the charts played before
+            # have to rank the player as well
+            for by_version in leaderboards.values():
+                by_version.pop(game_version, None)
+
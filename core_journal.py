@@ -0,0 +1,294 @@
+import gzip
+import json
+import os
+import struct
+import threading
+import zlib
+
+from contextlib import contextmanager, nullcontext
+
+from tinydb.table import Document
+
+from core_query import build_indexes, plan
+
+
+# Score history tables only ever get new rows, so instead of living in
+# db.json (rewritten on every change) they are appended to a log of
+# segments under journal_dir/<table>/. A record is a header of payload
+# length, CRC-32 and doc_id followed by the document as JSON. The active
+# segment is NNNNNNNN.log; once it grows past segment_size it is sealed
+# into NNNNNNNN.log.gz and a new one is started.
+
+journal_tables = (
+    "iidx_scores",
+    "ddr_scores",
+    "sdvx_scores",
+    "guitarfreaks_scores",
+    "drummania_scores",
+    "polaris_score",
+    "drs_scores",
+    "nostalgia_scores",
+)
+
+_header = struct.Struct("<III")
+
+
+def _pack(doc_id, document):
+    payload = json.dumps(dict(document), ensure_ascii=False).encode("utf-8")
+    return _header.pack(len(payload), zlib.crc32(payload), doc_id) + payload
+
+
+def _unpack(data):
+    # Yields (end_offset, doc_id, document), stops at a torn record
+    offset = 0
+    while offset + _header.size <= len(data):
+        length, crc, doc_id = _header.unpack_from(data, offset)
+        start = offset + _header.size
+        payload = data[start : start + length]
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        offset = start + length
+        yield offset, doc_id, json.loads(payload)
+
+
+class JournalTable:
+    def __init__(self, directory, name, segment_size, lock=None, shared=False):
+        self.name = name
+        self.directory = os.path.join(directory, name)
+        self.segment_size = segment_size
+        # lock is held while appending; with shared=True other processes
+        # append too, so reads first pick up records written since
+        self._lock = lock or nullcontext()
+        self._shared = shared
+        self._thread_lock = threading.RLock()
+        self._batch_depth = 0
+        self._unsynced = set()
+
+        self._documents = None
+        self._by_id = {}
+        self._indexes = build_indexes(name)
+        self._segment = 0
+        self._offset = 0
+
+    def __repr__(self):
+        return f"<JournalTable name={self.name!r}>"
+
+    def _path(self, segment, sealed=False):
+        return os.path.join(
+            self.directory, f"{segment:08d}.log" + (".gz" if sealed else "")
+        )
+
+    def _segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(
+            {int(f.split(".")[0]) for f in os.listdir(self.directory) if ".log" in f}
+        )
+
+    def _read_segment(self, segment, offset):
+        try:
+            with open(self._path(segment), "rb") as fp:
+                fp.seek(offset)
+                return fp.read()
+        except FileNotFoundError:
+            # sealed, possibly by another process since the last read
+            with gzip.open(self._path(segment, sealed=True), "rb") as fp:
+                return fp.read()[offset:]
+
+    def _add(self, doc_id, document):
+        document = Document(document, doc_id)
+        self._documents.append(document)
+        self._by_id[doc_id] = document
+        for index in self._indexes:
+            index.add(doc_id, document)
+
+    def _load(self):
+        # Read every record not seen yet, starting where the last read ended
+        if self._documents is None:
+            self._documents = []
+        for segment in self._segments():
+            if segment < self._segment:
+                continue
+            if segment > self._segment:
+                self._segment, self._offset = segment, 0
+            base = self._offset
+            data = self._read_segment(segment, base)
+            for end, doc_id, document in _unpack(data):
+                self._offset = base + end
+                self._add(doc_id, document)
+
+    def _documents_for_read(self):
+        with self._thread_lock:
+            if self._documents is None or self._shared:
+                self._load()
+            return self._documents
+
+    def _append(self, documents):
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, self._thread_lock:
+            self._documents_for_read()
+            path = self._path(self._segment)
+
+            # cut a torn record left by a crash before appending after it
+            if os.path.exists(path) and os.path.getsize(path) != self._offset:
+                with open(path, "r+b") as fp:
+                    fp.truncate(self._offset)
+
+            next_id = max(self._by_id, default=0) + 1
+            records = []
+            for document in documents:
+                if isinstance(document, Document):
+                    doc_id = document.doc_id
+                    if doc_id in self._by_id or any(doc_id == r[0] for r in records):
+                        raise ValueError(f"Document with ID {doc_id} already exists")
+                else:
+                    doc_id = next_id
+                next_id = max(next_id, doc_id + 1)
+                records.append((doc_id, dict(document), _pack(doc_id, document)))
+
+            with open(path, "ab") as fp:
+                fp.write(b"".join(record for _, _, record in records))
+                fp.flush()
+                if self._batch_depth:
+                    self._unsynced.add(path)
+                else:
+                    os.fsync(fp.fileno())
+
+            for doc_id, document, record in records:
+                self._add(doc_id, document)
+                self._offset += len(record)
+
+            if self._offset >= self.segment_size:
+                self._seal(self._segment)
+            return [doc_id for doc_id, _, _ in records]
+
+    @contextmanager
+    def batch(self):
+        # appends inside reach the disk with one fsync, at the end
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock, self._thread_lock:
+            self._batch_depth += 1
+            try:
+                yield
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    for path in self._unsynced:
+                        # sealed meanwhile, the .gz copy was synced then
+                        if os.path.exists(path):
+                            with open(path, "ab") as fp:
+                                os.fsync(fp.fileno())
+                    self._unsynced.clear()
+
+    def _seal(self, segment):
+        sealed = self._path(segment, sealed=True)
+        with open(self._path(segment), "rb") as fp:
+            data = fp.read()
+        with gzip.open(f"{sealed}.tmp", "wb") as fp:
+            fp.write(data)
+        with open(f"{sealed}.tmp", "rb") as fp:
+            os.fsync(fp.fileno())
+        os.replace(f"{sealed}.tmp", sealed)
+        os.remove(self._path(segment))
+        self._segment, self._offset = segment + 1, 0
+
+    def recover(self):
+        # A crash between writing NNNNNNNN.log.gz and removing NNNNNNNN.log
+        # leaves both, the sealed copy is complete
+        if not os.path.isdir(self.directory):
+            return
+        with self._lock:
+            for segment in self._segments():
+                if os.path.exists(self._path(segment, sealed=True)):
+                    if os.path.exists(self._path(segment)):
+                        os.remove(self._path(segment))
+            for f in os.listdir(self.directory):
+                if f.endswith(".tmp"):
+                    os.remove(os.path.join(self.directory, f))
+
+    def insert(self, document):
+        return self._append([document])[0]
+
+    def insert_multiple(self, documents):
+        return self._append(list(documents))
+
+    def all(self):
+        return [Document(dict(d), d.doc_id) for d in self._documents_for_read()]
+
+    def _candidates(self, cond):
+        with self._thread_lock:
+            documents = self._documents_for_read()
+            doc_ids = plan(self._indexes, cond)
+            if doc_ids is None:
+                return list(documents)
+            return [self._by_id[doc_id] for doc_id in sorted(doc_ids)]
+
+    def search(self, cond):
+        return [Document(dict(d), d.doc_id) for d in self._candidates(cond) if cond(d)]
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        self._documents_for_read()
+        if doc_id is not None:
+            document = self._by_id.get(doc_id)
+            return Document(dict(document), doc_id) if document is not None else None
+        if doc_ids is not None:
+            return [self.get(doc_id=doc_id) for doc_id in doc_ids if doc_id in self._by_id]
+        if cond is None:
+            raise RuntimeError("You have to pass either cond or doc_id or doc_ids")
+        for document in self._candidates(cond):
+            if cond(document):
+                return Document(dict(document), document.doc_id)
+        return None
+
+    def contains(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            return self.get(doc_id=doc_id) is not None
+        return self.get(cond) is not None
+
+    def count(self, cond):
+        return len(self.search(cond))
+
+    def __len__(self):
+        return len(self._documents_for_read())
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def _append_only(self, *args, **kwargs):
+        raise RuntimeError(f"{self.name} is append-only")
+
+    update = upsert = remove = truncate = _append_only
+
+    def clear_cache(self):
+        pass
+
+
+class ScoreJournal:
+    def __init__(self, directory, segment_size, lock_factory=None, shared=False):
+        self.directory = directory
+        self._tables = {}
+        for name in journal_tables:
+            lock = lock_factory(os.path.join(directory, name, "lock")) if lock_factory else None
+            self._tables[name] = JournalTable(directory, name, segment_size, lock, shared)
+
+    def __contains__(self, name):
+        return name in self._tables
+
+    def table(self, name):
+        return self._tables[name]
+
+    def recover(self):
+        for table in self._tables.values():
+            table.recover()
+
+    def import_documents(self, name, documents):
+        # Moves rows over from db.json, keeping doc_ids and skipping the
+        # ones a previous, interrupted import already copied
+        table = self._tables[name]
+        os.makedirs(table.directory, exist_ok=True)
+        with table._lock:
+            table._documents_for_read()
+            missing = [d for d in documents if d.doc_id not in table._by_id]
+            for start in range(0, len(missing), 1000):
+                table.insert_multiple(missing[start : start + 1000])
+        return len(missing)
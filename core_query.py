@@ -0,0 +1,204 @@
+import config
+
+import os
+
+from bisect import bisect_left, insort
+
+
+# Fields the handlers look documents up by, per table. Each tuple is one
+# index; the score tables list their compound keys so a lookup of a single
+# chart does not have to scan every score of every player.
+table_indexes = {
+    "iidx_profile": (("card",), ("refid",), ("iidx_id",)),
+    "iidx_scores": (("iidx_id",), ("music_id",)),
+    "iidx_scores_best": (
+        ("iidx_id", "play_style", "music_id", "chart_id"),
+        ("music_id", "chart_id", "play_style"),
+    ),
+    "iidx_score_stats": (("music_id", "chart_id", "play_style"),),
+    "iidx_class_best": (("iidx_id", "game_version", "gtype"),),
+    "ddr_profile": (("card",), ("refid",), ("ddr_id",)),
+    "ddr_scores": (("ddr_id", "game_version", "mcode", "difficulty"), ("mcode",)),
+    "ddr_scores_best": (
+        ("ddr_id", "game_version", "mcode", "difficulty"),
+        ("mcode",),
+    ),
+    "sdvx_profile": (("card",), ("refid",), ("sdvx_id",)),
+    "sdvx_scores_best": (("sdvx_id", "game_version", "music_id", "music_type"),),
+    "gitadora_profile": (("card",), ("refid",), ("gitadora_id",)),
+    "guitarfreaks_scores": (("gitadora_id", "musicid", "seq"), ("mcode",)),
+    "guitarfreaks_scores_best": (("gitadora_id", "musicid", "seq"), ("mcode",)),
+    "drummania_scores": (("gitadora_id", "musicid", "seq"), ("mcode",)),
+    "drummania_scores_best": (("gitadora_id", "musicid", "seq"), ("mcode",)),
+    "nostalgia_profile": (("card",), ("refid",), ("nostalgia_id",)),
+    "nostalgia_scores_best": (("nostalgia_id", "music_index", "sheet_type"),),
+    "dancerush_profile": (("card",), ("refid",), ("drs_id",)),
+    "drs_scores_best": (("drs_id", "game_version", "music_id", "music_type"),),
+    "polaris_profile": (("card",), ("refid",), ("usr_id",)),
+    "polaris_score": (("usr_id",),),
+    "paseli": (("cardid",),),
+    "shop": (("pcbid",),),
+}
+
+# Database file (shard) each table lives in, by table name prefix. Tables
+# matching none of them (shop, paseli) go to "core".
+shard_prefixes = {
+    "iidx": ("iidx_",),
+    "ddr": ("ddr_",),
+    "sdvx": ("sdvx_",),
+    "gitadora": ("gitadora_", "guitarfreaks_", "drummania_"),
+    "polaris": ("polaris_",),
+    "nostalgia": ("nostalgia_",),
+    "dancerush": ("dancerush_", "drs_"),
+}
+
+
+def shard_for(name):
+    for shard, prefixes in shard_prefixes.items():
+        if name.startswith(prefixes):
+            return shard
+    return "core"
+
+
+def db_file(name):
+    """The TinyDB file holding table name, for tools that open the files
+    themselves: db_dir/<shard>.json once the database is sharded, db.json
+    before that."""
+    if os.path.isdir(config.db_dir):
+        return os.path.join(config.db_dir, f"{shard_for(name)}.json")
+    return "db.json"
+
+
+# Values that compare the same in Python and in SQLite/JSON
+_plain_types = (str, int, float, bool)
+
+
+def equality_terms(cond):
+    """Return {field: value} for the top-level ``where(field) == value``
+    terms of a TinyDB query joined by ``&``. A document matching ``cond``
+    matches every term, so the terms can narrow the candidates before the
+    query itself is run on them. Terms on nested paths, None and container
+    values are left out; so is anything under ``|`` or ``~``."""
+    terms = {}
+
+    def walk(hashval):
+        if not isinstance(hashval, tuple) or not hashval:
+            return
+        if hashval[0] == "and":
+            for part in hashval[1]:
+                walk(part)
+        elif hashval[0] == "==" and len(hashval) == 3:
+            _, path, value = hashval
+            if (
+                len(path) == 1
+                and isinstance(path[0], str)
+                and isinstance(value, _plain_types)
+            ):
+                terms.setdefault(path[0], value)
+
+    walk(getattr(cond, "_hash", None))
+    return terms
+
+
+def _index_value(value):
+    # Numbers compare equal across int/float/bool in Python, so they share
+    # one rank; strings sort after them. Anything else is not indexed.
+    if isinstance(value, (bool, int, float)):
+        return (0, value)
+    if isinstance(value, str):
+        return (1, value)
+    return None
+
+
+class TableIndex:
+    """In-memory index of one table on ``fields``. A single field is a
+    hash index; several fields also keep their keys sorted, so a query on
+    a leading subset of them is a range scan. A document is indexed on the
+    leading fields it holds a scalar for: an equality term on a scalar can
+    never match a missing field or a list."""
+
+    def __init__(self, fields):
+        self.fields = fields
+        self._keys = {}
+        self._entries = {}
+        self._sorted = [] if len(fields) > 1 else None
+
+    def _key(self, values):
+        key = []
+        for value in values:
+            value = _index_value(value)
+            if value is None:
+                break
+            key.append(value)
+        return tuple(key)
+
+    def add(self, doc_id, document):
+        key = self._key(
+            document[field] if field in document else None for field in self.fields
+        )
+        if not key:
+            return
+        self._keys[doc_id] = key
+        doc_ids = self._entries.get(key)
+        if doc_ids is None:
+            doc_ids = self._entries[key] = set()
+            if self._sorted is not None:
+                insort(self._sorted, key)
+        doc_ids.add(doc_id)
+
+    def remove(self, doc_id):
+        key = self._keys.pop(doc_id, None)
+        if key is None:
+            return
+        doc_ids = self._entries[key]
+        doc_ids.discard(doc_id)
+        if not doc_ids:
+            del self._entries[key]
+            if self._sorted is not None:
+                del self._sorted[bisect_left(self._sorted, key)]
+
+    def clear(self):
+        self._keys.clear()
+        self._entries.clear()
+        if self._sorted is not None:
+            self._sorted.clear()
+
+    def prefix(self, terms):
+        """Number of leading fields ``terms`` gives a value for."""
+        count = 0
+        for field in self.fields:
+            if field not in terms:
+                break
+            count += 1
+        return count
+
+    def lookup(self, terms):
+        """doc_ids whose leading fields equal ``terms``."""
+        count = self.prefix(terms)
+        key = self._key(terms[field] for field in self.fields[:count])
+        if len(key) == len(self.fields):
+            return set(self._entries.get(key, ()))
+
+        doc_ids = set()
+        position = bisect_left(self._sorted, key)
+        while position < len(self._sorted) and self._sorted[position][:len(key)] == key:
+            doc_ids.update(self._entries[self._sorted[position]])
+            position += 1
+        return doc_ids
+
+
+def build_indexes(name):
+    return [TableIndex(fields) for fields in table_indexes.get(name, ())]
+
+
+def plan(indexes, cond):
+    """Candidate doc_ids for ``cond`` from the index covering most of its
+    equality terms, or None when no index applies and the table has to be
+    scanned. Candidates still have to be checked against ``cond``."""
+    terms = equality_terms(cond)
+    if not terms or not indexes:
+        return None
+    best = max(indexes, key=lambda index: index.prefix(terms))
+    if not best.prefix(terms):
+        return None
+    return best.lookup(terms)
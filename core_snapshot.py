@@ -0,0 +1,118 @@
+import config
+
+import asyncio
+import copy
+import time
+
+from core_database import get_async_db
+from core_query import build_indexes, plan
+
+
+# The web API (/iidx, /ddr, /gfdm) reads whole tables. Instead of walking
+# the live tables next to the cabinets, it reads a snapshot: a copy of the
+# table taken on a DB thread, never changed afterwards and replaced as a
+# whole by a newer generation once it is older than api_snapshot_max_age.
+# A stale snapshot is still served while the next one is being taken.
+
+
+class Snapshot:
+    def __init__(self, name, documents):
+        self.name = name
+        self.taken = time.time()
+        self.documents = tuple(documents)
+        self._by_id = {}
+        self._indexes = build_indexes(name)
+        for document in self.documents:
+            self._by_id[document.doc_id] = document
+            for index in self._indexes:
+                index.add(document.doc_id, document)
+
+    def __len__(self):
+        return len(self.documents)
+
+    def age(self):
+        return time.time() - self.taken
+
+    def all(self):
+        return list(self.documents)
+
+    def search(self, cond):
+        doc_ids = plan(self._indexes, cond)
+        if doc_ids is None:
+            candidates = self.documents
+        else:
+            candidates = [self._by_id[doc_id] for doc_id in sorted(doc_ids)]
+        return [document for document in candidates if cond(document)]
+
+    def get(self, cond):
+        documents = self.search(cond)
+        return documents[0] if documents else None
+
+
+def take_snapshot(db, name):
+    # a plain Table's all() only copies the top level, nested dicts like
+    # profile["version"] would still be the live ones; a snapshot owns its own
+    return Snapshot(name, copy.deepcopy(db.table(name).all()))
+
+
+class SnapshotStore:
+    def __init__(self, async_db, max_age):
+        self.async_db = async_db
+        self.max_age = max_age
+        self._snapshots = {}
+        self._refreshing = {}
+        # bumped by invalidate(), a copy started before is not kept
+        self._generations = {}
+
+    async def table(self, name):
+        snapshot = self._snapshots.get(name)
+        if snapshot is None:
+            return await self._refresh(name)
+        if snapshot.age() > self.max_age:
+            self._refresh(name)
+        return snapshot
+
+    def _refresh(self, name):
+        task = self._refreshing.get(name)
+        if task is None:
+            task = self._refreshing[name] = asyncio.ensure_future(self._take(name))
+        return task
+
+    async def _take(self, name):
+        generation = self._generations.get(name, 0)
+        try:
+            snapshot = await self.async_db.run(take_snapshot, self.async_db.db, name)
+        finally:
+            if self._refreshing.get(name) is asyncio.current_task():
+                del self._refreshing[name]
+        if self._generations.get(name, 0) == generation:
+            self._snapshots[name] = snapshot
+        return snapshot
+
+    def invalidate(self, name):
+        """Drop the snapshot of name after a write through the API, the
+        next read waits for a fresh one."""
+        self._generations[name] = self._generations.get(name, 0) + 1
+        self._snapshots.pop(name, None)
+        self._refreshing.pop(name, None)
+
+    def get_stats(self):
+        return {
+            name: {"rows": len(snapshot), "age_s": round(snapshot.age(), 3)}
+            for name, snapshot in self._snapshots.items()
+        }
+
+
+snapshots = SnapshotStore(get_async_db(), config.api_snapshot_max_age)
+
+
+def get_snapshots():
+    return snapshots
+
+
+async def snapshot_table(name, response):
+    """Snapshot of table name for an API route, with its age in seconds
+    reported in the X-Snapshot-Age header of response."""
+    snapshot = await snapshots.table(name)
+    response.headers["X-Snapshot-Age"] = f"{snapshot.age():.3f}"
+    return snapshot
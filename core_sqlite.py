@@ -0,0 +1,259 @@
+import json
+import sqlite3
+import threading
+
+from collections.abc import Mapping
+from contextlib import contextmanager
+
+from tinydb.table import Document
+
+from core_query import equality_terms, table_indexes
+
+
+# Drop-in for the TinyDB object returned by get_db(). Every table is an
+# SQLite table of (doc_id, JSON document) with expression indexes on the
+# fields in core_query.table_indexes. Queries are still TinyDB queries:
+# their top-level equality terms select the candidate rows through the
+# indexes, then the query itself decides which of those match.
+
+
+def _quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _column(field):
+    # Must be spelled the same in CREATE INDEX and in WHERE for SQLite to
+    # use the index, so it is inlined rather than bound
+    path = "$." + json.dumps(field)
+    return "json_extract(data, '" + path.replace("'", "''") + "')"
+
+
+def _dumps(document):
+    return json.dumps(dict(document), ensure_ascii=False)
+
+
+class SQLiteTable:
+    def __init__(self, db, name):
+        self._db = db
+        self.name = name
+        self._sql_name = _quote(name)
+
+        with db.transaction() as con:
+            con.execute(
+                f"CREATE TABLE IF NOT EXISTS {self._sql_name} "
+                "(doc_id INTEGER PRIMARY KEY, data TEXT NOT NULL)"
+            )
+            for fields in table_indexes.get(name, ()):
+                con.execute(
+                    "CREATE INDEX IF NOT EXISTS "
+                    f"{_quote(name + ':' + '+'.join(fields))} ON {self._sql_name} "
+                    f"({', '.join(_column(field) for field in fields)})"
+                )
+
+    def __repr__(self):
+        return f"<SQLiteTable name={self.name!r}>"
+
+    def _rows(self, con, cond=None, doc_ids=None):
+        sql = f"SELECT doc_id, data FROM {self._sql_name}"
+        params = []
+        if doc_ids is not None:
+            doc_ids = list(doc_ids)
+            sql += f" WHERE doc_id IN ({', '.join('?' * len(doc_ids))})"
+            params.extend(doc_ids)
+        elif cond is not None:
+            terms = equality_terms(cond)
+            if terms:
+                sql += " WHERE " + " AND ".join(f"{_column(f)} = ?" for f in terms)
+                params.extend(terms.values())
+        sql += " ORDER BY doc_id"
+
+        for doc_id, data in con.execute(sql, params):
+            document = Document(json.loads(data), doc_id)
+            if cond is None or cond(document):
+                yield document
+
+    def all(self):
+        return list(self._rows(self._db.connection()))
+
+    def search(self, cond):
+        return list(self._rows(self._db.connection(), cond))
+
+    def get(self, cond=None, doc_id=None, doc_ids=None):
+        con = self._db.connection()
+        if doc_id is not None:
+            return next(self._rows(con, doc_ids=[doc_id]), None)
+        if doc_ids is not None:
+            return list(self._rows(con, doc_ids=doc_ids))
+        if cond is None:
+            raise RuntimeError("You have to pass either cond or doc_id or doc_ids")
+        return next(self._rows(con, cond), None)
+
+    def contains(self, cond=None, doc_id=None):
+        if doc_id is not None:
+            return self.get(doc_id=doc_id) is not None
+        return self.get(cond) is not None
+
+    def count(self, cond):
+        return len(self.search(cond))
+
+    def __len__(self):
+        con = self._db.connection()
+        return con.execute(f"SELECT COUNT(*) FROM {self._sql_name}").fetchone()[0]
+
+    def __iter__(self):
+        return iter(self.all())
+
+    def insert(self, document):
+        if not isinstance(document, Mapping):
+            raise ValueError("Document is not a Mapping")
+        doc_id = document.doc_id if isinstance(document, Document) else None
+
+        with self._db.transaction() as con:
+            try:
+                cursor = con.execute(
+                    f"INSERT INTO {self._sql_name} (doc_id, data) VALUES (?, ?)",
+                    (doc_id, _dumps(document)),
+                )
+            except sqlite3.IntegrityError:
+                raise ValueError(f"Document with ID {doc_id} already exists") from None
+            return cursor.lastrowid
+
+    def insert_multiple(self, documents):
+        with self._db.transaction():
+            return [self.insert(document) for document in documents]
+
+    def update(self, fields, cond=None, doc_ids=None):
+        with self._db.transaction() as con:
+            updated = []
+            for document in list(self._rows(con, cond, doc_ids)):
+                if callable(fields):
+                    fields(document)
+                else:
+                    document.update(fields)
+                con.execute(
+                    f"UPDATE {self._sql_name} SET data = ? WHERE doc_id = ?",
+                    (_dumps(document), document.doc_id),
+                )
+                updated.append(document.doc_id)
+            return updated
+
+    def upsert(self, document, cond=None):
+        if isinstance(document, Document) and hasattr(document, "doc_id"):
+            doc_ids = [document.doc_id]
+        else:
+            doc_ids = None
+
+        if doc_ids is None and cond is None:
+            raise ValueError(
+                "If you don't specify a search query, you must "
+                "specify a doc_id. Hint: use a table.Document "
+                "object."
+            )
+
+        # One transaction, so two workers upserting the same key cannot
+        # both miss and both insert
+        with self._db.transaction():
+            updated = self.update(document, cond, doc_ids)
+            if updated:
+                return updated
+            return [self.insert(document)]
+
+    def remove(self, cond=None, doc_ids=None):
+        if cond is None and doc_ids is None:
+            raise RuntimeError("Use truncate() to remove all documents")
+
+        with self._db.transaction() as con:
+            removed = [document.doc_id for document in self._rows(con, cond, doc_ids)]
+            con.executemany(
+                f"DELETE FROM {self._sql_name} WHERE doc_id = ?",
+                [(doc_id,) for doc_id in removed],
+            )
+            return removed
+
+    def truncate(self):
+        with self._db.transaction() as con:
+            con.execute(f"DELETE FROM {self._sql_name}")
+
+    def clear_cache(self):
+        pass
+
+
+class SQLiteDB:
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+        self._tables = {}
+        self._tables_lock = threading.Lock()
+
+    def connection(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.depth = 0
+        return con
+
+    @contextmanager
+    def transaction(self):
+        # Reentrant, so upsert() can run update() and insert() in the same
+        # transaction. IMMEDIATE takes the write lock up front.
+        con = self.connection()
+        self._local.depth += 1
+        if self._local.depth > 1:
+            try:
+                yield con
+            finally:
+                self._local.depth -= 1
+            return
+
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        else:
+            con.execute("COMMIT")
+        finally:
+            self._local.depth -= 1
+
+    def atomic(self, name):
+        # the write lock is per database file
+        return self.transaction()
+
+    def batch(self, names):
+        return self.transaction()
+
+    def table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            with self._tables_lock:
+                table = self._tables.get(name)
+                if table is None:
+                    table = self._tables[name] = SQLiteTable(self, name)
+        return table
+
+    def tables(self):
+        rows = self.connection().execute(
+            "SELECT name FROM sqlite_master "
+            "WHERE type = 'table' AND name NOT LIKE 'sqlite%'"
+        )
+        return {name for (name,) in rows}
+
+    def drop_table(self, name):
+        with self._tables_lock:
+            self._tables.pop(name, None)
+        with self.transaction() as con:
+            con.execute(f"DROP TABLE IF EXISTS {_quote(name)}")
+
+    def drop_tables(self):
+        for name in self.tables():
+            self.drop_table(name)
+
+    def close(self):
+        con = getattr(self._local, "con", None)
+        if con is not None:
+            con.close()
+            self._local.con = None
@@ -0,0 +1,189 @@
+import config
+
+import json
+import sqlite3
+import threading
+import time
+
+from contextlib import contextmanager
+from copy import deepcopy
+
+
+# Ephemeral state shared by request handlers (lobby hosts, PASELI sessions).
+# With a single worker it lives in memory; with several workers it goes
+# through a SQLite file so every process sees the same values. Values must
+# be JSON serializable. update() is an atomic read-modify-write.
+# Expired keys are dropped when read, and by writes at most every
+# SWEEP_INTERVAL seconds, since some are never read again.
+
+SWEEP_INTERVAL = 60
+
+
+class MemoryState:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+        self._next_sweep = 0
+
+    def _get(self, key, default):
+        value, expires = self._data.get(key, (default, None))
+        if expires is not None and expires < time.time():
+            del self._data[key]
+            return default
+        return value
+
+    def _sweep(self, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        for key, (_, expires) in list(self._data.items()):
+            if expires is not None and expires < now:
+                del self._data[key]
+
+    def _set(self, key, value, ttl):
+        now = time.time()
+        self._sweep(now)
+        self._data[key] = (value, now + ttl if ttl else None)
+
+    def get(self, key, default=None):
+        with self._lock:
+            return deepcopy(self._get(key, default))
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._set(key, deepcopy(value), ttl)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def update(self, key, func, default=None, ttl=None):
+        with self._lock:
+            value = func(deepcopy(self._get(key, default)))
+            self._set(key, value, ttl)
+            return deepcopy(value)
+
+    def incr(self, key):
+        return self.update(key, lambda value: value + 1, 0)
+
+
+class SQLiteState:
+    def __init__(self, filename):
+        self.filename = filename
+        self._local = threading.local()
+        self._next_sweep = 0
+
+        with self._transaction() as con:
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS state "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL)"
+            )
+
+    def _connection(self):
+        con = getattr(self._local, "con", None)
+        if con is None:
+            con = sqlite3.connect(self.filename, timeout=30, isolation_level=None)
+            con.execute("PRAGMA journal_mode=WAL")
+            self._local.con = con
+        return con
+
+    @contextmanager
+    def _transaction(self):
+        con = self._connection()
+        # IMMEDIATE takes the write lock up front, so concurrent
+        # read-modify-writes from other workers queue up behind it
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            yield con
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+        else:
+            con.execute("COMMIT")
+
+    def _get(self, con, key, default):
+        row = con.execute(
+            "SELECT value, expires FROM state WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] is not None and row[1] < time.time():
+            return default
+        return json.loads(row[0])
+
+    def _sweep(self, con, now):
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + SWEEP_INTERVAL
+        con.execute(
+            "DELETE FROM state WHERE expires IS NOT NULL AND expires < ?", (now,)
+        )
+
+    def _set(self, con, key, value, ttl):
+        now = time.time()
+        self._sweep(con, now)
+        con.execute(
+            "INSERT OR REPLACE INTO state (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value), now + ttl if ttl else None),
+        )
+
+    def get(self, key, default=None):
+        return self._get(self._connection(), key, default)
+
+    def set(self, key, value, ttl=None):
+        with self._transaction() as con:
+            self._set(con, key, value, ttl)
+
+    def delete(self, key):
+        with self._transaction() as con:
+            con.execute("DELETE FROM state WHERE key = ?", (key,))
+
+    def update(self, key, func, default=None, ttl=None):
+        with self._transaction() as con:
+            value = func(self._get(con, key, default))
+            self._set(con, key, value, ttl)
+            return value
+
+    def incr(self, key):
+        return self.update(key, lambda value: value + 1, 0)
+
+    def purge(self):
+        self._next_sweep = 0
+        with self._transaction() as con:
+            self._sweep(con, time.time())
+
+
+class ResponseCache(dict):
+    # Rendered bodies of core_prepare_cached_response, in process memory.
+    # A body is rendered from data read before the codec runs, so a write
+    # landing meanwhile must keep it out: invalidate() bumps the generation
+    # of the keys it drops, including ones not stored yet, and a body is
+    # only stored if its key's generation is the one it started with.
+
+    def __init__(self):
+        super().__init__()
+        self._generations = {}
+
+    def generation(self, key):
+        return self._generations.setdefault(key, 0)
+
+    def store(self, key, value, generation):
+        if self._generations.get(key, 0) == generation:
+            self[key] = value
+
+    def invalidate(self, match=None):
+        """Drop the bodies whose key match(key) is true, all of them
+        without match."""
+        for key in set(self) | set(self._generations):
+            if match is None or match(key):
+                self.pop(key, None)
+                self._generations[key] = self._generations.get(key, 0) + 1
+
+
+if config.workers > 1:
+    state = SQLiteState(config.state_file)
+    state.purge()
+else:
+    state = MemoryState()
+
+
+def get_state():
+    return state
@@ -1,8 +1,13 @@
+import re
+
+from functools import lru_cache
 from importlib import util
+from inspect import iscoroutinefunction
 from os import path
 from glob import glob
 
-from fastapi import APIRouter, Request
+from fastapi import APIRouter, Request, Response
+from fastapi.routing import APIRoute
 from typing import Optional
 
 routers = []
@@ -26,6 +31,110 @@ for module_path in [
 router = APIRouter(tags=["slashless_forwarder"])
 
 
+def _template_key(segment):
+    # "sv{ver}_common" -> "sv_common", "{ver}_gametop" -> "gametop"
+    return re.sub(r"\{[^}]*\}", "", segment).strip("_").lower()
+
+
+def _split_method_digits(module, method):
+    # KFC: sv6_common -> sv_common, "6"
+    return module, "".join(c for c in method if not c.isdigit()), (
+        "".join(filter(str.isdigit, method)),
+    )
+
+
+def _split_module_prefix(module, method):
+    # M32: <ver>_gametop -> gametop, "<ver>"
+    gd_module = module.split("_")
+    return gd_module[-1], method, (gd_module[0],)
+
+
+def _split_method_suffix(module, method):
+    # REC: get_playdata_1 -> get_playdata, "1"
+    method, _, player = method.rpartition("_")
+    return module, method, (player,)
+
+
+# URL slash 0 puts version/player numbers into module and method names
+# where the prefixed routes have path parameters
+slashless_normalizers = {
+    "KFC": _split_method_digits,
+    "M32": _split_module_prefix,
+    "REC": _split_method_suffix,
+}
+
+# Handlers without a prefixed route of their own, found by function name
+slashless_function_prefixes = {
+    "LAV": "polaris_",
+    "XIF": "polaris_",
+}
+
+# (model or None, module, method or None) -> (endpoint, has path parameters)
+forward_table = {}
+
+
+def build_forward_table():
+    forward_table.clear()
+    _resolve.cache_clear()
+
+    for r in routers:
+        if not r.tags or r.tags[0].startswith("api_") or r is router:
+            continue
+
+        models = getattr(r, "model_whitelist", None) or [None]
+
+        for route in r.routes:
+            if not isinstance(route, APIRoute):
+                continue
+
+            segments = route.path.strip("/").split("/")
+            if "{gameinfo}" in segments:
+                # /<prefix>/{gameinfo}/<module>/<method>
+                module, method = segments[segments.index("{gameinfo}") + 1 :]
+                key = (_template_key(module), _template_key(method))
+                has_params = "{" in module or "{" in method
+            else:
+                # dispatchers that resolve the method themselves (polaris)
+                key = (r.prefix.strip("/").split("/")[-1].lower(), None)
+                has_params = False
+
+            for model in models:
+                forward_table.setdefault((model, *key), (route.endpoint, has_params))
+
+    for model, prefix in slashless_function_prefixes.items():
+        for name, obj in list(globals().items()):
+            if name.startswith(prefix) and iscoroutinefunction(obj):
+                module, _, method = name[len(prefix) :].partition("_")
+                forward_table.setdefault((model, module, method.lower()), (obj, False))
+
+
+def resolve_slashless(model, module, method):
+    game_code = model.split(":")[0] if model else None
+    return _resolve(game_code, module, method)
+
+
+# module and method come from the client as they are, so the memo is bounded:
+# every KFC digit variant (sv123456_common) is a key of its own
+@lru_cache(maxsize=1024)
+def _resolve(game_code, module, method):
+    extra = ()
+    found = (
+        forward_table.get((game_code, module.lower(), method.lower()))
+        or forward_table.get((None, module.lower(), method.lower()))
+        or forward_table.get((game_code, module.lower(), None))
+    )
+
+    if found is None and game_code in slashless_normalizers:
+        module, method, extra = slashless_normalizers[game_code](module, method)
+        found = forward_table.get((game_code, module.lower(), method.lower()))
+
+    if found is None:
+        return None
+
+    endpoint, has_params = found
+    return endpoint, extra if has_params else ()
+
+
 @router.post("/fwdr")
 async def forward_slashless(
     request: Request,
@@ -37,45 +146,30 @@ async def forward_slashless(
     if f != None:
         module, method = f.split(".")
 
-    try:
-        find_response = globals()[f"{module}_{method}".lower()]
-        return await find_response(request)
-    except KeyError:
-        try:
-            game_code = model.split(":")[0]
-            # TODO: check for more edge cases
-            if game_code == "MDX" and module == "eventlog" or module == "eventlog_2":
-                find_response = globals()[f"ddr_{module}_{method}"]
-            elif game_code == "REC":
-                find_response = globals()[f"drs_{module}_{method}"]
-            elif game_code == "KFC":
-                if module == "eventlog":
-                    find_response = globals()[f"sdvx_{module}_{method}"]
-                else:
-                    sdvx_ver = "".join(filter(str.isdigit, method))
-                    find_response = globals()[f"{module}_{"".join([i for i in method if not i.isdigit()])}"]
-                    return await find_response(sdvx_ver, request)
-            elif game_code == "M32":
-                if module == "lobby":
-                    find_response = globals()[f"gitadora_{module}_{method}"]
-                else:
-                    gd_module = module.split("_")
-                    find_response = globals()[f"gitadora_{gd_module[-1]}_{method}"]
-                    return await find_response(gd_module[0], request)
-            elif game_code == "LAV" or game_code == "XIF":
-                find_response = globals()[f"polaris_{module}_{method}"]
-            return await find_response(request)
-        except (KeyError, UnboundLocalError) as e:
-            print(f"FWDR DEBUG: 404 Error. f='{f}' model='{model}'")
-            print(f"FWDR DEBUG: Parsed -> module='{module}' method='{method}' game_code='{model.split(':')[0] if model else 'None'}'")
-            print(f"FWDR DEBUG: Exception: {e}")
-            target_key = f"polaris_{module}_{method}"
-            if request.url.path == "/fwdr":
-                 print(f"FWDR DEBUG: Target globals key expected: '{target_key}'")
-                 print(f"FWDR DEBUG: Key in globals: {target_key in globals()}")
-            
-            print("Try URL Slash 1 (On) if this game is supported.")
-            return Response(status_code=404)
+    resolved = resolve_slashless(model, module or "", method or "")
+
+    if resolved is None:
+        print(f"FWDR: no handler for model='{model}' module='{module}' method='{method}'")
+        print("Try URL Slash 1 (On) if this game is supported.")
+        return Response(status_code=404)
+
+    find_response, extra = resolved
+    return await find_response(*extra, request)
+
+
+@router.get("/fwdr")
+async def forward_slashless_table():
+    return [
+        {
+            "model": model,
+            "module": module,
+            "method": method,
+            "handler": endpoint.__name__,
+            "path_params": has_params,
+        }
+        for (model, module, method), (endpoint, has_params) in forward_table.items()
+    ]
 
 
 routers.append(router)
+build_forward_table()
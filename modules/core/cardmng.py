@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Request, Response
 from tinydb import Query, where
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, games, E
 from core_database import get_db
 
 router = APIRouter(prefix="/core", tags=["cardmng"])
@@ -13,20 +13,7 @@ def to_refid(cid):
 
 
 def get_target_table(game_id):
-    target_table = {
-        "LDJ": "iidx_profile",
-        "MDX": "ddr_profile",
-        "KFC": "sdvx_profile",
-        "M32": "gitadora_profile",
-        "PAN": "nostalgia_profile",
-        "REC": "dancerush_profile",
-        "JDZ": "iidx_profile",
-        "KDZ": "iidx_profile",
-        "LAV": "polaris_profile",
-        "XIF": "polaris_profile",
-    }
-
-    return target_table[game_id]
+    return games[game_id]["profile_table"]
 
 
 def get_profile(game_id, cid):
@@ -4,12 +4,13 @@ from fastapi import APIRouter, Request, Response
 from tinydb import where
 
 from core_common import core_process_request, core_prepare_response, E
-from core_database import get_db
+from core_database import get_async_db, get_db
+from core_state import get_state
 
 router = APIRouter(prefix="/core", tags=["eacoin"])
 
-sessid = 0
-payments = {}
+# PASELI sessions outlive a credit (IIDX movie or gacha purchases)
+PAYMENT_TTL = 24 * 60 * 60
 
 @router.post("/{gameinfo}/eacoin/checkin")
 async def eacoin_checkin(request: Request):
@@ -23,9 +24,8 @@ async def eacoin_checkin(request: Request):
     bal = get_db().table("paseli").get(where("cardid") == cardid)
     bal = {} if bal is None else bal
 
-    global sessid
-    sessid += 1
-    payments[sessid] = cardid
+    sessid = get_state().incr("eacoin.sessid")
+    get_state().set(f"eacoin.payment.{sessid}", cardid, ttl=PAYMENT_TTL)
 
     response = E.response(
         E.eacoin(
@@ -59,7 +59,7 @@ async def eacoin_consume(request: Request):
     sessid = int(request_info["root"][0].find("sessid").text)
     payment = int(request_info["root"][0].find("payment").text)
 
-    cardid = payments.get(sessid, None)
+    cardid = get_state().get(f"eacoin.payment.{sessid}")
 
     # fallback if server is restarted mid-round for IIDX movie or gacha purchases
     if cardid == None:
@@ -74,21 +74,34 @@ async def eacoin_consume(request: Request):
         response_body, response_headers = await core_prepare_response(request, response)
         return Response(content=response_body, headers=response_headers)
 
-    bal = get_db().table("paseli").get(where("cardid") == cardid)
-    if bal == None:
-        bal = {
+    new_balance = None
+
+    def consume(bal):
+        nonlocal new_balance
+        if bal == None:
+            bal = {
+                "cardid": cardid,
+                "balance": config.paseli,
+                "total_spent": 0,
+            }
+
+        new_balance = bal["balance"] - payment
+
+        paseli_card = {
             "cardid": cardid,
-            "balance": config.paseli,
-            "total_spent": 0,
+            "balance": new_balance,
+            "total_spent": bal["total_spent"] + payment,
         }
 
-    new_balance = bal["balance"] - payment
+        if new_balance < 1000 or new_balance > config.paseli:
+            paseli_card["balance"] = config.paseli
 
-    paseli_card = {
-        "cardid": cardid,
-        "balance": new_balance,
-        "total_spent": bal["total_spent"] + payment,
-    }
+        return paseli_card
+
+    # two purchases on the same card must not both start from the old balance
+    await get_async_db().table("paseli").update_with(
+        where("cardid") == cardid, consume
+    )
 
     response = E.response(
         E.eacoin(
@@ -98,12 +111,7 @@ async def eacoin_consume(request: Request):
         )
     )
 
-    if new_balance < 1000 or new_balance > config.paseli:
-        paseli_card["balance"] = config.paseli
-
-    get_db().table("paseli").upsert(paseli_card, where("cardid") == cardid)
-
-    # del payments[sessid]
+    get_state().delete(f"eacoin.payment.{sessid}")
 
     response_body, response_headers = await core_prepare_response(request, response)
     return Response(content=response_body, headers=response_headers)
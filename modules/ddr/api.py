@@ -3,7 +3,9 @@ from fastapi import APIRouter, Request, Response, File, UploadFile
 from core_common import core_process_request, core_prepare_response, E
 
 from tinydb import Query, where
+from core_blobs import load_ghosts
 from core_database import get_db
+from core_snapshot import get_snapshots, snapshot_table
 from pydantic import BaseModel
 
 import config
@@ -46,14 +48,16 @@ class DDR_Profile_Version_Items(BaseModel):
 
 
 @router.get("/profiles")
-async def ddr_profiles():
-    return get_db().table("ddr_profile").all()
+async def ddr_profiles(response: Response):
+    snapshot = await snapshot_table("ddr_profile", response)
+    return snapshot.all()
 
 
 @router.get("/profiles/{ddr_id}")
-async def ddr_profile_id(ddr_id: str):
+async def ddr_profile_id(ddr_id: str, response: Response):
     ddr_id = int("".join([i for i in ddr_id if i.isnumeric()]))
-    return get_db().table("ddr_profile").get(where("ddr_id") == ddr_id)
+    snapshot = await snapshot_table("ddr_profile", response)
+    return snapshot.get(where("ddr_id") == ddr_id)
 
 
 @router.patch("/profiles/{ddr_id}")
@@ -65,6 +69,7 @@ async def ddr_profile_id_patch(ddr_id: str, item: DDR_Profile_Main_Items):
     profile["pin"] = item.pin
 
     get_db().table("ddr_profile").upsert(profile, where("ddr_id") == ddr_id)
+    get_snapshots().invalidate("ddr_profile")
     return Response(status_code=204)
 
 
@@ -95,11 +100,12 @@ async def ddr_profile_id_version_patch(
 
     profile["version"][str(version)] = game_profile
     get_db().table("ddr_profile").upsert(profile, where("ddr_id") == ddr_id)
+    get_snapshots().invalidate("ddr_profile")
     return Response(status_code=204)
 
 
 @router.get("/card/{card}")
-async def ddr_card_to_profile(card: str):
+async def ddr_card_to_profile(card: str, response: Response):
     card = card.upper()
     lookalike = {
         "I": "1",
@@ -117,40 +123,47 @@ async def ddr_card_to_profile(card: str):
         card = "".join([c for c in card if c in conv.valid_characters])
         uid = conv.to_uid(card)
         kid = card
-    profile = get_db().table("ddr_profile").get(where("card") == uid)
+    snapshot = await snapshot_table("ddr_profile", response)
+    profile = snapshot.get(where("card") == uid)
     return profile
 
 
 @router.get("/scores")
-async def ddr_scores():
-    return get_db().table("ddr_scores").all()
+async def ddr_scores(response: Response):
+    snapshot = await snapshot_table("ddr_scores", response)
+    return load_ghosts(snapshot.all(), binary=False)
 
 
 @router.get("/scores/{ddr_id}")
-async def ddr_scores_id(ddr_id: str):
+async def ddr_scores_id(ddr_id: str, response: Response):
     ddr_id = int("".join([i for i in ddr_id if i.isnumeric()]))
-    return get_db().table("ddr_scores").search((where("ddr_id") == ddr_id))
+    snapshot = await snapshot_table("ddr_scores", response)
+    return load_ghosts(snapshot.search((where("ddr_id") == ddr_id)), binary=False)
 
 
 @router.get("/scores_best")
-async def ddr_scores_best():
-    return get_db().table("ddr_scores_best").all()
+async def ddr_scores_best(response: Response):
+    snapshot = await snapshot_table("ddr_scores_best", response)
+    return load_ghosts(snapshot.all(), binary=False)
 
 
 @router.get("/scores_best/{ddr_id}")
-async def ddr_scores_best_id(ddr_id: str):
+async def ddr_scores_best_id(ddr_id: str, response: Response):
     ddr_id = int("".join([i for i in ddr_id if i.isnumeric()]))
-    return get_db().table("ddr_scores_best").search((where("ddr_id") == ddr_id))
+    snapshot = await snapshot_table("ddr_scores_best", response)
+    return load_ghosts(snapshot.search((where("ddr_id") == ddr_id)), binary=False)
 
 
 @router.get("/mcode/{mcode}/all")
-async def ddr_scores_id(mcode: int):
-    return get_db().table("ddr_scores").search((where("mcode") == mcode))
+async def ddr_scores_id(mcode: int, response: Response):
+    snapshot = await snapshot_table("ddr_scores", response)
+    return load_ghosts(snapshot.search((where("mcode") == mcode)), binary=False)
 
 
 @router.get("/mcode/{mcode}/best")
-async def ddr_scores_id_best(mcode: int):
-    return get_db().table("ddr_scores_best").search((where("mcode") == mcode))
+async def ddr_scores_id_best(mcode: int, response: Response):
+    snapshot = await snapshot_table("ddr_scores_best", response)
+    return load_ghosts(snapshot.search((where("mcode") == mcode)), binary=False)
 
 
 class ARC:
@@ -203,7 +216,8 @@ class ARC:
         else:
             # Compressed
             return lz77_decode(
-                self.__data[fileoffset : (fileoffset + compressedsize)]
+                memoryview(self.__data)[fileoffset : (fileoffset + compressedsize)],
+                size_hint=uncompressedsize,
             )
 
 
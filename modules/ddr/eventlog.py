@@ -2,10 +2,10 @@ import config
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 
 router = APIRouter(prefix="/local2", tags=["local2"])
-router.model_whitelist = ["MDX"]
+router.model_whitelist = game_models("ddr")
 
 
 @router.post("/{gameinfo}/eventlog/write")
@@ -7,13 +7,14 @@ import config
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
-from core_database import get_db
+from core_common import core_process_request, core_prepare_response, game_models, E
+from core_blobs import load_ghost, store_ghost
+from core_database import get_async_db, get_db
 
 from base64 import b64decode, b64encode
 
 router = APIRouter(prefix="/local2", tags=["local2"])
-router.model_whitelist = ["MDX"]
+router.model_whitelist = game_models("ddr")
 
 
 def get_profile(cid):
@@ -231,7 +232,7 @@ async def playerdata_2_usergamedata_advanced(request: Request):
                     E.mcode(record["mcode"], __type="u32"),
                     E.notetype(record["difficulty"], __type="u8"),
                     E.ghostsize(record["ghostsize"], __type="s32"),
-                    E.ghost(record["ghost"], __type="string"),
+                    E.ghost(load_ghost(record["ghost"], binary=False), __type="string"),
                 ),
             )
         )
@@ -269,7 +270,9 @@ async def playerdata_2_usergamedata_advanced(request: Request):
                     judge_ng = int(n.find("judge_ng").text)
                     calorie = int(n.find("calorie").text)
                     ghostsize = int(n.find("ghostsize").text)
-                    ghost = n.find("ghost").text
+                    ghost = await get_async_db().run(
+                        store_ghost, n.find("ghost").text, False
+                    )
                     opt_speed = int(n.find("opt_speed").text)
                     opt_boost = int(n.find("opt_boost").text)
                     opt_appearance = int(n.find("opt_appearance").text)
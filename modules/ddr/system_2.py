@@ -1,11 +1,11 @@
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 
 import utils.card as conv
 
 router = APIRouter(prefix="/local2", tags=["local2"])
-router.model_whitelist = ["MDX"]
+router.model_whitelist = game_models("ddr")
 
 
 @router.post("/{gameinfo}/system_2/convcardnumber")
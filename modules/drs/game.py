@@ -9,11 +9,11 @@ import time
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
-from core_database import get_db
+from core_common import core_process_request, core_prepare_response, game_models, E
+from core_database import get_async_db, get_db
 
 router = APIRouter(prefix="/local", tags=["local"])
-router.model_whitelist = ["REC"]
+router.model_whitelist = game_models("drs")
 
 
 def get_profile(cid):
@@ -370,53 +370,48 @@ async def drs_save_musicscore(request: Request):
     good = int(root.find("member/good").text)
     bad = int(root.find("member/bad").text)
 
-    db = get_db()
-    db.table("drs_scores").insert(
-        {
-            "timestamp": timestamp,
+    def update_best(best):
+        best = {} if best is None else best
+
+        return {
             "game_version": game_version,
             "drs_id": djid,
+            "name": profile["name"],
             "music_id": music_id,
             "music_type": music_type,
-            "mode": mode,
-            "score": score,
-            "rank": rank,
-            "combo": combo,
+            "score": max(score, best.get("score", score)),
+            "rank": max(rank, best.get("rank", rank)),
+            "combo": max(combo, best.get("combo", combo)),
             "param": param,
-            "perfect": perfect,
-            "great": great,
-            "good": good,
-            "bad": bad,
-        },
-    )
-
-    best = db.table("drs_scores_best").get(
-        (where("drs_id") == djid)
-        & (where("game_version") == game_version)
-        & (where("music_id") == music_id)
-        & (where("music_type") == music_type)
-    )
-    best = {} if best is None else best
-
-    best_score_data = {
-        "game_version": game_version,
-        "drs_id": djid,
-        "name": profile["name"],
-        "music_id": music_id,
-        "music_type": music_type,
-        "score": max(score, best.get("score", score)),
-        "rank": max(rank, best.get("rank", rank)),
-        "combo": max(combo, best.get("combo", combo)),
-        "param": param,
-    }
+        }
+
+    async with get_async_db().unit_of_work() as uow:
+        uow.table("drs_scores").insert(
+            {
+                "timestamp": timestamp,
+                "game_version": game_version,
+                "drs_id": djid,
+                "music_id": music_id,
+                "music_type": music_type,
+                "mode": mode,
+                "score": score,
+                "rank": rank,
+                "combo": combo,
+                "param": param,
+                "perfect": perfect,
+                "great": great,
+                "good": good,
+                "bad": bad,
+            },
+        )
 
-    db.table("drs_scores_best").upsert(
-        best_score_data,
-        (where("drs_id") == djid)
-        & (where("game_version") == game_version)
-        & (where("music_id") == music_id)
-        & (where("music_type") == music_type),
-    )
+        uow.table("drs_scores_best").update_with(
+            (where("drs_id") == djid)
+            & (where("game_version") == game_version)
+            & (where("music_id") == music_id)
+            & (where("music_type") == music_type),
+            update_best,
+        )
 
     response = E.response(E.game())
 
@@ -4,6 +4,7 @@ from core_common import core_process_request, core_prepare_response, E
 
 from tinydb import Query, where
 from core_database import get_db
+from core_snapshot import get_snapshots, snapshot_table
 from pydantic import BaseModel
 
 import config
@@ -26,14 +27,16 @@ class GFDM_Profile_Version_Items(BaseModel):
 
 
 @router.get("/profiles")
-async def gfdm_profiles():
-    return get_db().table("gitadora_profile").all()
+async def gfdm_profiles(response: Response):
+    snapshot = await snapshot_table("gitadora_profile", response)
+    return snapshot.all()
 
 
 @router.get("/profiles/{gitadora_id}")
-async def gfdm_profile_id(gitadora_id: str):
+async def gfdm_profile_id(gitadora_id: str, response: Response):
     gitadora_id = int("".join([i for i in gitadora_id if i.isnumeric()]))
-    return get_db().table("gitadora_profile").get(where("gitadora_id") == gitadora_id)
+    snapshot = await snapshot_table("gitadora_profile", response)
+    return snapshot.get(where("gitadora_id") == gitadora_id)
 
 
 @router.patch("/profiles/{gitadora_id}")
@@ -49,6 +52,7 @@ async def gfdm_profile_id_patch(gitadora_id: str, item: GFDM_Profile_Main_Items)
     get_db().table("gitadora_profile").upsert(
         profile, where("gitadora_id") == gitadora_id
     )
+    get_snapshots().invalidate("gitadora_profile")
     return Response(status_code=204)
 
 
@@ -71,11 +75,12 @@ async def gfdm_profile_id_version_patch(
     get_db().table("gitadora_profile").upsert(
         profile, where("gitadora_id") == gitadora_id
     )
+    get_snapshots().invalidate("gitadora_profile")
     return Response(status_code=204)
 
 
 @router.get("/card/{card}")
-async def gfdm_card_to_profile(card: str):
+async def gfdm_card_to_profile(card: str, response: Response):
     card = card.upper()
     lookalike = {
         "I": "1",
@@ -93,83 +98,82 @@ async def gfdm_card_to_profile(card: str):
         card = "".join([c for c in card if c in conv.valid_characters])
         uid = conv.to_uid(card)
         kid = card
-    profile = get_db().table("gitadora_profile").get(where("card") == uid)
+    snapshot = await snapshot_table("gitadora_profile", response)
+    profile = snapshot.get(where("card") == uid)
     return profile
 
 
 @router.get("/drummania/scores")
-async def dm_scores():
-    return get_db().table("drummania_scores").all()
+async def dm_scores(response: Response):
+    snapshot = await snapshot_table("drummania_scores", response)
+    return snapshot.all()
 
 
 @router.get("/guitarfreaks/scores")
-async def gf_scores():
-    return get_db().table("guitarfreaks_scores").all()
+async def gf_scores(response: Response):
+    snapshot = await snapshot_table("guitarfreaks_scores", response)
+    return snapshot.all()
 
 
 @router.get("/drummania/scores/{gitadora_id}")
-async def dm_scores_id(gitadora_id: str):
+async def dm_scores_id(gitadora_id: str, response: Response):
     gitadora_id = int("".join([i for i in gitadora_id if i.isnumeric()]))
-    return (
-        get_db().table("drummania_scores").search((where("gitadora_id") == gitadora_id))
-    )
+    snapshot = await snapshot_table("drummania_scores", response)
+    return snapshot.search((where("gitadora_id") == gitadora_id))
 
 
 @router.get("/guitarfreaks/scores/{gitadora_id}")
-async def gf_scores_id(gitadora_id: str):
+async def gf_scores_id(gitadora_id: str, response: Response):
     gitadora_id = int("".join([i for i in gitadora_id if i.isnumeric()]))
-    return (
-        get_db()
-        .table("guitarfreaks_scores")
-        .search((where("gitadora_id") == gitadora_id))
-    )
+    snapshot = await snapshot_table("guitarfreaks_scores", response)
+    return snapshot.search((where("gitadora_id") == gitadora_id))
 
 
 @router.get("/drummania/scores_best")
-async def dm_scores_best():
-    return get_db().table("drummania_scores_best").all()
+async def dm_scores_best(response: Response):
+    snapshot = await snapshot_table("drummania_scores_best", response)
+    return snapshot.all()
 
 
 @router.get("/guitarfreaks/scores_best")
-async def gf_scores_best():
-    return get_db().table("guitarfreaks_scores_best").all()
+async def gf_scores_best(response: Response):
+    snapshot = await snapshot_table("guitarfreaks_scores_best", response)
+    return snapshot.all()
 
 
 @router.get("/drummania/scores_best/{gitadora_id}")
-async def dm_scores_best_id(gitadora_id: str):
+async def dm_scores_best_id(gitadora_id: str, response: Response):
     gitadora_id = int("".join([i for i in gitadora_id if i.isnumeric()]))
-    return (
-        get_db()
-        .table("drummania_scores_best")
-        .search((where("gitadora_id") == gitadora_id))
-    )
+    snapshot = await snapshot_table("drummania_scores_best", response)
+    return snapshot.search((where("gitadora_id") == gitadora_id))
 
 
 @router.get("/guitarfreaks/scores_best/{gitadora_id}")
-async def gf_scores_best_id(gitadora_id: str):
+async def gf_scores_best_id(gitadora_id: str, response: Response):
     gitadora_id = int("".join([i for i in gitadora_id if i.isnumeric()]))
-    return (
-        get_db()
-        .table("guitarfreaks_scores_best")
-        .search((where("gitadora_id") == gitadora_id))
-    )
+    snapshot = await snapshot_table("guitarfreaks_scores_best", response)
+    return snapshot.search((where("gitadora_id") == gitadora_id))
 
 
 @router.get("/drummania/mcode/{mcode}/all")
-async def dm_scores_id(mcode: int):
-    return get_db().table("drummania_scores").search((where("mcode") == mcode))
+async def dm_scores_id(mcode: int, response: Response):
+    snapshot = await snapshot_table("drummania_scores", response)
+    return snapshot.search((where("mcode") == mcode))
 
 
 @router.get("/guitarfreaks/mcode/{mcode}/all")
-async def gf_scores_id(mcode: int):
-    return get_db().table("guitarfreaks_scores").search((where("mcode") == mcode))
+async def gf_scores_id(mcode: int, response: Response):
+    snapshot = await snapshot_table("guitarfreaks_scores", response)
+    return snapshot.search((where("mcode") == mcode))
 
 
 @router.get("/drummania/mcode/{mcode}/best")
-async def dm_scores_id_best(mcode: int):
-    return get_db().table("drummania_scores_best").search((where("mcode") == mcode))
+async def dm_scores_id_best(mcode: int, response: Response):
+    snapshot = await snapshot_table("drummania_scores_best", response)
+    return snapshot.search((where("mcode") == mcode))
 
 
 @router.get("/guitarfreaks/mcode/{mcode}/best")
-async def gf_scores_id_best(mcode: int):
-    return get_db().table("guitarfreaks_scores_best").search((where("mcode") == mcode))
+async def gf_scores_id_best(mcode: int, response: Response):
+    snapshot = await snapshot_table("guitarfreaks_scores_best", response)
+    return snapshot.search((where("mcode") == mcode))
@@ -2,10 +2,10 @@ import time
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 
 router = APIRouter(prefix="/local", tags=["local"])
-router.model_whitelist = ["M32"]
+router.model_whitelist = game_models("gitadora")
 
 
 @router.post("/{gameinfo}/{ver}_gameinfo/get")
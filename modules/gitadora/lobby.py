@@ -1,12 +1,10 @@
 from fastapi import APIRouter, Request, Response
 
-from core_common import E, core_prepare_response, core_process_request
+from core_common import E, core_prepare_response, core_process_request, game_models
+from core_state import get_state
 
 router = APIRouter(prefix="/lobby", tags=["lobby"])
-router.model_whitelist = ["M32"]
-
-
-host = {}
+router.model_whitelist = game_models("gitadora")
 
 
 @router.post("/{gameinfo}/lobby/request")
@@ -17,32 +15,33 @@ async def gitadora_lobby_request(request: Request):
     address_ip = root.find("address/ip").text
     check_attestid = root.find("check/attestid").text
 
-    if host:
-        if host["ip"] != address_ip:
-            response = E.response(
-                E.lobby(
-                    E.lobbydata(
-                        E.candidate(
-                            E.address(
-                                E.ip(host["ip"], __type="str"),
-                            ),
-                            E.check(
-                                E.attestid(host["attestid"], __type="str"),
-                            ),
-                        ),
-                    ),
-                )
-            )
+    host = {}
 
-        elif host["ip"] == address_ip:
-            response = E.response(E.lobby())
+    def pair(waiting):
+        # the waiting host is handed to the next cabinet and cleared
+        host.update(waiting)
+        if waiting:
+            return {}
+        return {"ip": address_ip, "attestid": check_attestid}
 
-        del host["ip"]
-        del host["attestid"]
+    get_state().update("gitadora_lobby.host", pair, {})
 
+    if host and host["ip"] != address_ip:
+        response = E.response(
+            E.lobby(
+                E.lobbydata(
+                    E.candidate(
+                        E.address(
+                            E.ip(host["ip"], __type="str"),
+                        ),
+                        E.check(
+                            E.attestid(host["attestid"], __type="str"),
+                        ),
+                    ),
+                ),
+            )
+        )
     else:
-        host["ip"] = address_ip
-        host["attestid"] = check_attestid
         response = E.response(E.lobby())
 
     response_body, response_headers = await core_prepare_response(request, response)
@@ -3,7 +3,10 @@ from fastapi import APIRouter, Request, Response, File, UploadFile
 from core_common import core_process_request, core_prepare_response, E
 
 from tinydb import Query, where
+from core_blobs import load_ghosts
 from core_database import get_db
+from core_iidx import profile_saved
+from core_snapshot import get_snapshots, snapshot_table
 from pydantic import BaseModel
 from typing import Optional
 
@@ -82,14 +85,16 @@ class IIDX_Profile_Version_Items(BaseModel):
 
 
 @router.get("/profiles")
-async def iidx_profiles():
-    return get_db().table("iidx_profile").all()
+async def iidx_profiles(response: Response):
+    snapshot = await snapshot_table("iidx_profile", response)
+    return snapshot.all()
 
 
 @router.get("/profiles/{iidx_id}")
-async def iidx_profile_id(iidx_id: str):
+async def iidx_profile_id(iidx_id: str, response: Response):
     iidx_id = int("".join([i for i in iidx_id if i.isnumeric()]))
-    return get_db().table("iidx_profile").get(where("iidx_id") == iidx_id)
+    snapshot = await snapshot_table("iidx_profile", response)
+    return snapshot.get(where("iidx_id") == iidx_id)
 
 
 @router.patch("/profiles/{iidx_id}")
@@ -101,6 +106,8 @@ async def iidx_profile_id_patch(iidx_id: str, item: IIDX_Profile_Main_Items):
     profile["pin"] = item.pin
 
     get_db().table("iidx_profile").upsert(profile, where("iidx_id") == iidx_id)
+    get_snapshots().invalidate("iidx_profile")
+    profile_saved(iidx_id)
     return Response(status_code=204)
 
 
@@ -174,11 +181,13 @@ async def iidx_profile_id_version_patch(
 
     profile["version"][str(version)] = game_profile
     get_db().table("iidx_profile").upsert(profile, where("iidx_id") == iidx_id)
+    get_snapshots().invalidate("iidx_profile")
+    profile_saved(iidx_id)
     return Response(status_code=204)
 
 
 @router.get("/card/{card}")
-async def iidx_card_to_profile(card: str):
+async def iidx_card_to_profile(card: str, response: Response):
     card = card.upper()
     lookalike = {
         "I": "1",
@@ -196,56 +205,66 @@ async def iidx_card_to_profile(card: str):
         card = "".join([c for c in card if c in conv.valid_characters])
         uid = conv.to_uid(card)
         kid = card
-    profile = get_db().table("iidx_profile").get(where("card") == uid)
+    snapshot = await snapshot_table("iidx_profile", response)
+    profile = snapshot.get(where("card") == uid)
     return profile
 
 
 @router.get("/scores")
-async def iidx_scores():
-    return get_db().table("iidx_scores").all()
+async def iidx_scores(response: Response):
+    snapshot = await snapshot_table("iidx_scores", response)
+    return load_ghosts(snapshot.all())
 
 
 @router.get("/scores/{iidx_id}")
-async def iidx_scores_id(iidx_id: str):
+async def iidx_scores_id(iidx_id: str, response: Response):
     iidx_id = int("".join([i for i in iidx_id if i.isnumeric()]))
-    return get_db().table("iidx_scores").search((where("iidx_id") == iidx_id))
+    snapshot = await snapshot_table("iidx_scores", response)
+    return load_ghosts(snapshot.search((where("iidx_id") == iidx_id)))
 
 
 @router.get("/scores_best")
-async def iidx_scores_best():
-    return get_db().table("iidx_scores_best").all()
+async def iidx_scores_best(response: Response):
+    snapshot = await snapshot_table("iidx_scores_best", response)
+    return load_ghosts(snapshot.all())
 
 
 @router.get("/scores_best/{iidx_id}")
-async def iidx_scores_best_id(iidx_id: str):
+async def iidx_scores_best_id(iidx_id: str, response: Response):
     iidx_id = int("".join([i for i in iidx_id if i.isnumeric()]))
-    return get_db().table("iidx_scores_best").search((where("iidx_id") == iidx_id))
+    snapshot = await snapshot_table("iidx_scores_best", response)
+    return load_ghosts(snapshot.search((where("iidx_id") == iidx_id)))
 
 
 @router.get("/music_id/{music_id}/all")
-async def iidx_scores_id(music_id: int):
-    return get_db().table("iidx_scores").search((where("music_id") == music_id))
+async def iidx_scores_id(music_id: int, response: Response):
+    snapshot = await snapshot_table("iidx_scores", response)
+    return load_ghosts(snapshot.search((where("music_id") == music_id)))
 
 
 @router.get("/music_id/{music_id}/best")
-async def iidx_scores_id_best(music_id: int):
-    return get_db().table("iidx_scores_best").search((where("music_id") == music_id))
+async def iidx_scores_id_best(music_id: int, response: Response):
+    snapshot = await snapshot_table("iidx_scores_best", response)
+    return load_ghosts(snapshot.search((where("music_id") == music_id)))
 
 
 @router.get("/class_best/{iidx_id}")
-async def iidx_class_best(iidx_id: str):
+async def iidx_class_best(iidx_id: str, response: Response):
     iidx_id = int("".join([i for i in iidx_id if i.isnumeric()]))
-    return get_db().table("iidx_class_best").search((where("iidx_id") == iidx_id))
+    snapshot = await snapshot_table("iidx_class_best", response)
+    return snapshot.search((where("iidx_id") == iidx_id))
 
 
 @router.get("/score_stats/all")
-async def iidx_score_stats():
-    return get_db().table("iidx_score_stats").all()
+async def iidx_score_stats(response: Response):
+    snapshot = await snapshot_table("iidx_score_stats", response)
+    return snapshot.all()
 
 
 @router.get("/score_stats/{music_id}")
-async def iidx_score_stats_song(music_id: int):
-    return get_db().table("iidx_score_stats").search((where("music_id") == music_id))
+async def iidx_score_stats_song(music_id: int, response: Response):
+    snapshot = await snapshot_table("iidx_score_stats", response)
+    return snapshot.search((where("music_id") == music_id))
 
 
 @router.post("/parse_mdb/upload")
@@ -2,10 +2,10 @@ import config
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 
 router = APIRouter(prefix="/local2", tags=["local2"])
-router.model_whitelist = ["LDJ"]
+router.model_whitelist = game_models("iidx", min_version=29)
 
 
 @router.post("/{gameinfo}/IIDX29lobby/entry")
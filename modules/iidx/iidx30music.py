@@ -5,13 +5,30 @@ from enum import IntEnum
 from fastapi import APIRouter, Request, Response
 from tinydb import where
 
-from core_common import core_process_request, core_prepare_response, E
-from core_database import get_db
+from core_common import (
+    core_process_request,
+    core_prepare_cached_response,
+    core_prepare_response,
+    game_models,
+    E,
+)
+from core_blobs import load_ghost, store_ghost
+from core_database import get_async_db, get_db
+from core_iidx import (
+    best_score_saved,
+    get_champion,
+    get_clear_rates,
+    get_crate_bodies,
+    get_djname,
+    get_ranklist,
+    get_top_scores,
+    score_stats_saved,
+)
 
 import config
 
 router = APIRouter(prefix="/local2", tags=["local2"])
-router.model_whitelist = ["LDJ"]
+router.model_whitelist = game_models("iidx", min_version=29)
 
 
 class ClearFlags(IntEnum):
@@ -51,10 +68,6 @@ async def iidx30music_getrank(request: Request):
         if iidxid == 0:
             continue
 
-        profile = db.table("iidx_profile").get(where("iidx_id") == iidxid)["version"][
-            str(game_version)
-        ]
-
         for record in db.table("iidx_scores_best").search(
             (where("music_id") < (game_version + 1) * 1000)
             & (where("play_style") == play_style)
@@ -80,35 +93,22 @@ async def iidx30music_getrank(request: Request):
             all_scores[rival_idx, music_id][chart_id]["miss_count"] = miss_count
 
     names = {}
-    profiles = get_db().table("iidx_profile")
-    for p in profiles:
-        names[p["iidx_id"]] = {}
-        try:
-            names[p["iidx_id"]]["name"] = p["version"][str(game_version)]["djname"]
-        except KeyError:
-            names[p["iidx_id"]]["name"] = "UNK"
-
     top_scores = {}
-    for record in db.table("iidx_scores_best").search(
-        (where("music_id") < (game_version + 1) * 1000)
-        & (where("play_style") == play_style)
+    for music_id, charts in get_top_scores().charts(
+        play_style, (game_version + 1) * 1000
     ):
-        music_id = record["music_id"]
-        ex_score = record["ex_score"]
-        chart_id = record["chart_id"]
-        iidx_id = record["iidx_id"]
-
-        if music_id not in top_scores:
-            top_scores[music_id] = {
-                0: {"djname": "", "clear_flg": -1, "ex_score": -1},
-                1: {"djname": "", "clear_flg": -1, "ex_score": -1},
-                2: {"djname": "", "clear_flg": -1, "ex_score": -1},
-                3: {"djname": "", "clear_flg": -1, "ex_score": -1},
-                4: {"djname": "", "clear_flg": -1, "ex_score": -1},
-            }
-
-        if ex_score > top_scores[music_id][chart_id]["ex_score"]:
-            top_scores[music_id][chart_id]["djname"] = names[iidx_id]["name"]
+        top_scores[music_id] = {
+            0: {"djname": "", "clear_flg": -1, "ex_score": -1},
+            1: {"djname": "", "clear_flg": -1, "ex_score": -1},
+            2: {"djname": "", "clear_flg": -1, "ex_score": -1},
+            3: {"djname": "", "clear_flg": -1, "ex_score": -1},
+            4: {"djname": "", "clear_flg": -1, "ex_score": -1},
+        }
+
+        for chart_id, (ex_score, iidx_id) in charts.items():
+            if iidx_id not in names:
+                names[iidx_id] = get_djname(iidx_id, game_version)
+            top_scores[music_id][chart_id]["djname"] = names[iidx_id]
             top_scores[music_id][chart_id]["clear_flg"] = 1
             top_scores[music_id][chart_id]["ex_score"] = ex_score
 
@@ -160,32 +160,34 @@ async def iidx30music_crate(request: Request):
     request_info = await core_process_request(request)
     game_version = request_info["game_version"]
 
-    db = get_db()
-    all_score_stats = db.table("iidx_score_stats").search(
-        (where("music_id") < (game_version + 1) * 1000)
-    )
-
-    crate = {}
-    fcrate = {}
-    for stat in all_score_stats:
-        if stat["music_id"] not in crate:
-            crate[stat["music_id"]] = [1001] * 10
-        if stat["music_id"] not in fcrate:
-            fcrate[stat["music_id"]] = [1001] * 10
-
-        if stat["play_style"] == 1:
-            dp_idx = 5
-        else:
-            dp_idx = 0
-
-        crate[stat["music_id"]][stat["chart_id"] + dp_idx] = int(stat["clear_rate"])
-        fcrate[stat["music_id"]][stat["chart_id"] + dp_idx] = int(stat["fc_rate"])
+    def build():
+        crate = {}
+        fcrate = {}
+        for stat in get_clear_rates().below((game_version + 1) * 1000):
+            music_id, play_style, chart_id, clear_rate, fc_rate = stat
+            if music_id not in crate:
+                crate[music_id] = [1001] * 10
+            if music_id not in fcrate:
+                fcrate[music_id] = [1001] * 10
+
+            if play_style == 1:
+                dp_idx = 5
+            else:
+                dp_idx = 0
+
+            crate[music_id][chart_id + dp_idx] = clear_rate
+            fcrate[music_id][chart_id + dp_idx] = fc_rate
+
+        return E.response(
+            E.IIDX30music(
+                *[E.c(crate[k] + fcrate[k], mid=k, __type="s32") for k in crate]
+            )
+        )
 
-    response = E.response(
-        E.IIDX30music(*[E.c(crate[k] + fcrate[k], mid=k, __type="s32") for k in crate])
+    # only rebuilt when music/reg changes a rate, see core_iidx.score_stats_saved
+    response_body, response_headers = await core_prepare_cached_response(
+        request, get_crate_bodies(), game_version, build
     )
-
-    response_body, response_headers = await core_prepare_response(request, response)
     return Response(content=response_body, headers=response_headers)
 
 
@@ -218,8 +220,11 @@ async def iidx30music_reg(request: Request):
     option2 = int(log.attrib["option2"])
     pgreat_num = int(log.attrib["pgreat_num"])
 
-    ghost = log.find("ghost").text
-    ghost_gauge = log.find("ghost_gauge").text
+    # ghost files are written and fsynced on the DB executor, not the loop
+    ghost = await get_async_db().run(store_ghost, log.find("ghost").text)
+    ghost_gauge = await get_async_db().run(
+        store_ghost, log.find("ghost_gauge").text
+    )
 
     db = get_db()
     db.table("iidx_scores").insert(
@@ -288,6 +293,7 @@ async def iidx30music_reg(request: Request):
         & (where("music_id") == music_id)
         & (where("chart_id") == note_id),
     )
+    best_score_saved(best_score_data)
 
     score_stats = db.table("iidx_score_stats").get(
         (where("music_id") == music_id)
@@ -320,52 +326,16 @@ async def iidx30music_reg(request: Request):
         & (where("play_style") == play_style)
         & (where("chart_id") == note_id),
     )
+    score_stats_saved(score_stats)
 
     ranklist_data = []
-    ranklist_scores = db.table("iidx_scores_best").search(
-        (where("play_style") == play_style)
-        & (where("music_id") == music_id)
-        & (where("chart_id") == note_id)
+    ranklist_scores_ranked, myRank, total_user_num = get_ranklist(
+        game_version, play_style, music_id, note_id, iidx_id
     )
-    ranklist_scores = [] if ranklist_scores is None else ranklist_scores
-
-    ranklist_scores_ranked = []
 
-    for score in ranklist_scores:
-        profile = db.table("iidx_profile").get(where("iidx_id") == score["iidx_id"])
-
-        if profile is None or str(game_version) not in profile["version"]:
-            continue
-
-        game_profile = profile["version"][str(game_version)]
-
-        ranklist_scores_ranked.append(
-            {
-                "opname": config.arcade,
-                "name": game_profile["djname"],
-                "pid": game_profile["region"],
-                "body": game_profile["body"],
-                "face": game_profile["face"],
-                "hair": game_profile["hair"],
-                "hand": game_profile["hand"],
-                "head": game_profile["head"],
-                "dgrade": game_profile["grade_double"],
-                "sgrade": game_profile["grade_single"],
-                "score": score["ex_score"],
-                "iidx_id": score["iidx_id"],
-                "clflg": score["clear_flg"],
-                "myFlg": score["iidx_id"] == iidx_id,
-            }
-        )
-
-    ranklist_scores_ranked = sorted(
-        ranklist_scores_ranked, key=lambda x: (x["clflg"], x["score"]), reverse=True
-    )
-
-    myRank = 0
-    for rnum, score in enumerate(ranklist_scores_ranked):
+    for score in ranklist_scores_ranked:
         r = E.data(
-            rnum=rnum + 1,
+            rnum=score["rnum"],
             opname=score["opname"],
             name=score["name"],
             pid=score["pid"],
@@ -384,12 +354,9 @@ async def iidx30music_reg(request: Request):
         )
         ranklist_data.append(r)
 
-        if score["myFlg"]:
-            myRank = rnum + 1
-
     response = E.response(
         E.IIDX30music(
-            E.ranklist(*ranklist_data, total_user_num=len(ranklist_data)),
+            E.ranklist(*ranklist_data, total_user_num=total_user_num),
             E.shopdata(rank=myRank),
             clid=clid,
             crate=score_stats["clear_rate"],
@@ -423,12 +390,13 @@ async def iidx30music_appoint(request: Request):
 
     vals = []
     if record is not None:
+        ghost = load_ghost(record["ghost"])
         vals.append(
             E.mydata(
-                record["ghost"],
+                ghost,
                 score=record["ex_score"],
                 __type="bin",
-                __size=len(record["ghost"]) // 2,
+                __size=len(ghost) // 2,
             )
         )
 
@@ -439,36 +407,18 @@ async def iidx30music_appoint(request: Request):
             & (where("chart_id") == chart_id)
         )
     elif ctype in (2, 4, 10):
-        sdata = {
-            "game_version": 29,
-            "ghost": "",
-            "ex_score": 0,
-            "iidx_id": 0,
-            "name": "",
-            "pid": 13,
-        }
+        sdata = get_champion(music_id, chart_id)
 
-        for record in db.table("iidx_scores_best").search(
-            (where("music_id") == music_id) & (where("chart_id") == chart_id)
-        ):
-            if record["ex_score"] > sdata["ex_score"]:
-                sdata["game_version"] = record["game_version"]
-                sdata["ghost"] = record["ghost"]
-                sdata["ex_score"] = record["ex_score"]
-                sdata["iidx_id"] = record["iidx_id"]
-                sdata["pid"] = record["pid"]
-
-    if ctype in (1, 2, 4, 10) and sdata["ex_score"] != 0:
+    if ctype in (1, 2, 4, 10) and sdata is not None and sdata["ex_score"] != 0:
+        ghost = load_ghost(sdata["ghost"])
         vals.append(
             E.sdata(
-                sdata["ghost"],
+                ghost,
                 score=sdata["ex_score"],
-                name=db.table("iidx_profile").get(where("iidx_id") == sdata["iidx_id"])[
-                    "version"
-                ][str(sdata["game_version"])]["djname"],
+                name=get_djname(sdata["iidx_id"], sdata["game_version"]),
                 pid=sdata["pid"],
                 __type="bin",
-                __size=len(sdata["ghost"]) // 2,
+                __size=len(ghost) // 2,
             )
         )
 
@@ -4,14 +4,11 @@ import config
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
+from core_state import get_state
 
 router = APIRouter(prefix="/lobby", tags=["lobby"])
-router.model_whitelist = ["LDJ"]
-
-
-arena_host = {}
-bpl_host = {}
+router.model_whitelist = game_models("iidx", min_version=29)
 
 
 @router.post("/{gameinfo}/IIDX31lobby/entry")
@@ -25,40 +22,29 @@ async def iidx31lobby_entry(request: Request):
     gp = root.find("address/gp").text
     la = root.find("address/la").text.split()
 
-    if arena_host and time() < arena_host["time"]:
-        # test menu reset
-        if arena_host["ga"] == ga:
-            is_arena_host = 1
-            arena_host["time"] = time() + 30
-        else:
-            is_arena_host = 0
-        response = E.response(
-            E.IIDX31lobby(
-                E.host(is_arena_host, __type="bool"),
-                E.matching_class(arena_class, __type="s32"),
-                E.address(
-                    E.ga(arena_host["ga"], __type="u8"),
-                    E.gp(arena_host["gp"], __type="u16"),
-                    E.la(arena_host["la"], __type="u8"),
-                ),
-            )
-        )
-    else:
-        arena_host["ga"] = ga
-        arena_host["gp"] = gp
-        arena_host["la"] = la
-        arena_host["time"] = time() + 30
-        response = E.response(
-            E.IIDX31lobby(
-                E.host(1, __type="bool"),
-                E.matching_class(arena_class, __type="s32"),
-                E.address(
-                    E.ga(ga, __type="u8"),
-                    E.gp(gp, __type="u16"),
-                    E.la(la, __type="u8"),
-                ),
-            )
+    def entry(arena_host):
+        if arena_host and time() < arena_host["time"]:
+            # test menu reset
+            if arena_host["ga"] == ga:
+                arena_host["time"] = time() + 30
+            return arena_host
+
+        return {"ga": ga, "gp": gp, "la": la, "time": time() + 30}
+
+    arena_host = get_state().update("IIDX31lobby.arena_host", entry, {})
+    is_arena_host = 1 if arena_host["ga"] == ga else 0
+
+    response = E.response(
+        E.IIDX31lobby(
+            E.host(is_arena_host, __type="bool"),
+            E.matching_class(arena_class, __type="s32"),
+            E.address(
+                E.ga(arena_host["ga"], __type="u8"),
+                E.gp(arena_host["gp"], __type="u16"),
+                E.la(arena_host["la"], __type="u8"),
+            ),
         )
+    )
 
     response_body, response_headers = await core_prepare_response(request, response)
     return Response(content=response_body, headers=response_headers)
@@ -79,10 +65,7 @@ async def iidx31lobby_delete(request: Request):
     request_info = await core_process_request(request)
 
     # normal reset
-    del arena_host["ga"]
-    del arena_host["gp"]
-    del arena_host["la"]
-    del arena_host["time"]
+    get_state().delete("IIDX31lobby.arena_host")
     response = E.response(E.IIDX31lobby())
 
     response_body, response_headers = await core_prepare_response(request, response)
@@ -101,41 +84,30 @@ async def iidx31lobby_bplbattle_entry(request: Request):
     gp = root.find("address/gp").text
     la = root.find("address/la").text.split()
 
-    if bpl_host and password in bpl_host and time() < bpl_host[password]["time"]:
-        # test menu reset
-        if bpl_host[password]["ga"] == ga:
-            is_bpl_host = 1
-            bpl_host[password]["time"] = time() + 30
+    def entry(bpl_host):
+        host = bpl_host.get(password)
+        if host and time() < host["time"]:
+            # test menu reset
+            if host["ga"] == ga:
+                host["time"] = time() + 30
         else:
-            is_bpl_host = 0
-        response = E.response(
-            E.IIDX31lobby(
-                E.host(is_bpl_host, __type="bool"),
-                E.matching_class(arena_class, __type="s32"),
-                E.address(
-                    E.ga(bpl_host[password]["ga"], __type="u8"),
-                    E.gp(bpl_host[password]["gp"], __type="u16"),
-                    E.la(bpl_host[password]["la"], __type="u8"),
-                ),
-            )
-        )
-    else:
-        bpl_host[password] = {}
-        bpl_host[password]["ga"] = ga
-        bpl_host[password]["gp"] = gp
-        bpl_host[password]["la"] = la
-        bpl_host[password]["time"] = time() + 30
-        response = E.response(
-            E.IIDX31lobby(
-                E.host(1, __type="bool"),
-                E.matching_class(arena_class, __type="s32"),
-                E.address(
-                    E.ga(ga, __type="u8"),
-                    E.gp(gp, __type="u16"),
-                    E.la(la, __type="u8"),
-                ),
-            )
+            bpl_host[password] = {"ga": ga, "gp": gp, "la": la, "time": time() + 30}
+        return bpl_host
+
+    bpl_host = get_state().update("IIDX31lobby.bpl_host", entry, {})[password]
+    is_bpl_host = 1 if bpl_host["ga"] == ga else 0
+
+    response = E.response(
+        E.IIDX31lobby(
+            E.host(is_bpl_host, __type="bool"),
+            E.matching_class(arena_class, __type="s32"),
+            E.address(
+                E.ga(bpl_host["ga"], __type="u8"),
+                E.gp(bpl_host["gp"], __type="u16"),
+                E.la(bpl_host["la"], __type="u8"),
+            ),
         )
+    )
 
     response_body, response_headers = await core_prepare_response(request, response)
     return Response(content=response_body, headers=response_headers)
@@ -158,11 +130,15 @@ async def iidx31lobby_bplbattle_delete(request: Request):
     root = request_info["root"][0]
     ga = root.find("address/ga").text.split()
 
+    def delete(bpl_host):
+        for host in bpl_host:
+            if bpl_host[host]["ga"] == ga:
+                del bpl_host[host]
+                break
+        return bpl_host
+
     # normal reset
-    for host in bpl_host:
-        if bpl_host[host]["ga"] == ga:
-            del bpl_host[host]
-            break
+    get_state().update("IIDX31lobby.bpl_host", delete, {})
     response = E.response(E.IIDX31lobby())
 
     response_body, response_headers = await core_prepare_response(request, response)
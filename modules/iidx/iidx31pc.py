@@ -6,11 +6,12 @@ import random
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 from core_database import get_db
+from core_iidx import get_profile_summary, profile_saved
 
 router = APIRouter(prefix="/local2", tags=["local2"])
-router.model_whitelist = ["LDJ"]
+router.model_whitelist = game_models("iidx", min_version=29)
 
 
 def get_profile(cid):
@@ -86,27 +87,29 @@ async def iidx31pc_get(request: Request):
     for idx, r in enumerate(rival_ids):
         if r == 0:
             continue
+        rival_profile = get_profile_summary(r, game_version)
+        if rival_profile is None:
+            continue
         rivals[idx] = {}
         rivals[idx]["spdp"] = 1 if idx < 6 else 2
 
-        rival_profile = get_game_profile_by_id(r, game_version)
         rdjid = "%08d" % r
         rdjid_split = "-".join([rdjid[:4], rdjid[4:]])
 
         rivals[idx]["djid"] = rdjid
         rivals[idx]["djid_split"] = rdjid_split
-        rivals[idx]["djname"] = rival_profile["djname"]
-        rivals[idx]["region"] = rival_profile["region"]
-        rivals[idx]["sa"] = rival_profile["sach"]
-        rivals[idx]["sg"] = rival_profile["grade_single"]
-        rivals[idx]["da"] = rival_profile["dach"]
-        rivals[idx]["dg"] = rival_profile["grade_double"]
-        rivals[idx]["back"] = rival_profile.get("back", 0)
-        rivals[idx]["body"] = rival_profile["body"]
-        rivals[idx]["face"] = rival_profile["face"]
-        rivals[idx]["hair"] = rival_profile["hair"]
-        rivals[idx]["hand"] = rival_profile["hand"]
-        rivals[idx]["head"] = rival_profile["head"]
+        rivals[idx]["djname"] = rival_profile.djname
+        rivals[idx]["region"] = rival_profile.region
+        rivals[idx]["sa"] = rival_profile.sach
+        rivals[idx]["sg"] = rival_profile.grade_single
+        rivals[idx]["da"] = rival_profile.dach
+        rivals[idx]["dg"] = rival_profile.grade_double
+        rivals[idx]["back"] = rival_profile.back
+        rivals[idx]["body"] = rival_profile.body
+        rivals[idx]["face"] = rival_profile.face
+        rivals[idx]["hair"] = rival_profile.hair
+        rivals[idx]["hand"] = rival_profile.hand
+        rivals[idx]["head"] = rival_profile.head
 
     # current_time = round(time())
 
@@ -1146,6 +1149,7 @@ async def iidx31pc_save(request: Request):
     profile["version"][str(game_version)] = game_profile
 
     get_db().table("iidx_profile").upsert(profile, where("card") == cid)
+    profile_saved(profile["iidx_id"])
 
     response = E.response(E.IIDX31pc(iidxid=xid, cltype=clt))
 
@@ -1395,6 +1399,7 @@ async def iidx31pc_reg(request: Request):
         "dp_rival_6_iidx_id": 0,
     }
     db.upsert(all_profiles_for_card, where("card") == cid)
+    profile_saved(all_profiles_for_card["iidx_id"])
 
     card, card_split = get_id_from_profile(cid)
 
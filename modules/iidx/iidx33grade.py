@@ -4,11 +4,12 @@ from tinydb import Query, where
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 from core_database import get_db
+from core_iidx import profile_saved
 
 router = APIRouter(prefix="/local", tags=["local"])
-router.model_whitelist = ["LDJ"]
+router.model_whitelist = game_models("iidx", min_version=29)
 
 
 def get_profile(iidx_id):
@@ -109,6 +110,7 @@ async def iidx33grade_raised(request: Request):
     profile["version"][str(game_version)] = game_profile
 
     db.table("iidx_profile").upsert(profile, where("game_version") == game_version)
+    profile_saved(iidx_id)
 
     response = E.response(E.IIDX33grade(pnum=1))
 
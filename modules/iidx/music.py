@@ -4,13 +4,27 @@ from enum import IntEnum
 from fastapi import APIRouter, Request, Response
 from tinydb import where
 
-from core_common import core_process_request, core_prepare_response, E
-from core_database import get_db
+from core_common import (
+    core_process_request,
+    core_prepare_cached_response,
+    core_prepare_response,
+    game_models,
+    E,
+)
+from core_blobs import load_ghost, store_ghost
+from core_database import get_async_db, get_db
+from core_iidx import (
+    best_score_saved,
+    get_clear_rates,
+    get_crate_bodies,
+    get_ranklist,
+    score_stats_saved,
+)
 
 import config
 
 router = APIRouter(prefix="/local", tags=["local"])
-router.model_whitelist = ["LDJ", "KDZ", "JDZ"]
+router.model_whitelist = game_models("iidx", max_version=20)
 
 
 class ClearFlags(IntEnum):
@@ -94,40 +108,36 @@ async def music_crate(request: Request):
     request_info = await core_process_request(request)
     game_version = request_info["game_version"]
 
-    db = get_db()
-    all_score_stats = db.table("iidx_score_stats").search(
-        (where("music_id") < (game_version + 1) * 1000)
-    )
-
-    crate = {}
-    fcrate = {}
-    for stat in all_score_stats:
-        if game_version < 20:
-            m = str(stat["music_id"])
-            stat["music_id"] = int("".join([m[: len(m) - 3], m[-2:]]))
-
-        if stat["music_id"] not in crate:
-            crate[stat["music_id"]] = [101] * 6
-        if stat["music_id"] not in fcrate:
-            fcrate[stat["music_id"]] = [101] * 6
-
-        if stat["play_style"] == 0:
-            old_to_new_adjust = -1
-        elif stat["play_style"] == 1:
-            old_to_new_adjust = 2
-
-        crate[stat["music_id"]][stat["chart_id"] + old_to_new_adjust] = (
-            int(stat["clear_rate"]) // 10
-        )
-        fcrate[stat["music_id"]][stat["chart_id"] + old_to_new_adjust] = (
-            int(stat["fc_rate"]) // 10
+    def build():
+        crate = {}
+        fcrate = {}
+        for stat in get_clear_rates().below((game_version + 1) * 1000):
+            music_id, play_style, chart_id, clear_rate, fc_rate = stat
+            if game_version < 20:
+                m = str(music_id)
+                music_id = int("".join([m[: len(m) - 3], m[-2:]]))
+
+            if music_id not in crate:
+                crate[music_id] = [101] * 6
+            if music_id not in fcrate:
+                fcrate[music_id] = [101] * 6
+
+            if play_style == 0:
+                old_to_new_adjust = -1
+            elif play_style == 1:
+                old_to_new_adjust = 2
+
+            crate[music_id][chart_id + old_to_new_adjust] = clear_rate // 10
+            fcrate[music_id][chart_id + old_to_new_adjust] = fc_rate // 10
+
+        return E.response(
+            E.music(*[E.c(crate[k] + fcrate[k], mid=k, __type="u8") for k in crate])
         )
 
-    response = E.response(
-        E.music(*[E.c(crate[k] + fcrate[k], mid=k, __type="u8") for k in crate])
+    # only rebuilt when music/reg changes a rate, see core_iidx.score_stats_saved
+    response_body, response_headers = await core_prepare_cached_response(
+        request, get_crate_bodies(), game_version, build
     )
-
-    response_body, response_headers = await core_prepare_response(request, response)
     return Response(content=response_body, headers=response_headers)
 
 
@@ -165,7 +175,7 @@ async def music_reg(request: Request):
         note_id = clid - 2
         play_style = 1
 
-    ghost = root.find("ghost").text
+    ghost = await get_async_db().run(store_ghost, root.find("ghost").text)
 
     db = get_db()
     db.table("iidx_scores").insert(
@@ -227,6 +237,7 @@ async def music_reg(request: Request):
         & (where("music_id") == music_id)
         & (where("chart_id") == note_id),
     )
+    best_score_saved(best_score_data)
 
     score_stats = db.table("iidx_score_stats").get(
         (where("music_id") == music_id)
@@ -259,52 +270,16 @@ async def music_reg(request: Request):
         & (where("play_style") == play_style)
         & (where("chart_id") == note_id),
     )
+    score_stats_saved(score_stats)
 
     ranklist_data = []
-    ranklist_scores = db.table("iidx_scores_best").search(
-        (where("play_style") == play_style)
-        & (where("music_id") == music_id)
-        & (where("chart_id") == note_id)
-    )
-    ranklist_scores = [] if ranklist_scores is None else ranklist_scores
-
-    ranklist_scores_ranked = []
-
-    for score in ranklist_scores:
-        profile = db.table("iidx_profile").get(where("iidx_id") == score["iidx_id"])
-
-        if profile is None or str(game_version) not in profile["version"]:
-            continue
-
-        game_profile = profile["version"][str(game_version)]
-
-        ranklist_scores_ranked.append(
-            {
-                "opname": config.arcade,
-                "name": game_profile["djname"],
-                "pid": game_profile["region"],
-                "body": game_profile.get("body", 0),
-                "face": game_profile.get("face", 0),
-                "hair": game_profile.get("hair", 0),
-                "hand": game_profile.get("hand", 0),
-                "head": game_profile.get("head", 0),
-                "dgrade": game_profile["grade_double"],
-                "sgrade": game_profile["grade_single"],
-                "score": score["ex_score"],
-                "iidx_id": score["iidx_id"],
-                "clflg": score["clear_flg"],
-                "myFlg": score["iidx_id"] == iidx_id,
-            }
-        )
-
-    ranklist_scores_ranked = sorted(
-        ranklist_scores_ranked, key=lambda x: (x["clflg"], x["score"]), reverse=True
+    ranklist_scores_ranked, myRank, total_user_num = get_ranklist(
+        game_version, play_style, music_id, note_id, iidx_id
     )
 
-    myRank = 0
-    for rnum, score in enumerate(ranklist_scores_ranked):
+    for score in ranklist_scores_ranked:
         r = E.data(
-            rnum=rnum + 1,
+            rnum=score["rnum"],
             opname=score["opname"],
             name=score["name"],
             pid=score["pid"],
@@ -323,12 +298,9 @@ async def music_reg(request: Request):
         )
         ranklist_data.append(r)
 
-        if score["myFlg"]:
-            myRank = rnum + 1
-
     response = E.response(
         E.music(
-            E.ranklist(*ranklist_data, total_user_num=len(ranklist_data)),
+            E.ranklist(*ranklist_data, total_user_num=total_user_num),
             E.shopdata(rank=myRank),
             clid=clid,
             crate=score_stats["clear_rate"] // 10,
@@ -358,12 +330,13 @@ async def music_appoint(request: Request):
 
     vals = []
     if record is not None:
+        ghost = load_ghost(record["ghost"])
         vals.append(
             E.mydata(
-                record["ghost"],
+                ghost,
                 score=record["ex_score"],
                 __type="bin",
-                __size=len(record["ghost"]) // 2,
+                __size=len(ghost) // 2,
             )
         )
 
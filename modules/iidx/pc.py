@@ -5,11 +5,12 @@ import random
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 from core_database import get_db
+from core_iidx import profile_saved
 
 router = APIRouter(prefix="/local", tags=["local"])
-router.model_whitelist = ["LDJ", "KDZ", "JDZ"]
+router.model_whitelist = game_models("iidx", max_version=20)
 
 
 def get_profile(cid):
@@ -638,6 +639,7 @@ async def pc_save(request: Request):
     profile["version"][str(game_version)] = game_profile
 
     get_db().table("iidx_profile").upsert(profile, where("iidx_id") == xid)
+    profile_saved(profile["iidx_id"])
 
     response = E.response(E.pc(iidxid=xid, cltype=clt))
 
@@ -859,6 +861,7 @@ async def pc_reg(request: Request):
             "_hide_rival_info": 1,
         }
     db.upsert(all_profiles_for_card, where("card") == cid)
+    profile_saved(all_profiles_for_card["iidx_id"])
 
     card, card_split = get_id_from_profile(cid)
 
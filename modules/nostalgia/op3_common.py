@@ -3,10 +3,10 @@ from os import path
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 
 router = APIRouter(prefix="/local", tags=["local"])
-router.model_whitelist = ["PAN"]
+router.model_whitelist = game_models("nostalgia")
 
 
 @router.post("/{gameinfo}/op3_common/get_common_info")
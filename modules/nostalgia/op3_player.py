@@ -4,11 +4,11 @@ import random
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 from core_database import get_db
 
 router = APIRouter(prefix="/local", tags=["local"])
-router.model_whitelist = ["PAN"]
+router.model_whitelist = game_models("nostalgia")
 
 
 def get_profile(cid):
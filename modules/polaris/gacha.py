@@ -1,10 +1,10 @@
 from fastapi import APIRouter, Request, Response
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 import time
 import uuid
 
 router = APIRouter(prefix="/polaris/gacha", tags=["gacha"])
-router.model_whitelist = ["LAV", "XIF"]
+router.model_whitelist = game_models("polaris")
 
 @router.post("")
 @router.post("/")
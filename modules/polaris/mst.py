@@ -1,9 +1,9 @@
 from fastapi import APIRouter, Request, Response
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 import time
 
 router = APIRouter(prefix="/polaris/mst", tags=["mst"])
-router.model_whitelist = ["LAV", "XIF"]
+router.model_whitelist = game_models("polaris")
 
 @router.post("")
 @router.post("/")
@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Request, Response
-from core_common import core_process_request, core_prepare_response, E
+from core_common import core_process_request, core_prepare_response, game_models, E
 from core_database import get_db
 from tinydb import Query, where
 import random
 import time
 
 router = APIRouter(prefix="/polaris/usr", tags=["usr"])
-router.model_whitelist = ["LAV", "XIF"]
+router.model_whitelist = game_models("polaris")
 
 @router.post("")
 @router.post("/")
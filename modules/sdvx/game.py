@@ -9,11 +9,11 @@ import time
 
 from fastapi import APIRouter, Request, Response
 
-from core_common import core_process_request, core_prepare_response, E
-from core_database import get_db
+from core_common import core_process_request, core_prepare_response, game_models, E
+from core_database import get_async_db, get_db
 
 router = APIRouter(prefix="/local2", tags=["local2"])
-router.model_whitelist = ["KFC"]
+router.model_whitelist = game_models("sdvx")
 
 
 def get_profile(cid):
@@ -631,69 +631,64 @@ async def game_sv_save_m(ver: str, request: Request):
     retry_cnt = int(track.find("retry_cnt").text)
     judge = [int(x) for x in track.find("judge").text.split(" ")]
 
-    db = get_db()
-    db.table("sdvx_scores").insert(
-        {
-            "timestamp": timestamp,
+    def update_best(best):
+        best = {} if best is None else best
+
+        return {
             "game_version": game_version,
             "sdvx_id": djid,
-            "play_id": play_id,
+            "name": profile["name"],
             "music_id": music_id,
             "music_type": music_type,
-            "score": score,
-            "exscore": exscore,
-            "clear_type": clear_type,
-            "score_grade": score_grade,
-            "max_chain": max_chain,
-            "just": just,
-            "critical": critical,
-            "near": near,
-            "error": error,
-            "effective_rate": effective_rate,
-            "btn_rate": btn_rate,
-            "long_rate": long_rate,
-            "vol_rate": vol_rate,
-            "mode": mode,
-            "gauge_type": gauge_type,
-            "notes_option": notes_option,
-            "online_num": online_num,
-            "local_num": local_num,
-            "challenge_type": challenge_type,
-            "retry_cnt": retry_cnt,
-            "judge": judge,
-        },
-    )
-
-    best = db.table("sdvx_scores_best").get(
-        (where("sdvx_id") == djid)
-        & (where("game_version") == game_version)
-        & (where("music_id") == music_id)
-        & (where("music_type") == music_type)
-    )
-    best = {} if best is None else best
-
-    best_score_data = {
-        "game_version": game_version,
-        "sdvx_id": djid,
-        "name": profile["name"],
-        "music_id": music_id,
-        "music_type": music_type,
-        "score": max(score, best.get("score", score)),
-        "exscore": max(exscore, best.get("exscore", exscore)),
-        "clear_type": max(clear_type, best.get("clear_type", clear_type)),
-        "score_grade": max(score_grade, best.get("score_grade", score_grade)),
-        "btn_rate": max(btn_rate, best.get("btn_rate", btn_rate)),
-        "long_rate": max(long_rate, best.get("long_rate", long_rate)),
-        "vol_rate": max(vol_rate, best.get("vol_rate", vol_rate)),
-    }
+            "score": max(score, best.get("score", score)),
+            "exscore": max(exscore, best.get("exscore", exscore)),
+            "clear_type": max(clear_type, best.get("clear_type", clear_type)),
+            "score_grade": max(score_grade, best.get("score_grade", score_grade)),
+            "btn_rate": max(btn_rate, best.get("btn_rate", btn_rate)),
+            "long_rate": max(long_rate, best.get("long_rate", long_rate)),
+            "vol_rate": max(vol_rate, best.get("vol_rate", vol_rate)),
+        }
+
+    async with get_async_db().unit_of_work() as uow:
+        uow.table("sdvx_scores").insert(
+            {
+                "timestamp": timestamp,
+                "game_version": game_version,
+                "sdvx_id": djid,
+                "play_id": play_id,
+                "music_id": music_id,
+                "music_type": music_type,
+                "score": score,
+                "exscore": exscore,
+                "clear_type": clear_type,
+                "score_grade": score_grade,
+                "max_chain": max_chain,
+                "just": just,
+                "critical": critical,
+                "near": near,
+                "error": error,
+                "effective_rate": effective_rate,
+                "btn_rate": btn_rate,
+                "long_rate": long_rate,
+                "vol_rate": vol_rate,
+                "mode": mode,
+                "gauge_type": gauge_type,
+                "notes_option": notes_option,
+                "online_num": online_num,
+                "local_num": local_num,
+                "challenge_type": challenge_type,
+                "retry_cnt": retry_cnt,
+                "judge": judge,
+            },
+        )
 
-    db.table("sdvx_scores_best").upsert(
-        best_score_data,
-        (where("sdvx_id") == djid)
-        & (where("game_version") == game_version)
-        & (where("music_id") == music_id)
-        & (where("music_type") == music_type),
-    )
+        uow.table("sdvx_scores_best").update_with(
+            (where("sdvx_id") == djid)
+            & (where("game_version") == game_version)
+            & (where("music_id") == music_id)
+            & (where("music_type") == music_type),
+            update_best,
+        )
 
     response = E.response(
         E.game(),
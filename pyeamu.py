@@ -15,7 +15,19 @@ import config
 import modules
 import utils.card as conv
 
-from core_common import core_process_request, core_prepare_response, E
+from core_common import (
+    core_process_request,
+    core_prepare_response,
+    core_prepare_cached_response,
+    get_codec_stats,
+    get_request_cache_stats,
+    games,
+    E,
+)
+from core_database import get_async_db, get_db, get_db_stats
+from core_iidx import warm_up
+from core_snapshot import get_snapshots
+from core_state import ResponseCache
 
 import socket
 
@@ -26,8 +38,10 @@ def urlpathjoin(parts, sep="/"):
 
 loopback = "127.0.0.1"
 
+server_hosts = ("localhost", config.ip, socket.gethostname())
+
 server_addresses = []
-for host in ("localhost", config.ip, socket.gethostname()):
+for host in server_hosts:
     server_addresses.append(f"{host}:{config.port}")
 
 server_services_urls = []
@@ -109,32 +123,28 @@ if __name__ == "__main__":
     print("\033[1mSource Repository\033[0m:")
     print("https://github.com/drmext/MonkeyBusiness")
     print()
-    uvicorn.run("pyeamu:app", host="0.0.0.0", port=config.port, reload=True)
+    if config.workers > 1:
+        # production: reload can't be combined with several worker processes
+        uvicorn.run("pyeamu:app", host="0.0.0.0", port=config.port, workers=config.workers)
+    else:
+        uvicorn.run("pyeamu:app", host="0.0.0.0", port=config.port, reload=True)
 
 
-@app.post("/core")
-@app.post("/core/{gameinfo}/services/get")
-async def services_get(
-    request: Request,
-    model: Optional[str] = None,
-    f: Optional[str] = None,
-    module: Optional[str] = None,
-    method: Optional[str] = None,
-):
-    request_info = await core_process_request(request)
+services_cache = ResponseCache()
+cached_hosts = {host.lower() for host in server_hosts}
 
-    request_address = f"{urlparse(str(request.url)).netloc}:{config.port}"
 
+def build_services(request_address, model, url_slash):
     services = {}
 
     for service in modules.routers:
-        model_blacklist = services.get("model_blacklist", [])
-        model_whitelist = services.get("model_whitelist", [])
+        model_blacklist = getattr(service, "model_blacklist", [])
+        model_whitelist = getattr(service, "model_whitelist", [])
 
-        if request_info["model"] in model_blacklist:
+        if model in model_blacklist:
             continue
 
-        if model_whitelist and request_info["model"] not in model_whitelist:
+        if model_whitelist and model not in model_whitelist:
             continue
 
         if (
@@ -145,12 +155,10 @@ async def services_get(
             continue
 
         k = (service.tags[0] if service.tags else service.prefix).strip("/")
-        if f == "services.get" or module == "services" and method == "get":
-            # url_slash 0
-            pre = "/fwdr"
-        else:
-            # url_slash 1
+        if url_slash:
             pre = service.prefix
+        else:
+            pre = "/fwdr"
         if k not in services:
             services[k] = urlunparse(("http", request_address, pre, None, None, None))
 
@@ -174,7 +182,7 @@ async def services_get(
     )
     services["ntp"] = urlunparse(("ntp", "pool.ntp.org", "/", None, None, None))
 
-    response = E.response(
+    return E.response(
         E.services(
             expire=10800,
             mode="operation",
@@ -183,7 +191,40 @@ async def services_get(
         )
     )
 
-    response_body, response_headers = await core_prepare_response(request, response)
+
+@app.post("/core")
+@app.post("/core/{gameinfo}/services/get")
+async def services_get(
+    request: Request,
+    model: Optional[str] = None,
+    f: Optional[str] = None,
+    module: Optional[str] = None,
+    method: Optional[str] = None,
+):
+    request_info = await core_process_request(request)
+
+    request_address = f"{urlparse(str(request.url)).netloc}:{config.port}"
+
+    # url_slash 0 asks for services.get through query parameters
+    url_slash = not (f == "services.get" or module == "services" and method == "get")
+
+    # Routers are fixed after startup, so the list only depends on these
+    key = (request_address, request_info["model"], url_slash)
+
+    # Host and model come from the client, only the ones a cabinet of this
+    # server sends are cached so the cache can't be grown without bound
+    host = urlparse(str(request.url)).hostname
+    if host in cached_hosts and request_info["model"] in games:
+        response_body, response_headers = await core_prepare_cached_response(
+            request,
+            services_cache,
+            key,
+            lambda: build_services(*key),
+        )
+    else:
+        response_body, response_headers = await core_prepare_response(
+            request, build_services(*key)
+        )
     return Response(content=response_body, headers=response_headers)
 
 
@@ -197,6 +238,36 @@ async def get_config():
     return settings
 
 
+@app.get("/stats/codec")
+async def codec_stats():
+    return get_codec_stats()
+
+
+@app.get("/stats/request_cache")
+async def request_cache_stats():
+    return get_request_cache_stats()
+
+
+@app.get("/stats/db")
+async def db_stats():
+    return get_db_stats()
+
+
+@app.get("/stats/snapshots")
+async def snapshot_stats():
+    return get_snapshots().get_stats()
+
+
+@app.on_event("startup")
+async def warm_indexes():
+    await get_async_db().run(warm_up)
+
+
+@app.on_event("shutdown")
+async def flush_db():
+    get_db().close()
+
+
 @app.get("/conv/{card}")
 async def card_conv(card: str):
     card = card.upper()
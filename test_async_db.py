@@ -0,0 +1,194 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from unittest import mock
+
+from tinydb import TinyDB, where
+from tinydb.storages import JSONStorage
+
+from core_database import (
+    AsyncDB,
+    IndexedTable,
+    LockedJSONStorage,
+    MonkeyDB,
+    SharedJSONStorage,
+    SharedTable,
+    db_executor,
+    open_tinydb,
+)
+from core_sqlite import SQLiteDB
+
+
+async def charge(async_db, times):
+    def consume(bal):
+        bal = bal or {"cardid": "E004", "balance": times, "total_spent": 0}
+        # give other DB threads the chance to read the same balance
+        time.sleep(0.001)
+        bal["balance"] -= 1
+        bal["total_spent"] += 1
+        return bal
+
+    await asyncio.gather(
+        *(
+            async_db.table("paseli").update_with(where("cardid") == "E004", consume)
+            for _ in range(times)
+        )
+    )
+    return await async_db.table("paseli").search(where("cardid") == "E004")
+
+
+def test_update_with_tinydb():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = MonkeyDB({None: open_tinydb(os.path.join(tmp, "db.json"))}, lambda n: None)
+        rows = asyncio.run(charge(AsyncDB(db, db_executor), 200))
+        assert rows == [{"cardid": "E004", "balance": 0, "total_spent": 200}]
+        db.close()
+
+
+def test_update_with_sqlite():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteDB(os.path.join(tmp, "db.sqlite3"))
+        rows = asyncio.run(charge(AsyncDB(db, db_executor), 200))
+        assert rows == [{"cardid": "E004", "balance": 0, "total_spent": 200}]
+        db.close()
+
+
+def open_shared(path):
+    # what every worker opens with workers > 1
+    tinydb = TinyDB(path, storage=SharedJSONStorage)
+    tinydb.table_class = SharedTable
+    return MonkeyDB({None: tinydb}, lambda n: None)
+
+
+def test_shared_workers():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "db.json")
+        one, two = open_shared(path), open_shared(path)
+
+        # a query one worker ran before is not answered from its cache
+        assert one.table("paseli").search(where("cardid") == "E004") == []
+        two.table("paseli").insert({"cardid": "E004", "balance": 1})
+        assert len(one.table("paseli").search(where("cardid") == "E004")) == 1
+
+        # both pick the next free ID from the file
+        one.table("paseli").insert({"cardid": "E005"})
+        two.table("paseli").insert_multiple([{"cardid": "E006"}, {"cardid": "E007"}])
+        assert one.table("paseli").insert({"cardid": "E008"}) == 5
+        assert sorted(d.doc_id for d in two.table("paseli").all()) == [1, 2, 3, 4, 5]
+
+        one.table("paseli").remove(where("cardid") != "E004")
+        rows = asyncio.run(charge_workers(one, two, 100))
+        assert rows == [{"cardid": "E004", "balance": -99, "total_spent": 100}]
+
+
+async def charge_workers(one, two, times):
+    def consume(bal):
+        time.sleep(0.001)
+        bal["balance"] -= 1
+        bal["total_spent"] = bal.get("total_spent", 0) + 1
+        return bal
+
+    workers = AsyncDB(one, db_executor), AsyncDB(two, db_executor)
+    await asyncio.gather(
+        *(
+            workers[i % 2]
+            .table("paseli")
+            .update_with(where("cardid") == "E004", consume)
+            for i in range(times)
+        )
+    )
+    return await workers[0].table("paseli").search(where("cardid") == "E004")
+
+
+def test_key_lock():
+    async def run():
+        async_db = AsyncDB(None, db_executor)
+        order = []
+
+        async def step(name):
+            async with async_db.lock("paseli", "E004"):
+                order.append(name)
+                await asyncio.sleep(0.01)
+                order.append(name)
+
+        await asyncio.gather(step("a"), step("b"))
+        assert order in (["a", "a", "b", "b"], ["b", "b", "a", "a"])
+
+    asyncio.run(run())
+
+
+async def play(async_db, fail=False):
+    def update_best(best):
+        best = best or {"iidx_id": 1, "music_id": 1000, "ex_score": 0}
+        best["ex_score"] = max(best["ex_score"], 1500)
+        return best
+
+    async with async_db.unit_of_work() as uow:
+        uow.table("iidx_scores").insert({"iidx_id": 1, "music_id": 1000})
+        best = uow.table("iidx_scores_best").update_with(
+            where("iidx_id") == 1, update_best
+        )
+        uow.table("iidx_profile").update({"plays": 1}, where("iidx_id") == 1)
+        if fail:
+            raise ValueError("bad request")
+    return best.result()
+
+
+def test_unit_of_work_tinydb():
+    writes = []
+    file_write = JSONStorage.write
+
+    def counting_write(self, data):
+        writes.append(data)
+        file_write(self, data)
+
+    with tempfile.TemporaryDirectory() as tmp, mock.patch.object(
+        JSONStorage, "write", counting_write
+    ):
+        tinydb = TinyDB(os.path.join(tmp, "db.json"), storage=LockedJSONStorage)
+        tinydb.table_class = IndexedTable
+        db = MonkeyDB({None: tinydb}, lambda n: None)
+        db.table("iidx_profile").insert({"iidx_id": 1})
+        writes.clear()
+        async_db = AsyncDB(db, db_executor)
+
+        try:
+            asyncio.run(play(async_db, fail=True))
+        except ValueError:
+            pass
+        assert writes == []
+        assert db.table("iidx_scores").all() == []
+
+        assert asyncio.run(play(async_db))["ex_score"] == 1500
+        assert len(writes) == 1
+        assert len(db.table("iidx_scores")) == 1
+        assert db.table("iidx_profile").all() == [{"iidx_id": 1, "plays": 1}]
+
+        # what reached the file is the whole unit
+        reopened = TinyDB(os.path.join(tmp, "db.json"), storage=JSONStorage)
+        assert len(reopened.table("iidx_scores")) == 1
+        assert reopened.table("iidx_scores_best").all()[0]["ex_score"] == 1500
+
+
+def test_unit_of_work_sqlite():
+    with tempfile.TemporaryDirectory() as tmp:
+        db = SQLiteDB(os.path.join(tmp, "db.sqlite3"))
+        db.table("iidx_profile").insert({"iidx_id": 1})
+        async_db = AsyncDB(db, db_executor)
+        assert asyncio.run(play(async_db))["ex_score"] == 1500
+        assert asyncio.run(play(async_db))["ex_score"] == 1500
+        assert len(db.table("iidx_scores")) == 2
+        assert len(db.table("iidx_scores_best")) == 1
+        db.close()
+
+
+if __name__ == "__main__":
+    test_update_with_tinydb()
+    test_update_with_sqlite()
+    test_shared_workers()
+    test_key_lock()
+    test_unit_of_work_tinydb()
+    test_unit_of_work_sqlite()
+    print("ok")
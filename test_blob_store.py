@@ -0,0 +1,43 @@
+import os
+import tempfile
+
+import pytest
+
+import core_blobs
+from core_blobs import BlobStore, load_ghost, load_ghosts, store_ghost
+
+
+def test_blob_store():
+    with tempfile.TemporaryDirectory() as tmp:
+        blobs = BlobStore(tmp)
+        key = blobs.put(b"\x00\x01ghost")
+        assert blobs.put(b"\x00\x01ghost") == key
+        assert key in blobs
+        assert blobs.get(key) == b"\x00\x01ghost"
+        assert blobs.get(blobs.put(b"")) == b""
+        assert len(os.listdir(os.path.join(tmp, key[:2]))) == 1
+
+
+def test_ghost_refs(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_blobs, "blobs", BlobStore(str(tmp_path)))
+    ghost = bytes(range(256)).hex() * 4
+    ref = store_ghost(ghost)
+    assert ref.startswith(core_blobs.BLOB_PREFIX)
+    assert store_ghost(ref) == ref
+    assert load_ghost(ref) == ghost
+    assert load_ghost(ghost) == ghost
+    assert load_ghost(0) == 0
+    assert store_ghost(None) is None
+
+    text = "1,2,3;ＤＤＲ"
+    assert load_ghost(store_ghost(text, binary=False), binary=False) == text
+
+    row = {"music_id": 1000, "ghost": ref, "ghost_gauge": store_ghost("00ff")}
+    assert load_ghosts([row]) == [
+        {"music_id": 1000, "ghost": ghost, "ghost_gauge": "00ff"}
+    ]
+    assert row["ghost"] == ref
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__]))
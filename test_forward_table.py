@@ -0,0 +1,44 @@
+import modules
+
+# values filled into path parameters when building slashless requests
+sample_params = {
+    "KFC": "6",
+    "M32": "galaxywave",
+    "REC": "1",
+}
+
+
+def prefixed_routes():
+    for router in modules.routers:
+        if not router.tags or router.tags[0].startswith("api_") or router is modules.router:
+            continue
+
+        for model in getattr(router, "model_whitelist", None) or ["ZZZ"]:
+            for route in router.routes:
+                if "{gameinfo}" in route.path:
+                    yield model, route
+
+
+def test_forward_table():
+    claimed = {}
+
+    for model, route in prefixed_routes():
+        segments = route.path.strip("/").split("/")
+        module, method = segments[segments.index("{gameinfo}") + 1 :]
+        has_params = "{" in module or "{" in method
+
+        value = sample_params.get(model, "")
+        module = modules.re.sub(r"\{[^}]*\}", value, module)
+        method = modules.re.sub(r"\{[^}]*\}", value, method)
+
+        endpoint, extra = modules.resolve_slashless(f"{model}:J:A:A:2025091700", module, method)
+
+        # the first route registered for a key wins, like FastAPI's own matching
+        expected = claimed.setdefault((model, module.lower(), method.lower()), route.endpoint)
+        assert endpoint is expected, (model, route.path)
+        assert extra == ((value,) if has_params else ()), (model, route.path)
+
+
+if __name__ == "__main__":
+    test_forward_table()
+    print(f"{len(modules.forward_table)} slashless routes OK")
@@ -0,0 +1,253 @@
+import random
+
+import pytest
+from tinydb import where
+
+import config
+import core_iidx
+from core_iidx import (
+    Champions,
+    ClearRates,
+    TopScores,
+    best_score_saved,
+    get_djname,
+    get_profile_summary,
+    get_ranklist,
+    profile_saved,
+    score_stats_saved,
+)
+from core_state import ResponseCache
+
+
+@pytest.fixture(autouse=True)
+def iidx_views(monkeypatch):
+    # every test starts without the views built from the previous one's db
+    for name in ("top_scores", "champions", "clear_rates"):
+        monkeypatch.setattr(core_iidx, name, None)
+    monkeypatch.setattr(core_iidx, "leaderboards", {})
+    monkeypatch.setattr(core_iidx, "profile_summaries", {})
+    monkeypatch.setattr(core_iidx, "crate_bodies", ResponseCache())
+
+
+def sample_best(rng):
+    return {
+        "iidx_id": rng.randint(1, 20),
+        "play_style": rng.randint(0, 1),
+        "music_id": rng.choice((1000, 1001, 33000, 33001)),
+        "chart_id": rng.randint(0, 4),
+        "clear_flg": rng.randint(1, 7),
+        "ex_score": rng.randint(0, 3000),
+    }
+
+
+def test_top_scores(db):
+    rng = random.Random(33)
+    incremental = TopScores()
+    for _ in range(500):
+        record = sample_best(rng)
+        db.table("iidx_scores_best").insert(record)
+        incremental.add(record)
+
+    built = TopScores.build(db)
+    assert built.styles == incremental.styles
+
+    for play_style in (0, 1):
+        expected = {}
+        for record in db.table("iidx_scores_best").all():
+            if record["play_style"] != play_style or record["music_id"] >= 2000:
+                continue
+            key = record["music_id"], record["chart_id"]
+            if record["ex_score"] > expected.get(key, (-1,))[0]:
+                expected[key] = (record["ex_score"], record["iidx_id"])
+        assert {
+            (music_id, chart_id): top
+            for music_id, charts in built.charts(play_style, 2000)
+            for chart_id, top in charts.items()
+        } == expected
+
+
+def game_profile(iidx_id):
+    return {
+        "djname": f"DJ{iidx_id}",
+        "region": 1,
+        "body": 0,
+        "face": 0,
+        "hair": 0,
+        "hand": 0,
+        "head": 0,
+        "grade_double": -1,
+        "grade_single": -1,
+    }
+
+
+def expected_ranklist(db, game_version):
+    ranked = []
+    for record in db.table("iidx_scores_best").all():
+        profile = db.table("iidx_profile").get(where("iidx_id") == record["iidx_id"])
+        if str(game_version) in profile["version"]:
+            ranked.append(
+                (-record["clear_flg"], -record["ex_score"], record["iidx_id"])
+            )
+    return [
+        (iidx_id, -clear_flg, -ex_score)
+        for clear_flg, ex_score, iidx_id in sorted(ranked)
+    ]
+
+
+def test_leaderboard(db, monkeypatch):
+    rng = random.Random(573)
+    # odd players have a profile for 33, even ones only for 32
+    for iidx_id in range(1, 21):
+        version = "33" if iidx_id % 2 else "32"
+        db.table("iidx_profile").insert(
+            {"iidx_id": iidx_id, "version": {version: game_profile(iidx_id)}}
+        )
+
+    chart = (where("play_style") == 0) & (where("music_id") == 33000)
+    for _ in range(300):
+        iidx_id = rng.randint(1, 20)
+        mine = chart & (where("iidx_id") == iidx_id)
+        best = db.table("iidx_scores_best").get(mine)
+        best = best or {"iidx_id": iidx_id, "play_style": 0, "music_id": 33000}
+        best["chart_id"] = 2
+        best["clear_flg"] = max(best.get("clear_flg", 0), rng.randint(1, 7))
+        best["ex_score"] = max(best.get("ex_score", 0), rng.randint(0, 3000))
+        db.table("iidx_scores_best").upsert(best, mine)
+        best_score_saved(best)
+
+        ranklist, my_rank, total = get_ranklist(33, 0, 33000, 2, iidx_id)
+        expected = expected_ranklist(db, 33)
+        assert [
+            (row["iidx_id"], row["clflg"], row["score"]) for row in ranklist
+        ] == expected
+        assert [row["rnum"] for row in ranklist] == list(range(1, total + 1))
+        assert total == len(expected)
+        if iidx_id % 2:
+            assert ranklist[my_rank - 1]["iidx_id"] == iidx_id
+            assert ranklist[my_rank - 1]["name"] == f"DJ{iidx_id}"
+        else:
+            assert my_rank == 0
+
+    # the top 3 and one player either side
+    with monkeypatch.context() as m:
+        m.setattr(config, "iidx_ranklist_top", 3)
+        m.setattr(config, "iidx_ranklist_around", 1)
+        last = expected_ranklist(db, 33)[-1][0]
+        ranklist, my_rank, total = get_ranklist(33, 0, 33000, 2, last)
+        assert [row["rnum"] for row in ranklist] == [1, 2, 3, total - 1, total]
+
+    # registering for 33 ranks a player on the charts played before
+    profile = db.table("iidx_profile").get(where("iidx_id") == 2)
+    profile["version"]["33"] = game_profile(2)
+    db.table("iidx_profile").upsert(profile, where("iidx_id") == 2)
+    profile_saved(2)
+    ranklist, my_rank, total = get_ranklist(33, 0, 33000, 2, 2)
+    assert my_rank != 0
+    assert [
+        (row["iidx_id"], row["clflg"], row["score"]) for row in ranklist
+    ] == expected_ranklist(db, 33)
+
+
+def test_clear_rates(db):
+    stats = {
+        "music_id": 32001,
+        "play_style": 0,
+        "chart_id": 2,
+        "clear_rate": 500,
+        "fc_rate": 0,
+    }
+    db.table("iidx_score_stats").insert(stats)
+    clear_rates = core_iidx.get_clear_rates()
+    assert list(clear_rates.below(33000)) == [(32001, 0, 2, 500, 0)]
+    assert list(clear_rates.below(32000)) == []
+
+    core_iidx.crate_bodies.update(
+        {(31, "binary"): b"31", (32, "binary"): b"32", (33, "xml"): b"33"}
+    )
+    # the same rates keep every body
+    score_stats_saved(dict(stats))
+    assert len(core_iidx.crate_bodies) == 3
+
+    # a changed rate drops the bodies of the versions sending the chart
+    stats["clear_rate"] = 501
+    score_stats_saved(stats)
+    assert list(core_iidx.crate_bodies) == [(31, "binary")]
+    assert list(clear_rates.below(33000)) == [(32001, 0, 2, 501, 0)]
+
+    # a body still rendering when the rate changes is not stored
+    generation = core_iidx.crate_bodies.generation((33, "binary"))
+    stats["clear_rate"] = 502
+    score_stats_saved(stats)
+    core_iidx.crate_bodies.store((33, "binary"), b"stale", generation)
+    assert list(core_iidx.crate_bodies) == [(31, "binary")]
+    generation = core_iidx.crate_bodies.generation((33, "binary"))
+    core_iidx.crate_bodies.store((33, "binary"), b"33", generation)
+    assert core_iidx.crate_bodies[33, "binary"] == b"33"
+
+    db.table("iidx_score_stats").update(stats)
+    assert ClearRates.build(db).charts == clear_rates.charts
+
+
+def test_champions(db):
+    rng = random.Random(10)
+    champions = core_iidx.get_champions()
+    for n in range(500):
+        record = sample_best(rng)
+        record["game_version"] = 33
+        record["pid"] = 13
+        # half of the rows still hold an inline hex ghost
+        record["ghost"] = f"blob:{n:064x}" if n % 2 else f"{n:04x}"
+        cond = (
+            (where("iidx_id") == record["iidx_id"])
+            & (where("play_style") == record["play_style"])
+            & (where("music_id") == record["music_id"])
+            & (where("chart_id") == record["chart_id"])
+        )
+        best = db.table("iidx_scores_best").get(cond)
+        if best is not None and best["ex_score"] > record["ex_score"]:
+            continue
+        db.table("iidx_scores_best").upsert(record, cond)
+        best_score_saved(record)
+
+    assert Champions.build(db).charts == champions.charts
+    for music_id in (1000, 1001, 33000, 33001):
+        for chart_id in range(5):
+            records = db.table("iidx_scores_best").search(
+                (where("music_id") == music_id) & (where("chart_id") == chart_id)
+            )
+            sdata = core_iidx.get_champion(music_id, chart_id)
+            best = max(records, key=lambda r: r["ex_score"], default=None)
+            if best is None:
+                assert sdata is None
+                continue
+            assert sdata["ex_score"] == best["ex_score"]
+            holder = [
+                r
+                for r in records
+                if r["iidx_id"] == sdata["iidx_id"]
+                and r["play_style"] == sdata["play_style"]
+            ]
+            assert holder[0]["ex_score"] == sdata["ex_score"]
+            assert holder[0]["ghost"] == sdata["ghost"]
+
+
+def test_profile_summary(db):
+    db.table("iidx_profile").insert({"iidx_id": 1, "version": {"33": game_profile(1)}})
+    summary = get_profile_summary(1, 33)
+    assert not hasattr(summary, "__dict__")
+    assert (summary.djname, summary.region, summary.sach) == ("DJ1", 1, 0)
+    assert get_profile_summary(1, 32) is None
+    assert get_djname(1, 32) == "UNK"
+    assert get_djname(2, 33) == "UNK"
+
+    # cached until the profile is saved again
+    profile = db.table("iidx_profile").get(where("iidx_id") == 1)
+    profile["version"]["33"]["djname"] = "NEW"
+    db.table("iidx_profile").upsert(profile, where("iidx_id") == 1)
+    assert get_djname(1, 33) == "DJ1"
+    profile_saved(1)
+    assert get_djname(1, 33) == "NEW"
+
+
+if __name__ == "__main__":
+    raise SystemExit(pytest.main([__file__]))
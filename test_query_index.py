@@ -0,0 +1,144 @@
+import json
+import os
+import random
+import tempfile
+
+from tinydb import TinyDB, where
+from tinydb.storages import MemoryStorage
+from tinydb.table import Table
+
+from core_database import IndexedTable, WriteBehindStorage
+from core_journal import ScoreJournal
+
+
+def sample_score(rng):
+    score = {
+        "iidx_id": rng.choice((12345678, 87654321, 11112222, "12345678")),
+        "play_style": rng.choice((0, 1, True)),
+        "music_id": rng.randint(1000, 1010),
+        "chart_id": rng.randint(0, 4),
+        "ex_score": rng.randint(0, 3000),
+    }
+    if rng.random() < 0.05:
+        del score["chart_id"]
+    if rng.random() < 0.05:
+        score["music_id"] = [score["music_id"]]
+    return score
+
+
+def sample_queries(rng):
+    for _ in range(50):
+        iidx_id = rng.choice((12345678, 87654321, 11112222, "12345678", 1))
+        play_style = rng.choice((0, 1, 1.0))
+        music_id = rng.randint(1000, 1011)
+        chart_id = rng.randint(0, 4)
+        yield where("iidx_id") == iidx_id
+        yield (where("iidx_id") == iidx_id) & (where("play_style") == play_style)
+        yield (
+            (where("iidx_id") == iidx_id)
+            & (where("play_style") == play_style)
+            & (where("music_id") == music_id)
+            & (where("chart_id") == chart_id)
+        )
+        yield (where("music_id") == music_id) & (where("chart_id") == chart_id)
+        yield (where("music_id") == music_id) & (where("ex_score") > 1500)
+        yield (where("chart_id") == chart_id) & (where("music_id") == music_id) & (
+            where("play_style") == play_style
+        )
+        yield (where("music_id") == music_id) | (where("chart_id") == chart_id)
+
+
+def open_tables():
+    scan = TinyDB(storage=MemoryStorage)
+    scan.table_class = Table
+    indexed = TinyDB(storage=MemoryStorage)
+    indexed.table_class = IndexedTable
+    return scan.table("iidx_scores_best"), indexed.table("iidx_scores_best")
+
+
+def check(scan, indexed, rng):
+    for cond in sample_queries(rng):
+        expected = scan.search(cond)
+        assert indexed.search(cond) == expected, cond
+        assert [d.doc_id for d in indexed.search(cond)] == [d.doc_id for d in expected]
+        assert indexed.get(cond) == (expected[0] if expected else None), cond
+
+
+def test_index_matches_scan():
+    rng = random.Random(573)
+    scan, indexed = open_tables()
+    for table in (scan, indexed):
+        table.insert_multiple(sample_score(random.Random(1)) for _ in range(1))
+    indexed.search(where("iidx_id") == 0)  # build the index before the writes
+
+    for _ in range(800):
+        score = sample_score(rng)
+        scan.insert(score)
+        indexed.insert(score)
+    check(scan, indexed, random.Random(1))
+
+    for _ in range(200):
+        cond = (where("music_id") == rng.randint(1000, 1010)) & (
+            where("chart_id") == rng.randint(0, 4)
+        )
+        fields = {"chart_id": rng.randint(0, 4), "ex_score": rng.randint(0, 3000)}
+        op = rng.random()
+        for table in (scan, indexed):
+            if op < 0.4:
+                table.update(fields, cond)
+            elif op < 0.7:
+                table.upsert(dict(fields, music_id=1005, iidx_id=1), cond)
+            else:
+                table.remove(cond)
+    check(scan, indexed, random.Random(2))
+
+    for table in (scan, indexed):
+        table.truncate()
+        table.insert({"iidx_id": 1, "play_style": 0, "music_id": 1000, "chart_id": 0})
+    check(scan, indexed, random.Random(3))
+
+
+def test_journal_index_matches_scan():
+    rng = random.Random(573)
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = ScoreJournal(tmp, segment_size=1 << 20).table("iidx_scores")
+        scan, _ = open_tables()
+        for _ in range(500):
+            score = sample_score(rng)
+            journal.insert(score)
+            scan.insert(score)
+
+        for cond in sample_queries(random.Random(4)):
+            assert journal.search(cond) == scan.search(cond), cond
+
+
+def test_write_behind_documents_are_copies():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "db.json")
+        db = TinyDB(path, storage=WriteBehindStorage, flush_interval=60)
+        db.table_class = IndexedTable
+        table = db.table("iidx_profile")
+
+        profile = {"iidx_id": 1, "version": {"33": {"djname": "DJ"}}}
+        table.insert(profile)
+        profile["version"]["33"]["djname"] = "INSERTED"
+        table.get(where("iidx_id") == 1)["version"]["33"]["djname"] = "GOT"
+        table.all()[0]["version"]["33"]["djname"] = "ALL"
+        table.get(doc_id=1)["version"]["33"]["djname"] = "DOC_ID"
+
+        fields = {"version": {"33": {"djname": "UPDATED"}}}
+        table.update(fields, where("iidx_id") == 1)
+        fields["version"]["33"]["djname"] = "AFTER_UPDATE"
+
+        assert table.get(where("iidx_id") == 1)["version"]["33"]["djname"] == "UPDATED"
+        db.close()
+        with open(path, "r", encoding="utf-8") as fp:
+            stored = json.load(fp)
+        assert stored["iidx_profile"]["1"]["version"]["33"]["djname"] == "UPDATED"
+
+
+if __name__ == "__main__":
+    test_index_matches_scan()
+    test_journal_index_matches_scan()
+    test_write_behind_documents_are_copies()
+    print("ok")
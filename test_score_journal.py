@@ -0,0 +1,67 @@
+import os
+import tempfile
+
+from tinydb import where
+from tinydb.table import Document
+
+from core_journal import ScoreJournal
+
+
+def sample_score(i):
+    return {"iidx_id": i % 3, "music_id": 1000 + i, "ex_score": i * 7, "ghost": [i] * 8}
+
+
+def test_journal_append_and_read():
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = ScoreJournal(tmp, segment_size=1024)
+        table = journal.table("iidx_scores")
+        doc_ids = [table.insert(sample_score(i)) for i in range(100)]
+        assert doc_ids == list(range(1, 101))
+
+        files = os.listdir(os.path.join(tmp, "iidx_scores"))
+        assert any(f.endswith(".log.gz") for f in files)
+
+        # a fresh reader sees the same rows, sealed segments included
+        reopened = ScoreJournal(tmp, segment_size=1024).table("iidx_scores")
+        assert reopened.all() == table.all()
+        assert len(reopened) == 100
+        assert reopened.get(doc_id=42)["music_id"] == 1041
+        assert reopened.search(where("iidx_id") == 1) == [
+            sample_score(i) for i in range(100) if i % 3 == 1
+        ]
+        assert reopened.insert(sample_score(100)) == 101
+
+
+def test_journal_torn_tail():
+    with tempfile.TemporaryDirectory() as tmp:
+        table = ScoreJournal(tmp, segment_size=1 << 20).table("ddr_scores")
+        table.insert({"ddr_id": 1})
+        table.insert({"ddr_id": 2})
+        path = os.path.join(tmp, "ddr_scores", "00000000.log")
+        with open(path, "ab") as fp:
+            fp.write(b"\x40\x00\x00\x00garbage")
+
+        table = ScoreJournal(tmp, segment_size=1 << 20).table("ddr_scores")
+        assert [d["ddr_id"] for d in table.all()] == [1, 2]
+        assert table.insert({"ddr_id": 3}) == 3
+        table = ScoreJournal(tmp, segment_size=1 << 20).table("ddr_scores")
+        assert [d["ddr_id"] for d in table.all()] == [1, 2, 3]
+
+
+def test_journal_import():
+    with tempfile.TemporaryDirectory() as tmp:
+        journal = ScoreJournal(tmp, segment_size=1 << 20)
+        rows = [Document({"ddr_id": i}, doc_id=i * 2) for i in range(1, 6)]
+        assert journal.import_documents("ddr_scores", rows[:2]) == 2
+        # an interrupted import is picked up where it stopped
+        assert journal.import_documents("ddr_scores", rows) == 3
+        table = journal.table("ddr_scores")
+        assert [d.doc_id for d in table.all()] == [2, 4, 6, 8, 10]
+        assert table.insert({"ddr_id": 6}) == 11
+
+
+if __name__ == "__main__":
+    test_journal_append_and_read()
+    test_journal_torn_tail()
+    test_journal_import()
+    print("ok")
@@ -0,0 +1,79 @@
+import asyncio
+import time
+
+from tinydb import where
+from tinydb.table import Table
+
+from core_database import AsyncDB, IndexedTable, db_executor
+from core_snapshot import Snapshot, SnapshotStore
+from testing_db import make_db
+
+
+def make_profiles(table_class=IndexedTable):
+    db = make_db(table_class)
+    db.table("iidx_profile").insert_multiple(
+        {"iidx_id": i, "card": f"E004{i:012X}", "version": {}} for i in range(100)
+    )
+    return db
+
+
+def test_snapshot_matches_table():
+    db = make_profiles()
+    snapshot = Snapshot("iidx_profile", db.table("iidx_profile").all())
+    for cond in (
+        where("iidx_id") == 42,
+        where("card") == "E00400000000002A",
+        where("iidx_id") > 90,
+        where("iidx_id") == "42",
+    ):
+        assert snapshot.search(cond) == db.table("iidx_profile").search(cond)
+    assert snapshot.get(where("iidx_id") == 7).doc_id == 8
+    assert snapshot.get(where("iidx_id") == 1000) is None
+
+
+def test_snapshot_is_a_copy():
+    async def run():
+        db = make_profiles(Table)
+        store = SnapshotStore(AsyncDB(db, db_executor), max_age=60)
+        snapshot = await store.table("iidx_profile")
+
+        # a plain Table hands out documents sharing nested dicts with storage
+        profile = db.table("iidx_profile").get(where("iidx_id") == 4)
+        profile["version"]["31"] = {"sp_rank": 2}
+        assert snapshot.get(where("iidx_id") == 4)["version"] == {}
+
+    asyncio.run(run())
+
+
+def test_snapshot_generations():
+    async def run():
+        db = make_profiles()
+        store = SnapshotStore(AsyncDB(db, db_executor), max_age=0.05)
+        first = await store.table("iidx_profile")
+        assert len(first) == 100
+
+        # writes are not seen until the next generation
+        db.table("iidx_profile").insert({"iidx_id": 100})
+        assert await store.table("iidx_profile") is first
+
+        time.sleep(0.06)
+        # stale: still served while the next one is taken
+        assert await store.table("iidx_profile") is first
+        await asyncio.sleep(0.05)
+        second = await store.table("iidx_profile")
+        assert second is not first and len(second) == 101
+        assert len(first) == 100
+
+        db.table("iidx_profile").update({"card": "changed"}, where("iidx_id") == 0)
+        store.invalidate("iidx_profile")
+        third = await store.table("iidx_profile")
+        assert third.get(where("iidx_id") == 0)["card"] == "changed"
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    test_snapshot_matches_table()
+    test_snapshot_is_a_copy()
+    test_snapshot_generations()
+    print("ok")
@@ -0,0 +1,69 @@
+import json
+import os
+import tempfile
+
+from core_database import split_db
+
+
+def write_json(path, tables):
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(tables, fp)
+
+
+def read_json(path):
+    with open(path, "r", encoding="utf-8") as fp:
+        return json.load(fp)
+
+
+def test_split_db_merges_into_shards():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "db.json")
+        directory = os.path.join(tmp, "db")
+        os.makedirs(directory)
+        polaris = {
+            "polaris_profile": {"1": {"card": "E004"}},
+            "polaris_score": {"1": {"music_id": 1}},
+        }
+        write_json(os.path.join(directory, "polaris.json"), polaris)
+
+        # a stray db.json from an old tool: an empty polaris_profile and a
+        # table the shards don't have yet
+        write_json(
+            source,
+            {"polaris_profile": {}, "ddr_profile": {"1": {"ddr_id": 1}}},
+        )
+        split_db(source, directory)
+
+        assert read_json(os.path.join(directory, "polaris.json")) == polaris
+        assert read_json(os.path.join(directory, "ddr.json")) == {
+            "ddr_profile": {"1": {"ddr_id": 1}}
+        }
+        assert not os.path.exists(source)
+        assert os.path.exists(f"{source}.unsharded")
+
+
+def test_split_db_refuses_conflicts():
+    with tempfile.TemporaryDirectory() as tmp:
+        source = os.path.join(tmp, "db.json")
+        directory = os.path.join(tmp, "db")
+        os.makedirs(directory)
+        shard = os.path.join(directory, "polaris.json")
+        write_json(shard, {"polaris_profile": {"1": {"name": "NEW"}}})
+        write_json(source, {"polaris_profile": {"1": {"name": "OLD"}}})
+
+        try:
+            split_db(source, directory)
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("split_db replaced a live table")
+
+        assert read_json(shard) == {"polaris_profile": {"1": {"name": "NEW"}}}
+        assert read_json(source) == {"polaris_profile": {"1": {"name": "OLD"}}}
+        assert os.listdir(directory) == ["polaris.json"]
+
+
+if __name__ == "__main__":
+    test_split_db_merges_into_shards()
+    test_split_db_refuses_conflicts()
+    print("ok")
@@ -0,0 +1,117 @@
+import os
+import random
+import tempfile
+
+from tinydb import Query, TinyDB, where
+from tinydb.storages import MemoryStorage
+from tinydb.table import Document
+
+from core_query import equality_terms
+from core_sqlite import SQLiteDB
+
+
+def sample_scores():
+    rng = random.Random(573)
+    for _ in range(500):
+        yield {
+            "iidx_id": rng.choice((12345678, 87654321, 11112222)),
+            "play_style": rng.randint(0, 1),
+            "music_id": rng.randint(1000, 1020),
+            "chart_id": rng.randint(0, 4),
+            "ex_score": rng.randint(0, 3000),
+            "ghost": [rng.randint(0, 255) for _ in range(4)],
+        }
+
+
+def sample_queries():
+    yield where("iidx_id") == 12345678
+    yield (where("iidx_id") == 12345678) & (where("play_style") == 1)
+    yield (
+        (where("iidx_id") == 87654321)
+        & (where("play_style") == 0)
+        & (where("music_id") == 1005)
+        & (where("chart_id") == 3)
+    )
+    yield (where("music_id") == 1010) & (where("ex_score") > 1500)
+    yield (where("music_id") == 1001) | (where("music_id") == 1002)
+    yield Query().chart_id == 2
+    yield where("iidx_id") == "12345678"
+    yield where("missing") == 1
+
+
+def open_dbs(tmp):
+    tiny = TinyDB(storage=MemoryStorage)
+    sqlite = SQLiteDB(os.path.join(tmp, "db.sqlite3"))
+    return tiny, sqlite
+
+
+def test_equality_terms():
+    cond = (where("iidx_id") == 1) & (where("music_id") == 2) & (where("x") > 3)
+    assert equality_terms(cond) == {"iidx_id": 1, "music_id": 2}
+    assert equality_terms((where("a") == 1) | (where("b") == 2)) == {}
+    assert equality_terms(where("a").b == 1) == {}
+    assert equality_terms(where("a") == [1]) == {}
+
+
+def test_sqlite_matches_tinydb():
+    with tempfile.TemporaryDirectory() as tmp:
+        tiny, sqlite = open_dbs(tmp)
+        for db in (tiny, sqlite):
+            table = db.table("iidx_scores_best")
+            for score in sample_scores():
+                table.insert(score)
+
+        for cond in sample_queries():
+            expected = tiny.table("iidx_scores_best").search(cond)
+            result = sqlite.table("iidx_scores_best").search(cond)
+            assert result == expected
+            assert [d.doc_id for d in result] == [d.doc_id for d in expected]
+            first = sqlite.table("iidx_scores_best").get(cond)
+            assert first == (expected[0] if expected else None)
+        sqlite.close()
+
+
+def test_sqlite_writes():
+    with tempfile.TemporaryDirectory() as tmp:
+        tiny, sqlite = open_dbs(tmp)
+        for db in (tiny, sqlite):
+            table = db.table("iidx_profile")
+            table.insert({"card": "E004000000000001", "iidx_id": 1, "djname": "A"})
+            table.insert({"card": "E004000000000002", "iidx_id": 2, "djname": "B"})
+
+            # get, modify, upsert back, the way the handlers save profiles
+            profile = table.get(where("card") == "E004000000000001")
+            profile["djname"] = "C"
+            table.upsert(profile, where("card") == "E004000000000001")
+            table.upsert({"card": "E004000000000003", "iidx_id": 3}, where("card") == "E004000000000003")
+            table.update({"djname": "D"}, where("iidx_id") == 2)
+            table.remove(where("iidx_id") == 3)
+            table.insert(Document({"card": "E004000000000009", "iidx_id": 9}, doc_id=20))
+
+        assert sqlite.table("iidx_profile").all() == tiny.table("iidx_profile").all()
+        assert len(sqlite.table("iidx_profile")) == len(tiny.table("iidx_profile"))
+        assert sqlite.table("iidx_profile").get(doc_id=20)["iidx_id"] == 9
+        sqlite.drop_table("iidx_profile")
+        assert sqlite.table("iidx_profile").all() == []
+        sqlite.close()
+
+
+def test_sqlite_uses_index():
+    with tempfile.TemporaryDirectory() as tmp:
+        _, sqlite = open_dbs(tmp)
+        sqlite.table("iidx_profile")
+        plan = sqlite.connection().execute(
+            "EXPLAIN QUERY PLAN SELECT doc_id FROM \"iidx_profile\" "
+            "WHERE json_extract(data, '$.\"card\"') = ?",
+            ("E004000000000001",),
+        ).fetchall()
+        assert "USING INDEX" in str(plan), plan
+        sqlite.close()
+
+
+if __name__ == "__main__":
+    test_equality_terms()
+    test_sqlite_matches_tinydb()
+    test_sqlite_writes()
+    test_sqlite_uses_index()
+    print("ok")
@@ -0,0 +1,35 @@
+import time
+
+import core_state
+from core_state import MemoryState, SQLiteState
+
+
+def check_sweep(state, keys, monkeypatch):
+    monkeypatch.setattr(core_state, "SWEEP_INTERVAL", 0)
+    state.set("session.1", "E004", ttl=0.01)
+    state.set("session.2", "E004", ttl=60)
+    state.set("counter", 1)
+    time.sleep(0.02)
+
+    # nothing reads session.1 again, the next write drops it
+    state.incr("counter")
+    assert keys() == {"session.2", "counter"}
+    assert state.get("session.2") == "E004"
+
+    state.delete("session.2")
+    assert keys() == {"counter"}
+
+
+def test_memory_state_sweep(monkeypatch):
+    state = MemoryState()
+    check_sweep(state, lambda: set(state._data), monkeypatch)
+
+
+def test_sqlite_state_sweep(tmp_path, monkeypatch):
+    state = SQLiteState(str(tmp_path / "state.db"))
+
+    def keys():
+        rows = state._connection().execute("SELECT key FROM state")
+        return {key for key, in rows}
+
+    check_sweep(state, keys, monkeypatch)
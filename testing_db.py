@@ -0,0 +1,14 @@
+from tinydb import TinyDB
+from tinydb.storages import MemoryStorage
+
+from core_database import IndexedTable, MonkeyDB
+
+
+# In-memory stand-in for the MonkeyDB of core_database, shared by the tests
+# and the benchmarks in utils/
+
+
+def make_db(table_class=IndexedTable):
+    tinydb = TinyDB(storage=MemoryStorage)
+    tinydb.table_class = table_class
+    return MonkeyDB({None: tinydb}, lambda name: None)
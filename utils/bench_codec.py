@@ -0,0 +1,105 @@
+import asyncio
+import statistics
+import sys
+import time
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+import config
+
+from kbinxml import KBinXML
+
+from core_common import core_process_request, core_prepare_response, E
+from utils.arc4 import EamuseARC4
+from utils.lz77 import lz77_encode
+
+
+class FakeRequest:
+    def __init__(self, body, headers):
+        self._body = body
+        self.headers = headers
+
+    async def body(self):
+        return self._body
+
+
+def make_request(xml, compress):
+    data = KBinXML(xml).to_binary()
+    if compress:
+        data = lz77_encode(data)
+    data = EamuseARC4(bytes.fromhex("00000001"), bytes.fromhex("0001")).encrypt(data)
+    headers = {
+        "Content-Length": str(len(data)),
+        "X-Eamuse-Info": "1-00000001-0001",
+        "X-Compress": "lz77" if compress else "none",
+    }
+    return data, headers
+
+
+def small_xml():
+    return E.call(E.cardmng(method="inquire", cardid="E004000000000000"), model="LDJ:J:B:A:2025091700")
+
+
+def large_xml():
+    return E.call(
+        E.IIDX33pc(
+            *[E.m([i, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10], __type="s32") for i in range(20000)],
+            method="save",
+        ),
+        model="LDJ:J:B:A:2025091700",
+    )
+
+
+def large_response():
+    return E.response(
+        E.IIDX33music(
+            *[E.m([-1, i, *range(15)], __type="s32") for i in range(20000)],
+        )
+    )
+
+
+async def roundtrip(body, headers, response):
+    request = FakeRequest(body, headers)
+    await core_process_request(request)
+    await core_prepare_response(request, response)
+
+
+async def run(duration=10.0, big_clients=2):
+    small = make_request(small_xml(), False)
+    big = make_request(large_xml(), True)
+    big_response = large_response()
+    latencies = []
+    deadline = time.perf_counter() + duration
+
+    async def small_client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            await roundtrip(*small, E.response(E.cardmng(status=0)))
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(0.01)
+
+    async def big_client():
+        while time.perf_counter() < deadline:
+            await roundtrip(*big, big_response)
+
+    await asyncio.gather(small_client(), *[big_client() for _ in range(big_clients)])
+
+    latencies.sort()
+    return (
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        len(latencies),
+    )
+
+
+if __name__ == "__main__":
+    config.verbose_log = False
+
+    for label, offload_size in (
+        ("inline", float("inf")),
+        (f"offload >= {config.codec_offload_size}", config.codec_offload_size),
+    ):
+        config.codec_offload_size = offload_size
+        p50, p99, count = asyncio.run(run())
+        print(f"{label:>20}: small request p50 {p50:.2f} ms, p99 {p99:.2f} ms ({count} samples)")
@@ -0,0 +1,183 @@
+import argparse
+import random
+import sys
+import time
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from tinydb import where
+
+import core_database
+import core_iidx
+from testing_db import make_db
+
+# Usage: python utils/bench_iidx_getrank.py [--players 500] [--scores 20000]
+# Times the score and top-score part of IIDX33music/getrank on a synthetic
+# in-memory database, scanning iidx_scores_best as getrank used to against
+# the indexed best scores and core_iidx.TopScores.
+
+GAME_VERSION = 33
+
+
+def fill_db(players, scores, rng):
+    db = make_db()
+
+    db.table("iidx_profile").insert_multiple(
+        {
+            "iidx_id": 10000000 + i,
+            "card": f"E004{i:012X}",
+            "version": {
+                str(GAME_VERSION): {
+                    "djname": f"DJ{i:04d}",
+                    "region": 13,
+                    "grade_single": -1,
+                    "grade_double": -1,
+                }
+            },
+        }
+        for i in range(players)
+    )
+
+    charts = set()
+    while len(charts) < scores:
+        charts.add(
+            (
+                10000000 + rng.randrange(players),
+                rng.randint(0, 1),
+                # about 60 songs per version, as the real music data has
+                rng.randint(1, GAME_VERSION) * 1000 + rng.randint(0, 59),
+                rng.randint(0, 4),
+            )
+        )
+    db.table("iidx_scores_best").insert_multiple(
+        {
+            "iidx_id": iidx_id,
+            "play_style": play_style,
+            "music_id": music_id,
+            "chart_id": chart_id,
+            "clear_flg": rng.randint(1, 7),
+            "ex_score": rng.randint(0, 4000),
+            "miss_count": rng.randint(0, 100),
+        }
+        for iidx_id, play_style, music_id, chart_id in sorted(charts)
+    )
+    return db
+
+
+def player_scores(db, requested_ids, play_style):
+    all_scores = {}
+    for rival_idx, iidxid in enumerate(requested_ids, -1):
+        for record in db.table("iidx_scores_best").search(
+            (where("music_id") < (GAME_VERSION + 1) * 1000)
+            & (where("play_style") == play_style)
+            & (where("iidx_id") == iidxid)
+        ):
+            all_scores[rival_idx, record["music_id"], record["chart_id"]] = (
+                record["clear_flg"],
+                record["ex_score"],
+                record["miss_count"],
+            )
+    return all_scores
+
+
+def getrank_scan(db, requested_ids, play_style):
+    # what getrank did before: a full scan per rival, another one for the
+    # top scores and every profile for the names
+    all_scores = {}
+    for rival_idx, iidxid in enumerate(requested_ids, -1):
+        for record in db.table("iidx_scores_best")._read_table().values():
+            if (
+                record["music_id"] < (GAME_VERSION + 1) * 1000
+                and record["play_style"] == play_style
+                and record["iidx_id"] == iidxid
+            ):
+                all_scores[rival_idx, record["music_id"], record["chart_id"]] = (
+                    record["clear_flg"],
+                    record["ex_score"],
+                    record["miss_count"],
+                )
+
+    names = {}
+    for p in db.table("iidx_profile"):
+        try:
+            names[p["iidx_id"]] = p["version"][str(GAME_VERSION)]["djname"]
+        except KeyError:
+            names[p["iidx_id"]] = "UNK"
+
+    top_scores = {}
+    for record in db.table("iidx_scores_best").search(
+        (where("music_id") < (GAME_VERSION + 1) * 1000)
+        & (where("play_style") == play_style)
+    ):
+        key = record["music_id"], record["chart_id"]
+        if record["ex_score"] > top_scores.get(key, ("", -1))[1]:
+            top_scores[key] = (names[record["iidx_id"]], record["ex_score"])
+    return all_scores, top_scores
+
+
+def getrank_indexed(db, requested_ids, play_style):
+    all_scores = player_scores(db, requested_ids, play_style)
+
+    names = {}
+    top_scores = {}
+    for music_id, charts in core_iidx.get_top_scores().charts(
+        play_style, (GAME_VERSION + 1) * 1000
+    ):
+        for chart_id, (ex_score, iidx_id) in charts.items():
+            if iidx_id not in names:
+                names[iidx_id] = core_iidx.get_djname(iidx_id, GAME_VERSION)
+            top_scores[music_id, chart_id] = (names[iidx_id], ex_score)
+    return all_scores, top_scores
+
+
+def bench(func, db, requests, rounds):
+    # the first call builds the table indexes
+    func(db, *requests[0])
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for requested_ids, play_style in requests:
+            result = func(db, requested_ids, play_style)
+    return (time.perf_counter() - start) / rounds / len(requests) * 1000, result
+
+
+def main(players, scores, rounds):
+    rng = random.Random(573)
+    start = time.perf_counter()
+    db = fill_db(players, scores, rng)
+    core_database.db = db
+    print(
+        f"{players} players, {scores} best scores "
+        f"({time.perf_counter() - start:.1f}s to build)"
+    )
+
+    start = time.perf_counter()
+    core_iidx.top_scores = None
+    core_iidx.get_top_scores()
+    print(f"TopScores.build: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    # a player and up to six rivals, as song select sends them
+    requests = [
+        (
+            [10000000 + rng.randrange(players) for _ in range(rng.randint(1, 7))],
+            rng.randint(0, 1),
+        )
+        for _ in range(10)
+    ]
+
+    scan_ms, scan_result = bench(getrank_scan, db, requests, rounds)
+    indexed_ms, indexed_result = bench(getrank_indexed, db, requests, rounds)
+    assert scan_result == indexed_result
+
+    print(f"scan:    {scan_ms:8.2f} ms per getrank")
+    print(f"indexed: {indexed_ms:8.2f} ms per getrank ({scan_ms / indexed_ms:.0f}x)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--players", type=int, default=500)
+    parser.add_argument("--scores", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    main(args.players, args.scores, args.rounds)
@@ -0,0 +1,56 @@
+import sys
+import time
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.abspath(__file__))))
+
+from kbinxml import KBinXML
+
+from core_common import E
+
+# Usage: python utils/bench_request_text.py [payload ...]
+# Payloads are decrypted, decompressed request bodies (binary or text XML).
+# Without arguments a synthetic IIDX save-sized request is used.
+
+
+def synthetic_payload():
+    return KBinXML(
+        E.call(
+            E.IIDX33pc(
+                *[E.m([i, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10], __type="s32") for i in range(20000)],
+                method="save",
+            ),
+            model="LDJ:J:B:A:2025091700",
+        )
+    ).to_binary()
+
+
+def bench(payload, rounds=20):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        KBinXML(payload, convert_illegal_things=True).to_text()
+    before = (time.perf_counter() - start) / rounds
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        KBinXML(payload, convert_illegal_things=True)
+    after = (time.perf_counter() - start) / rounds
+
+    return before * 1000, after * 1000
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        payloads = {}
+        for filename in sys.argv[1:]:
+            with open(filename, "rb") as f:
+                payloads[path.basename(filename)] = f.read()
+    else:
+        payloads = {"synthetic IIDX33pc/save": synthetic_payload()}
+
+    for name, payload in payloads.items():
+        before, after = bench(payload)
+        print(
+            f"{name}: {len(payload)} bytes, parse + to_text {before:.2f} ms, "
+            f"parse only {after:.2f} ms ({before / after:.1f}x)"
+        )
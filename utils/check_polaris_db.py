@@ -5,7 +5,14 @@ import os
 # Add root to sys.path to import core_database
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-db = TinyDB("db.json", indent=2, encoding="utf-8", ensure_ascii=False)
+from core_query import db_file
+
+db_path = db_file("polaris_profile")
+if not os.path.exists(db_path):
+    print(f"Error: {db_path} not found.")
+    sys.exit(1)
+
+db = TinyDB(db_path, indent=2, encoding="utf-8", ensure_ascii=False)
 table = db.table("polaris_profile")
 
 print(f"Polaris Profile Count: {len(table.all())}")
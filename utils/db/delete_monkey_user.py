@@ -1,17 +1,48 @@
 import argparse
+import sys
 import time
-from os import stat
+from os import path, replace, stat
 from shutil import copy
 
 from tinydb import TinyDB, where
 from tinydb.middlewares import CachingMiddleware
 from tinydb.storages import JSONStorage
 
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+import config
+
+from core_journal import JournalTable, journal_tables
+from core_query import db_file
+
+
+def delete_journal_scores(table, field, user_id):
+    # The journal is append-only: write the rows of the other users into a
+    # new one, keeping doc_ids, and move the old one aside
+    if table not in journal_tables:
+        return
+    journal = JournalTable(config.journal_dir, table, config.journal_segment_size)
+    if not path.isdir(journal.directory):
+        return
+    documents = journal.all()
+    kept = [d for d in documents if d.get(field) != user_id]
+    if len(kept) == len(documents):
+        return
+
+    archive = f"{journal.directory}_{round(time.time())}"
+    replace(journal.directory, archive)
+    journal = JournalTable(config.journal_dir, table, config.journal_segment_size)
+    with journal.batch():
+        for start in range(0, len(kept), 1000):
+            journal.insert_multiple(kept[start : start + 1000])
+    print(f"Removed {len(documents) - len(kept)} rows of {table}, old one in {archive}")
+
 
 def delete_scores(user_id, game):
     for scores in (f"{game}_scores_best", f"{game}_scores", f"{game}_profile"):
         if db.table(scores).search((where(f"{game}_id") == user_id)):
             db.table(scores).remove((where(f"{game}_id") == user_id))
+    delete_journal_scores(f"{game}_scores", f"{game}_id", user_id)
 
 
 # special case
@@ -25,6 +56,8 @@ def delete_gitadora_scores(user_id):
     ):
         if db.table(scores).search((where("gitadora_id") == user_id)):
             db.table(scores).remove((where("gitadora_id") == user_id))
+    for scores in ("guitarfreaks_scores", "drummania_scores"):
+        delete_journal_scores(scores, "gitadora_id", user_id)
 
 
 if __name__ == "__main__":
@@ -36,8 +69,8 @@ if __name__ == "__main__":
     storage = CachingMiddleware(JSONStorage)
     storage.WRITE_CACHE_SIZE = 5000
 
-    infile = "db.json"
-    outfile = f"db_{round(time.time())}.json"
+    infile = db_file(f"{args.game.lower()}_profile")
+    outfile = f"{path.splitext(infile)[0]}_{round(time.time())}.json"
 
     copy(infile, outfile)
 
@@ -1,10 +1,18 @@
 import argparse
+import sys
 import xml.etree.ElementTree as ET
+from os import path
 
 from tinydb import TinyDB, where
 from tinydb.middlewares import CachingMiddleware
 from tinydb.storages import JSONStorage
 
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+import config
+
+from core_journal import JournalTable
+
 
 def main(automap_xml, version, monkey_db, ddr_id):
     storage = CachingMiddleware(JSONStorage)
@@ -30,6 +38,16 @@ def main(automap_xml, version, monkey_db, ddr_id):
             f"ERROR: DDR profile {ddr_id} version {game_version} not in {monkey_db}"
         )
 
+    # ddr_scores rows are in the score journal once the server has moved
+    # them there (config.score_journal), not in monkey_db
+    ddr_scores = db.table("ddr_scores")
+    if config.score_journal:
+        journal = JournalTable(
+            config.journal_dir, "ddr_scores", config.journal_segment_size
+        )
+        if path.isdir(journal.directory):
+            ddr_scores = journal
+
     scores = []
 
     with open(automap_xml, "rb") as fp:
@@ -99,7 +117,7 @@ def main(automap_xml, version, monkey_db, ddr_id):
                 "exscore": max(exscore, best.get("exscore", exscore)),
             }
 
-            ghostid = db.table("ddr_scores").get(
+            ghostid = ddr_scores.get(
                 (where("ddr_id") == ddr_id)
                 & (where("game_version") == game_version)
                 & (where("mcode") == mcode)
@@ -0,0 +1,71 @@
+import argparse
+import json
+import sys
+import time
+from os import path, stat
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from core_journal import ScoreJournal, journal_tables
+from core_query import shard_prefixes
+from core_sqlite import SQLiteDB, _dumps
+
+
+def copy_table(db, name, documents):
+    table = db.table(name)
+    with db.transaction() as con:
+        # Keep doc_ids, DDR scores_best refers to ghosts by doc_id
+        con.executemany(
+            f"INSERT INTO {table._sql_name} (doc_id, data) VALUES (?, ?)",
+            ((int(doc_id), _dumps(doc)) for doc_id, doc in documents),
+        )
+    print(name, len(documents))
+
+
+def main(monkey_db, journal_dir, sqlite_db):
+    if path.exists(sqlite_db):
+        sys.exit(f"{sqlite_db} already exists, move it away first")
+
+    start = time.time()
+    db = SQLiteDB(sqlite_db)
+    for infile in monkey_db:
+        with open(infile, "r", encoding="utf-8") as fp:
+            tables = json.load(fp)
+        for name, documents in tables.items():
+            copy_table(db, name, list(documents.items()))
+
+    if journal_dir and path.isdir(journal_dir):
+        journal = ScoreJournal(journal_dir, segment_size=0)
+        for name in journal_tables:
+            documents = journal.table(name).all()
+            if documents:
+                copy_table(db, name, [(doc.doc_id, doc) for doc in documents])
+
+    db.connection().execute("ANALYZE")
+    db.close()
+
+    size = sum(stat(infile).st_size for infile in monkey_db)
+    print(
+        f"{', '.join(monkey_db)} ({round(size / 1024 / 1024, 2)} MiB) -> "
+        f"{sqlite_db} ({round(stat(sqlite_db).st_size / 1024 / 1024, 2)} MiB) "
+        f"in {round(time.time() - start, 2)}s"
+    )
+
+
+if __name__ == "__main__":
+    shards = [path.join("db", f"{shard}.json") for shard in (*shard_prefixes, "core")]
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--monkey_db",
+        help="Input json files (default db.json, or the db/<game>.json shards)",
+        nargs="+",
+        default=[shard for shard in shards if path.exists(shard)] or ["db.json"],
+    )
+    parser.add_argument(
+        "--journal_dir", help="Score journal directory", default="scores"
+    )
+    parser.add_argument("--sqlite_db", help="Output sqlite file", default="db.sqlite3")
+    args = parser.parse_args()
+
+    main(args.monkey_db, args.journal_dir, args.sqlite_db)
@@ -0,0 +1,59 @@
+import sys
+import time
+from os import path, stat
+from shutil import copy
+
+from tinydb import TinyDB
+from tinydb.middlewares import CachingMiddleware
+from tinydb.storages import JSONStorage
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+import config
+
+from core_blobs import store_ghost
+from core_query import db_file
+
+# Best scores are the rows kept in the database file; the history tables
+# live in the append-only score journal and keep their inline ghosts
+tables = {"iidx_scores_best": ("ghost", "ghost_gauge")}
+
+if not config.ghost_blobs:
+    # store_ghost() would leave every ghost inline
+    raise SystemExit("ERROR: set ghost_blobs = True in config.py first")
+
+for table, fields in tables.items():
+    infile = db_file(table)
+    if not path.exists(infile):
+        continue
+
+    storage = CachingMiddleware(JSONStorage)
+    storage.WRITE_CACHE_SIZE = 5000
+
+    outfile = f"{path.splitext(infile)[0]}_{round(time.time())}.json"
+
+    copy(infile, outfile)
+
+    db = TinyDB(
+        infile,
+        indent=2,
+        encoding="utf-8",
+        ensure_ascii=False,
+        storage=storage,
+    )
+
+    start_size = stat(infile).st_size
+
+    def move(document):
+        for field in fields:
+            if isinstance(document.get(field), str):
+                document[field] = store_ghost(document[field])
+
+    moved = db.table(table).update(move)
+    print(table, len(moved), "rows")
+
+    db.close()
+
+    end_size = stat(infile).st_size
+
+    print(f"{infile} {round((start_size - end_size) / 1024 / 1024, 2)} MiB trimmed")
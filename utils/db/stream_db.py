@@ -0,0 +1,281 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+from os import path
+
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
+
+from core_query import shard_for
+from core_sqlite import SQLiteDB, _dumps
+
+# Play history with a *_scores_best counterpart, safe to prune. polaris_score
+# is left alone, it is the only score table Polaris has.
+history_tables = (
+    "iidx_scores",
+    "ddr_scores",
+    "sdvx_scores",
+    "guitarfreaks_scores",
+    "drummania_scores",
+    "drs_scores",
+    "nostalgia_scores",
+)
+
+
+class JSONStream:
+    # Reads a TinyDB file ({table: {doc_id: document}}) one document at a
+    # time, so memory stays at one chunk plus the largest document
+
+    def __init__(self, fp, chunk_size=1 << 20):
+        self.fp = fp
+        self.chunk_size = chunk_size
+        self.decoder = json.JSONDecoder()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        chunk = self.fp.read(self.chunk_size)
+        self.buf = self.buf[self.pos :] + chunk
+        self.pos = 0
+        self.eof = not chunk
+
+    def peek(self):
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buf) or self.eof:
+                return self.buf[self.pos : self.pos + 1]
+            self._fill()
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"expected {char!r} at {self.fp.tell()}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+                self._fill()
+                continue
+            # a number running into the end of the buffer may go on
+            if end == len(self.buf) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def documents(self):
+        """Yields (table, doc_id, document)."""
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            table = self.value()
+            self.expect(":")
+            self.expect("{")
+            if self.peek() != "}":
+                while True:
+                    doc_id = self.value()
+                    self.expect(":")
+                    yield table, doc_id, self.value()
+                    if self.peek() != ",":
+                        break
+                    self.pos += 1
+            self.expect("}")
+            if self.peek() != ",":
+                break
+            self.pos += 1
+        self.expect("}")
+
+
+def read_documents(infile):
+    with open(infile, "r", encoding="utf-8") as fp:
+        yield from JSONStream(fp).documents()
+
+
+class JSONWriter:
+    def __init__(self, outfile):
+        self.outfile = outfile
+        self.fp = open(f"{outfile}.tmp", "w", encoding="utf-8")
+        self.fp.write("{")
+        self.table = None
+        self.first = True
+
+    def write(self, table, doc_id, document):
+        if table != self.table:
+            if self.table is not None:
+                self.fp.write("},")
+            self.fp.write(json.dumps(table) + ":{")
+            self.table = table
+            self.first = True
+        if not self.first:
+            self.fp.write(",")
+        self.fp.write(json.dumps(str(doc_id)) + ":")
+        self.fp.write(json.dumps(document, ensure_ascii=False, separators=(",", ":")))
+        self.first = False
+
+    def close(self):
+        if self.table is not None:
+            self.fp.write("}")
+        self.fp.write("}")
+        self.fp.flush()
+        os.fsync(self.fp.fileno())
+        self.fp.close()
+        os.replace(f"{self.outfile}.tmp", self.outfile)
+
+
+class ShardedWriter:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.writers = {}
+
+    def write(self, table, doc_id, document):
+        shard = shard_for(table)
+        if shard not in self.writers:
+            self.writers[shard] = JSONWriter(path.join(self.directory, f"{shard}.json"))
+        self.writers[shard].write(table, doc_id, document)
+
+    def close(self):
+        for writer in self.writers.values():
+            writer.close()
+
+
+class SQLiteWriter:
+    def __init__(self, outfile, batch_size=5000):
+        if path.exists(outfile):
+            sys.exit(f"{outfile} already exists, move it away first")
+        self.db = SQLiteDB(outfile)
+        self.batch_size = batch_size
+        self.table = None
+        self.batch = []
+
+    def _flush(self):
+        if self.batch:
+            with self.db.transaction() as con:
+                con.executemany(
+                    f"INSERT INTO {self.db.table(self.table)._sql_name} "
+                    "(doc_id, data) VALUES (?, ?)",
+                    self.batch,
+                )
+            self.batch = []
+
+    def write(self, table, doc_id, document):
+        if table != self.table or len(self.batch) >= self.batch_size:
+            self._flush()
+            self.table = table
+        self.batch.append((int(doc_id), _dumps(document)))
+
+    def close(self):
+        self._flush()
+        self.db.connection().execute("ANALYZE")
+        self.db.close()
+
+
+def timestamp_of(document):
+    timestamp = document.get("timestamp")
+    if not isinstance(timestamp, (int, float)):
+        return None
+    # gitadora and nostalgia store milliseconds
+    return timestamp / 1000 if timestamp > 1e11 else timestamp
+
+
+def ddr_ghost_ids(infile):
+    # DDR best scores point at their ghost's history row by doc_id
+    return {
+        document["ghostid"]
+        for table, _, document in read_documents(infile)
+        if table == "ddr_scores_best" and "ghostid" in document
+    }
+
+
+def main(monkey_db, output, output_format, prune_days, prune_versions, archive):
+    start = time.time()
+    pruning = prune_days is not None or prune_versions
+    cutoff = time.time() - prune_days * 24 * 60 * 60 if prune_days is not None else None
+    keep_ids = ddr_ghost_ids(monkey_db) if pruning else set()
+
+    if output_format == "json":
+        writer = JSONWriter(output)
+    elif output_format == "sharded":
+        writer = ShardedWriter(output)
+    else:
+        writer = SQLiteWriter(output)
+    archived = gzip.open(archive, "wt", encoding="utf-8") if archive else None
+
+    report = {}
+    for table, doc_id, document in read_documents(monkey_db):
+        stats = report.setdefault(table, {"rows": 0, "pruned": 0, "bytes": 0})
+        stats["rows"] += 1
+
+        if pruning and table in history_tables:
+            timestamp = timestamp_of(document)
+            old = cutoff is not None and timestamp is not None and timestamp < cutoff
+            if prune_versions and document.get("game_version") in prune_versions:
+                old = True
+            if old and not (table == "ddr_scores" and int(doc_id) in keep_ids):
+                stats["pruned"] += 1
+                if archived is not None:
+                    archived.write(
+                        json.dumps(
+                            {"table": table, "doc_id": doc_id, "document": document},
+                            ensure_ascii=False,
+                        )
+                        + "\n"
+                    )
+                continue
+
+        stats["bytes"] += len(_dumps(document).encode("utf-8"))
+        writer.write(table, doc_id, document)
+
+    writer.close()
+    if archived is not None:
+        archived.close()
+
+    print(f"{'table':<28}{'rows':>10}{'pruned':>10}{'MiB':>10}")
+    for table, stats in sorted(report.items(), key=lambda item: -item[1]["bytes"]):
+        print(
+            f"{table:<28}{stats['rows']:>10}{stats['pruned']:>10}"
+            f"{round(stats['bytes'] / 1024 / 1024, 2):>10}"
+        )
+    print(f"{monkey_db} -> {output} in {round(time.time() - start, 2)}s")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--monkey_db", help="Input json file", default="db.json")
+    parser.add_argument(
+        "--output", help="Output json file, shard directory or sqlite file", required=True
+    )
+    parser.add_argument(
+        "--format", choices=("json", "sharded", "sqlite"), default="json"
+    )
+    parser.add_argument(
+        "--prune_days", type=int, help="Drop play history older than this many days"
+    )
+    parser.add_argument(
+        "--prune_versions",
+        type=int,
+        nargs="+",
+        default=[],
+        help="Drop play history of these game versions",
+    )
+    parser.add_argument("--archive", help="Write dropped rows to this .jsonl.gz file")
+    args = parser.parse_args()
+
+    main(
+        args.monkey_db,
+        args.output,
+        args.format,
+        args.prune_days,
+        args.prune_versions,
+        args.archive,
+    )
@@ -1,36 +1,62 @@
+import sys
 import time
-from os import stat
+from os import path, replace, stat
 from shutil import copy
 
 from tinydb import TinyDB
 from tinydb.middlewares import CachingMiddleware
 from tinydb.storages import JSONStorage
 
-storage = CachingMiddleware(JSONStorage)
-storage.WRITE_CACHE_SIZE = 5000
+sys.path.append(path.dirname(path.dirname(path.dirname(path.abspath(__file__)))))
 
-infile = "db.json"
-outfile = f"db_{round(time.time())}.json"
+import config
 
-copy(infile, outfile)
+from core_query import db_file
 
-db = TinyDB(
-    infile,
-    indent=2,
-    encoding="utf-8",
-    ensure_ascii=False,
-    storage=storage,
-)
-
-start_size = stat(infile).st_size
 
 # Non-best tables for GITADORA and IIDX are not used in game
-for table in ("guitarfreaks_scores", "drummania_scores", "iidx_scores"):
-    db.drop_table(table)
-    print("Dropped", table)
+tables = ("guitarfreaks_scores", "drummania_scores", "iidx_scores")
+
+files = {}
+for table in tables:
+    files.setdefault(db_file(table), []).append(table)
+
+for infile, file_tables in files.items():
+    for table in file_tables:
+        # moved out of db.json by the score journal, set aside next to it
+        # the same way db.json is backed up below
+        journal = path.join(config.journal_dir, table)
+        if path.isdir(journal):
+            archive = f"{journal}_{round(time.time())}"
+            replace(journal, archive)
+            print("Moved", table, "journal to", archive)
+
+    if not path.exists(infile):
+        continue
+
+    storage = CachingMiddleware(JSONStorage)
+    storage.WRITE_CACHE_SIZE = 5000
+
+    outfile = f"{path.splitext(infile)[0]}_{round(time.time())}.json"
+
+    copy(infile, outfile)
+
+    db = TinyDB(
+        infile,
+        indent=2,
+        encoding="utf-8",
+        ensure_ascii=False,
+        storage=storage,
+    )
+
+    start_size = stat(infile).st_size
+
+    for table in file_tables:
+        db.drop_table(table)
+        print("Dropped", table)
 
-db.close()
+    db.close()
 
-end_size = stat(infile).st_size
+    end_size = stat(infile).st_size
 
-print(f"{infile} {round((start_size - end_size) / 1024 / 1024, 2)} MiB trimmed")
+    print(f"{infile} {round((start_size - end_size) / 1024 / 1024, 2)} MiB trimmed")
@@ -2,7 +2,11 @@ from tinydb import TinyDB, Query, where
 import sys
 import os
 
-db_path = "db.json"
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from core_query import db_file
+
+db_path = db_file("polaris_profile")
 if not os.path.exists(db_path):
     print(f"Error: {db_path} not found.")
     sys.exit(1)
@@ -1,125 +1,190 @@
 WINDOW_SIZE = 0x1000
 WINDOW_MASK = WINDOW_SIZE - 1
 THRESHOLD = 3
-INPLACE_THRESHOLD = 0xA
-LOOK_RANGE = 0x200
 MAX_LEN = 0xF + THRESHOLD
-MAX_BUFFER = 0x10 + 1
-
-
-def match_current(window: bytes, pos: int, max_len: int, data: bytes, dpos: int) -> int:
-    length = 0
-    while (
-        dpos + length < len(data)
-        and length < max_len
-        and window[(pos + length) & WINDOW_MASK] == data[dpos + length]
-        and length < MAX_LEN
-    ):
-        length += 1
-    return length
-
-
-def match_window(window: bytes, pos: int, data: bytes, d_pos: int) -> None | tuple[int, int]:
-    max_pos = 0
-    max_len = 0
-    for i in range(THRESHOLD, LOOK_RANGE):
-        length = match_current(window, (pos - i) & WINDOW_MASK, i, data, d_pos)
-        if length >= INPLACE_THRESHOLD:
-            return (i, length)
-        if length >= THRESHOLD:
-            max_pos = i
-            max_len = length
-    if max_len >= THRESHOLD:
-        return (max_pos, max_len)
-    return None
-
-
-def lz77_encode(data: bytes) -> bytes:
+MAX_DISTANCE = WINDOW_MASK
+CHAIN_DEPTH = 32
+
+
+def lz77_encode(data: bytes, chain_depth: int = CHAIN_DEPTH) -> bytes:
+    # Greedy LZSS using hash chains keyed on the next THRESHOLD bytes.
+    # head maps a 3-byte key to its most recent position, prev links each
+    # position to the previous one with the same key, so candidates are
+    # visited newest (closest) first and only real matches are ever compared.
+    data = bytes(data)
+    size = len(data)
     output = bytearray()
-    window = bytearray(WINDOW_SIZE)
+    head = {}
+    prev = [-1] * size
+    inserted = 0
     current_pos = 0
-    current_window = 0
-    current_buffer = 0
-    flag_byte = 0
-    bit = 0
-    buffer = [0] * MAX_BUFFER
-    pad = 3
-    while current_pos < len(data):
+
+    while current_pos < size:
+        flag_pos = len(output)
+        output.append(0)
         flag_byte = 0
-        current_buffer = 0
+
         for bit_pos in range(8):
-            if current_pos >= len(data):
-                pad = 0
-                flag_byte = flag_byte >> (8 - bit_pos)
-                buffer[current_buffer] = 0
-                buffer[current_buffer + 1] = 0
-                current_buffer += 2
-                break
+            if current_pos >= size:
+                # terminator: back reference bit (0) followed by a zero word
+                output += b"\x00\x00"
+                output[flag_pos] = flag_byte
+                return bytes(output)
+
+            max_len = min(MAX_LEN, size - current_pos)
+            best_len = 0
+            best_dist = 0
+
+            if max_len >= THRESHOLD:
+                candidate = head.get(data[current_pos : current_pos + THRESHOLD], -1)
+                limit = current_pos - MAX_DISTANCE
+                depth = chain_depth
+                while candidate >= limit and candidate >= 0 and depth:
+                    if best_len == 0 or (
+                        data[candidate + best_len] == data[current_pos + best_len]
+                    ):
+                        length = THRESHOLD
+                        while (
+                            length < max_len
+                            and data[candidate + length] == data[current_pos + length]
+                        ):
+                            length += 1
+                        if length > best_len:
+                            best_len = length
+                            best_dist = current_pos - candidate
+                            if length == max_len:
+                                break
+                    candidate = prev[candidate]
+                    depth -= 1
+
+            if best_len >= THRESHOLD:
+                word = (best_dist << 4) | (best_len - THRESHOLD)
+                output.append(word >> 8)
+                output.append(word & 0xFF)
+                current_pos += best_len
             else:
-                found = match_window(window, current_window, data, current_pos)
-                if found is not None and found[1] >= THRESHOLD:
-                    pos, length = found
-
-                    byte1 = pos >> 4
-                    byte2 = (((pos & 0x0F) << 4) | ((length - THRESHOLD) & 0x0F))
-                    buffer[current_buffer] = byte1
-                    buffer[current_buffer + 1] = byte2
-                    current_buffer += 2
-                    bit = 0
-                    for _ in range(length):
-                        window[current_window & WINDOW_MASK] = data[current_pos]
-                        current_pos += 1
-                        current_window += 1
-                else:
-                    buffer[current_buffer] = data[current_pos]
-                    window[current_window] = data[current_pos]
-                    current_pos += 1
-                    current_window += 1
-                    current_buffer += 1
-                    bit = 1
-
-            flag_byte = (flag_byte >> 1) | ((bit & 1) << 7)
-            current_window = current_window & WINDOW_MASK
-
-        output.append(flag_byte)
-        for i in range(current_buffer):
-            output.append(buffer[i])
-    for _ in range(pad):
-        output.append(0)
+                output.append(data[current_pos])
+                flag_byte |= 1 << bit_pos
+                current_pos += 1
+
+            stop = min(current_pos, size - THRESHOLD + 1)
+            while inserted < stop:
+                key = data[inserted : inserted + THRESHOLD]
+                prev[inserted] = head.get(key, -1)
+                head[key] = inserted
+                inserted += 1
+
+        output[flag_pos] = flag_byte
+
+    output += b"\x00\x00\x00"
 
     return bytes(output)
 
 
-def lz77_decode(data: bytes) -> bytes:
-    output = bytearray()
-    cur_byte = 0
-    window = bytearray(WINDOW_SIZE)
-    window_cursor = 0
-
-    while cur_byte < len(data):
-        flag = data[cur_byte]
-        cur_byte += 1
-
-        for i in range(8):
-            if (flag >> i) & 1 == 1:
-                output.append(data[cur_byte])
-                window[window_cursor] = data[cur_byte]
-                window_cursor = (window_cursor + 1) & WINDOW_MASK
+class Lz77Decoder:
+    # Incremental decoder. Back references are resolved straight from the
+    # output buffer (which already is the history window), non-overlapping
+    # ones with a single slice copy. Input may be fed in arbitrary chunks.
+
+    def __init__(self, size_hint: int = 0):
+        self._output = bytearray(size_hint)
+        self._length = 0
+        self._flag = 0
+        self._bits = 0
+        self._pending = None
+        self.finished = False
+
+    def _copy(self, distance: int, length: int) -> None:
+        output = self._output
+        end = self._length
+        # distance 0 wraps around the ring window, to its oldest byte
+        start = end - (distance or WINDOW_SIZE)
+
+        if start >= 0 and start + length <= end:
+            chunk = output[start : start + length]
+        else:
+            # the bytes from start on repeat every distance bytes; references
+            # before the start of the stream read the zeroed window
+            period = bytes(max(-start, 0)) + bytes(output[max(start, 0) : end])
+            chunk = (period * (length // len(period) + 1))[:length]
+
+        output[end : end + len(chunk)] = chunk
+        self._length = end + len(chunk)
+
+    def feed(self, data: bytes) -> int:
+        # Returns the number of input bytes consumed, which is less than
+        # len(data) only once the end marker has been reached.
+        if self.finished:
+            return 0
+
+        data = memoryview(data)
+        size = len(data)
+        output = self._output
+        cur_byte = 0
+        flag = self._flag
+        bits = self._bits
+
+        if self._pending is not None and size:
+            word = (self._pending << 8) | data[0]
+            self._pending = None
+            cur_byte = 1
+            if word == 0:
+                self.finished = True
+                self._flag, self._bits = flag, bits
+                return cur_byte
+            self._copy(word >> 4, (word & 0x0F) + THRESHOLD)
+
+        while cur_byte < size:
+            if bits == 0:
+                flag = data[cur_byte]
+                cur_byte += 1
+                bits = 8
+                if flag == 0xFF and cur_byte + 8 <= size:
+                    # eight literals in a row
+                    end = self._length
+                    output[end : end + 8] = data[cur_byte : cur_byte + 8]
+                    self._length = end + 8
+                    cur_byte += 8
+                    bits = 0
+                continue
+
+            if flag & 1:
+                end = self._length
+                if end < len(output):
+                    output[end] = data[cur_byte]
+                else:
+                    output.append(data[cur_byte])
+                self._length = end + 1
                 cur_byte += 1
             else:
-                w = ((data[cur_byte]) << 8) | (data[cur_byte + 1])
-                if w == 0:
-                    return bytes(output)
-
+                if cur_byte + 1 >= size:
+                    self._pending = data[cur_byte]
+                    cur_byte += 1
+                    flag >>= 1
+                    bits -= 1
+                    break
+
+                word = (data[cur_byte] << 8) | data[cur_byte + 1]
                 cur_byte += 2
-                position = ((window_cursor - (w >> 4)) & WINDOW_MASK)
-                length = (w & 0x0F) + THRESHOLD
+                if word == 0:
+                    self.finished = True
+                    break
+                self._copy(word >> 4, (word & 0x0F) + THRESHOLD)
 
-                for _ in range(length):
-                    b = window[position & WINDOW_MASK]
-                    output.append(b)
-                    window[window_cursor] = b
-                    window_cursor = (window_cursor + 1) & WINDOW_MASK
-                    position += 1
+            flag >>= 1
+            bits -= 1
 
-    return bytes(output)
+        self._flag = flag
+        self._bits = bits
+
+        return cur_byte
+
+    def getvalue(self) -> bytes:
+        return bytes(memoryview(self._output)[: self._length])
+
+
+def lz77_decode(data: bytes, size_hint: int = 0) -> bytes:
+    decoder = Lz77Decoder(size_hint)
+    decoder.feed(data)
+
+    return decoder.getvalue()
@@ -0,0 +1,98 @@
+import os
+import random
+import time
+
+from utils.lz77 import Lz77Decoder, lz77_decode, lz77_encode
+
+
+def sample_payloads():
+    rng = random.Random(573)
+    xml = "".join(
+        f'<m mid="{i}" clflg="{rng.randint(0, 7)}" score="{rng.randint(0, 4000)}"/>\n'
+        for i in range(4000)
+    ).encode()
+    return {
+        "empty": b"",
+        "one": b"\x00",
+        "seven": b"abcdefg",
+        "eight": b"abcdefgh",
+        "zeros": bytes(5000),
+        "run": b"a" * 1000 + b"b" * 17 + b"a" * 19,
+        "random": os.urandom(20000),
+        "xml": xml,
+    }
+
+
+def test_lz77_roundtrip():
+    for name, payload in sample_payloads().items():
+        assert lz77_decode(lz77_encode(payload)) == payload, name
+
+
+def test_lz77_decode_streaming():
+    rng = random.Random(8)
+    for name, payload in sample_payloads().items():
+        encoded = lz77_encode(payload)
+        for size_hint in (0, len(payload), len(payload) * 2):
+            decoder = Lz77Decoder(size_hint)
+            offset = 0
+            while offset < len(encoded):
+                step = rng.randint(1, 64)
+                decoder.feed(memoryview(encoded)[offset : offset + step])
+                offset += step
+            assert decoder.finished, name
+            assert decoder.getvalue() == payload, name
+
+
+def test_lz77_decode_zero_window():
+    # back references before the start of the stream read zeros
+    encoded = bytes([0b10, 0x00, 0x55, ord("x"), 0x00, 0x00])
+    assert lz77_decode(encoded) == b"\x00" * 8 + b"x"
+
+    # partly before it: the zeros repeat along with the bytes after them
+    encoded = bytes([0b11, ord("a"), ord("b"), 0x00, 0x47, 0x00, 0x00])
+    assert lz77_decode(encoded) == b"ab" + b"\x00\x00ab" * 2 + b"\x00\x00"
+
+    # distance 0 is the whole window back
+    window = bytes(range(256)) * 16
+    encoded = b"".join(b"\xff" + window[i : i + 8] for i in range(0, 4096, 8))
+    encoded += bytes([0b0, 0x00, 0x01, 0x00, 0x00])
+    assert lz77_decode(encoded) == window + window[:4]
+
+
+def test_lz77_compresses():
+    xml = sample_payloads()["xml"]
+    assert len(lz77_encode(xml)) < len(xml) // 2
+
+
+def test_lz77_throughput():
+    xml = sample_payloads()["xml"]
+    while len(xml) < 100 * 1024:
+        xml += xml
+    start = time.perf_counter()
+    encoded = lz77_encode(xml)
+    elapsed = time.perf_counter() - start
+    assert lz77_decode(encoded) == xml
+    # the brute force encoder needed tens of seconds for this
+    assert elapsed < 5
+
+
+if __name__ == "__main__":
+    test_lz77_roundtrip()
+    test_lz77_compresses()
+
+    for name, payload in sample_payloads().items():
+        if len(payload) < 1024:
+            continue
+        while len(payload) < 100 * 1024:
+            payload += payload
+        start = time.perf_counter()
+        encoded = lz77_encode(payload)
+        encode_time = time.perf_counter() - start
+        start = time.perf_counter()
+        lz77_decode(encoded)
+        decode_time = time.perf_counter() - start
+        print(
+            f"{name:>8}: {len(payload)} -> {len(encoded)} bytes, "
+            f"encode {len(payload) / encode_time / 1024:.0f} KB/s, "
+            f"decode {len(payload) / decode_time / 1024:.0f} KB/s"
+        )
@@ -0,0 +1,77 @@
+import io
+import json
+import os
+import random
+import tempfile
+import time
+
+from utils.db.stream_db import JSONStream, main
+
+
+def sample_db():
+    rng = random.Random(573)
+    now = time.time()
+    return {
+        "iidx_profile": {
+            str(i): {"card": f"E004{i:012X}", "iidx_id": i, "djname": "ＤＪ　\"x\"\\"}
+            for i in range(1, 50)
+        },
+        "empty": {},
+        "iidx_scores": {
+            str(i): {
+                "iidx_id": rng.randint(1, 49),
+                "timestamp": now - rng.randint(0, 3 * 365) * 86400,
+                "game_version": rng.choice((29, 30, 31)),
+                "ex_score": rng.random() * 1e6,
+                "ghost": os.urandom(rng.randint(0, 64)).hex(),
+                "nested": [{"a": None, "b": [True, False, -1.5e-3]}],
+            }
+            for i in range(1, 500)
+        },
+        "ddr_scores": {
+            str(i): {"timestamp": now - 400 * 86400, "game_version": 19}
+            for i in range(1, 4)
+        },
+        "ddr_scores_best": {"1": {"ghostid": 2}},
+    }
+
+
+def test_stream_matches_json_load():
+    db = sample_db()
+    for indent in (None, 2):
+        text = json.dumps(db, indent=indent, ensure_ascii=False)
+        for chunk_size in (1, 7, 1024):
+            parsed = {}
+            for table, doc_id, document in JSONStream(io.StringIO(text), chunk_size).documents():
+                parsed.setdefault(table, {})[doc_id] = document
+            assert parsed == {k: v for k, v in db.items() if v}
+    assert list(JSONStream(io.StringIO("{}")).documents()) == []
+
+
+def test_prune():
+    db = sample_db()
+    with tempfile.TemporaryDirectory() as tmp:
+        infile = os.path.join(tmp, "db.json")
+        outfile = os.path.join(tmp, "out.json")
+        with open(infile, "w", encoding="utf-8") as fp:
+            json.dump(db, fp, indent=2, ensure_ascii=False)
+
+        main(infile, outfile, "json", 365, [29], None)
+        with open(outfile, encoding="utf-8") as fp:
+            out = json.load(fp)
+
+        assert out["iidx_profile"] == db["iidx_profile"]
+        cutoff = time.time() - 365 * 86400
+        assert out["iidx_scores"] == {
+            doc_id: score
+            for doc_id, score in db["iidx_scores"].items()
+            if score["timestamp"] >= cutoff and score["game_version"] != 29
+        }
+        # ghost of a DDR best score survives
+        assert list(out["ddr_scores"]) == ["2"]
+
+
+if __name__ == "__main__":
+    test_stream_matches_json_load()
+    test_prune()
+    print("ok")